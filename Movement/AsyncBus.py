@@ -0,0 +1,178 @@
+#!/usr/bin/python3
+# encoding: utf-8
+# Copyright ians.moyes@gmail.com
+
+# asyncio front-end for the Raspberry Pi expansion board servo bus.
+# Replies are collected by the event loop from the UART file descriptor & matched to the
+# request waiting for them, so other coroutines run while the servo answers.
+
+import asyncio # Standard asynchronous I/O library
+import os # Standard operating system interface
+import BusCapture # Bus traffic capture file format
+import weakref # Standard library of weak references
+import RPiExpCom as Ctrl # Raspberry Pi expansion board communication driver
+
+class Async_Bus():
+    ''' This is a class to carry out servo bus transactions from an asyncio event loop
+    Only one transaction is on each bus at a time, they're half duplex. Each bus is shared
+    with threads using RPiExpCom directly through the lock of its RPiExpCom.Serial_Bus.
+    Transactions on different buses run at the same time
+    '''
+    lock_poll = 0.0005 # How often to retry for the bus when another thread has it, in seconds
+
+    def __init__(self, pi):
+        self.pi = pi # Attach the bus to the Raspberry Pi
+        self.loop = asyncio.get_running_loop() # The event loop the bus belongs to
+        self.locks = {bus: asyncio.Lock() for bus in Ctrl.buses} # One coroutine on each bus at a time
+        self.waiting = {} # Replies being waited for. (id, command): Future
+
+    async def acquire(self, bus):
+        '''
+        Wait for a bus without blocking the event loop
+        :param bus: RPiExpCom.Serial_Bus
+        '''
+
+        await self.locks[bus].acquire() # First in the queue of coroutines
+        try:
+            while not bus.lock.acquire(blocking=False, task=asyncio.current_task()): # Then wait for other threads
+                await asyncio.sleep(Async_Bus.lock_poll)
+        except BaseException: # Cancelled, e.g. by asyncio.wait_for. Let the next coroutine have it
+            self.locks[bus].release()
+            raise
+
+    def release(self, bus):
+        '''
+        Hand a bus back
+        '''
+
+        bus.lock.release()
+        self.locks[bus].release()
+
+    def on_readable(self, bus): # Called by the event loop when the UART has data
+        try:
+            data = os.read(bus.uart.fileno(), 256) # Only what has arrived, this won't block
+        except BlockingIOError:
+            return
+        bus.parser.feed(data)
+        self.match_replies(bus)
+
+    def match_replies(self, bus):
+        '''
+        Hand any complete replies to the requests waiting for them
+        '''
+
+        while bus.parser.frames:
+            id, cmd, params = bus.parser.frames.popleft()
+            future = self.waiting.get((id, cmd))
+            if future is not None and not future.done() and len(params) + 3 == Ctrl.config.BS_reply_lengths[cmd - 1]:
+                future.set_result(Ctrl.decode_params(params))
+
+    async def write_cmd(self, id, w_cmd, dat1=None, dat2=None):
+        '''
+        Send a servo command. See RPiExpCom.serial_servo_write_cmd
+        :return: True = Success or error code
+        '''
+
+        result = True
+        for bus in (Ctrl.buses if id == Ctrl.config.BS_broadcast_id else (Ctrl.bus_for(id),)):
+            await self.acquire(bus)
+            try:
+                msg = bus.write_cmd(self.pi, id, w_cmd, dat1, dat2)
+            finally:
+                self.release(bus)
+            if result == True: result = msg # Report the first failure. A broadcast still goes to every bus
+        return result
+
+    async def write_many(self, cmds):
+        '''
+        Send several servo commands in one transmission on each bus. See RPiExpCom.serial_servo_write_many
+        :return: True = Success or error code
+        '''
+
+        for bus, share in Ctrl.split_cmds(cmds).items():
+            await self.acquire(bus)
+            try:
+                result = bus.write_many(self.pi, share)
+            finally:
+                self.release(bus)
+            if result != True: return result
+        return True
+
+    async def read_cmd(self, id, r_cmd):
+        '''
+        Send request for data to a servo & wait for the result without blocking the event loop
+        :param id: servo_id to be interrogated
+        :param r_cmd: The servo command to be responded to
+        :return: Data returned from the servo or "Comms"
+        '''
+
+        stats = Ctrl.get_latency(id, r_cmd) # How quickly this servo usually answers
+        timeout = stats.timeout # Time for the servo to answer & the reply to arrive
+        give_up = self.loop.time() + Ctrl.READ_TIMEOUT # Never longer than 1 second
+        bus = Ctrl.bus_for(id) # The bus the servo is on
+        await self.acquire(bus)
+        fd = bus.uart.fileno()
+        try:
+            for attempt in range(stats.attempts): # A few times, unless the servo isn't answering
+                if self.loop.time() >= give_up: break
+                future = self.loop.create_future() # Somewhere for the reply to go
+                self.waiting[(id, r_cmd)] = future
+                bus.write_cmd(self.pi, id, r_cmd) # Send the request
+                bus.uart.flush() # Wait until the request has left the UART, a few hundred µS
+                bus.portRead(self.pi) # Switch UART to read mode
+                sent = self.loop.time() # Start timing the reply
+                self.match_replies(bus) # The reply may already be in the parser
+                self.loop.add_reader(fd, self.on_readable, bus) # Collect the reply as it arrives
+                try:
+                    result = await asyncio.wait_for(future, timeout)
+                    bus.busy += self.loop.time() - sent # The bus was tied up until the reply arrived
+                    stats.add(self.loop.time() - sent) # Record how long it took
+                    return result
+                except asyncio.TimeoutError: # No reply, ask again
+                    bus.busy += timeout
+                    stats.timeouts += 1
+                    if Ctrl.capture is not None:
+                        Ctrl.capture.record(BusCapture.EVENT, BusCapture.TIMEOUT, bytes((id, r_cmd)))
+                finally:
+                    self.loop.remove_reader(fd)
+                    del self.waiting[(id, r_cmd)]
+            stats.failures += 1
+            if Ctrl.capture is not None: Ctrl.capture.record(BusCapture.EVENT, BusCapture.FAILED, bytes((id, r_cmd)))
+        finally:
+            self.release(bus)
+        return "Comms" # If it just didn't work, report
+
+buses = weakref.WeakKeyDictionary() # One bus per event loop
+
+def get_bus(pi):
+    '''
+    Find or create the bus for the running event loop
+    :return: Async_Bus
+    '''
+
+    loop = asyncio.get_running_loop()
+    bus = buses.get(loop)
+    if bus is None:
+        bus = buses[loop] = Async_Bus(pi)
+    return bus
+
+async def read_cmd(pi, id, r_cmd): # Shortcuts to the bus for the running event loop
+    return await get_bus(pi).read_cmd(id, r_cmd)
+
+async def write_cmd(pi, id, w_cmd, dat1=None, dat2=None):
+    return await get_bus(pi).write_cmd(id, w_cmd, dat1, dat2)
+
+async def write_many(pi, cmds):
+    return await get_bus(pi).write_many(cmds)
+
+if __name__ == '__main__':
+    import pigpio # Standard Raspberry Pi GPIO library
+    pi = pigpio.pi() # Create a Raspberry Pi object
+    Ctrl.portinit(pi) # Initialise the read/write switch
+
+    async def main():
+        for id in range(1, Ctrl.config.BS_num_servos + 1): # For every servo
+            print("Servo", id, "position", await read_cmd(pi, id, Ctrl.config.BS_POS_READ))
+
+    asyncio.run(main())
+    print("Async bus tests complete!")
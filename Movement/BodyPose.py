@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+# encoding: utf-8
+# Copyright ians.moyes@gmail.com
+
+# Body pose inverse kinematics. Moves & tilts the body while the feet stay where they are on
+# the ground. e.g. to keep the body level on a slope, or to lean into a turn.
+# Angles are in radians. Roll is port side up, pitch is nose down & yaw is turning to port.
+# Offsets are in mm, in the body frame of ForwardKin. X forward, Y to port, Z up.
+#
+#     positions, reachable = solve(pitch=0.1, z=10) # Nose down & 10mm taller
+#     move(pi, pitch=0.1, z=10, tim=500)
+
+import importlib # Standard library to import modules by name
+import numpy as np # Numerical array library
+import config # Bus Servo protocol definitions & hexapod geometry
+import ForwardKin as FK # Forward kinematics & the body frame
+from SerialServoClass import Serial_Servo as Servo # Bus Serial Servo control class
+
+IK = importlib.import_module("2DIK") # Inverse kinematics. The name starts with a digit
+
+def stance(pos=config.HX_stand_pos):
+    '''
+    Body frame feet of a posture in which every leg has the same toe coordinates
+    :param pos: toe coordinates from each shoulder. e.g. Hexapod.stand_pos or Hexapod.tall_pos
+    :return: array [6, 3] of foot coordinates in the body frame
+    '''
+
+    return FK.leg_to_body(np.tile(np.asarray(pos, dtype=float), (6, 1)))
+
+def rotation(roll=0.0, pitch=0.0, yaw=0.0):
+    '''
+    :return: array [..., 3, 3] rotation matrix of the body. Yaw, then pitch, then roll
+    '''
+
+    roll, pitch, yaw = np.broadcast_arrays(roll, pitch, yaw) # Many poses, or just 1
+    cr, sr = np.cos(roll), np.sin(roll)
+    cp, sp = np.cos(pitch), np.sin(pitch)
+    cy, sy = np.cos(yaw), np.sin(yaw)
+    return np.stack((np.stack((cy * cp, cy * sp * sr - sy * cr, cy * sp * cr + sy * sr), axis=-1),
+                     np.stack((sy * cp, sy * sp * sr + cy * cr, sy * sp * cr - cy * sr), axis=-1),
+                     np.stack((-sp, cp * sr, cp * cr), axis=-1)), axis=-2)
+
+def pose_feet(feet, roll=0.0, pitch=0.0, yaw=0.0, x=0.0, y=0.0, z=0.0):
+    '''
+    Where planted feet are, seen from the body after it has moved
+    :param feet: array [6, 3] of foot coordinates in the body frame before it moves
+    :param roll, pitch, yaw: body rotation in radians. Numbers or arrays, for many poses at once
+    :param x, y, z: body offset in mm
+    :return: array [..., 6, 3] of foot coordinates in the moved body frame
+    '''
+
+    matrix = rotation(roll, pitch, yaw)
+    offset = np.stack(np.broadcast_arrays(x, y, z), axis=-1)[..., np.newaxis, :]
+    # Undo the move. Row vectors, so multiplying by the matrix is rotating by its inverse
+    return (np.asarray(feet, dtype=float) - offset) @ matrix
+
+def solve(roll=0.0, pitch=0.0, yaw=0.0, x=0.0, y=0.0, z=0.0, feet=None):
+    '''
+    Servo positions to put the body in a pose with the feet planted
+    :param roll, pitch, yaw: body rotation in radians. Numbers or arrays, for many poses at once
+    :param x, y, z: body offset in mm
+    :param feet: array [6, 3] of foot coordinates in the body frame. Default the standing posture
+    :return: (positions, reachable) as 2DIK.inverse_kin_batch
+    '''
+
+    if feet is None: feet = stance()
+    return IK.inverse_kin_batch(FK.body_to_leg(pose_feet(feet, roll, pitch, yaw, x, y, z)))
+
+def move(pi, roll=0.0, pitch=0.0, yaw=0.0, x=0.0, y=0.0, z=0.0, tim=500, feet=None):
+    '''
+    Put the body in a pose, every joint in one transmission on each bus
+    :param pi: the Raspberry Pi
+    :param tim: time to reach the pose in mS
+    Other parameters as solve
+    :return: True = Success or error code
+    '''
+
+    positions, reachable = solve(roll, pitch, yaw, x, y, z, feet)
+    if not reachable.all(): return "Position too far" # Like inverse_kin, nothing is sent
+    if not IK.in_range_batch(positions, config.BS_rotate_limits).all(): return "Position out of range"
+    return Servo.write_many(pi, [(leg * 3 + joint + 1, Servo.MOVE_TIME_WRITE, int(positions[leg, joint]), tim)
+                                 for leg in range(6) for joint in range(3)])
+
+if __name__ == '__main__':
+    import time # Standard library of time, diary & calendar functions
+    start = time.perf_counter()
+    for n in range(1000): solve(0.05, -0.1, 0.1, 5, 0, 10)
+    print("%.3f mS per pose" % (time.perf_counter() - start))
+    positions, reachable = solve(roll=np.linspace(-0.3, 0.3, 7)) # 7 poses at once
+    print("Roll -0.3 ~ 0.3 reachable\n", reachable)
+    feet = FK.forward_kin(solve(pitch=0.1, z=10)[0]) # Check with forward kinematics
+    print("Feet moved %.1f mm" % np.abs(pose_feet(stance(), pitch=0.1, z=10) - feet).max())
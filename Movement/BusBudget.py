@@ -0,0 +1,220 @@
+#!/usr/bin/python3
+# encoding: utf-8
+# Copyright ians.moyes@gmail.com
+
+# Class to plan the use of the servo buses.
+# Every periodic job the robot does on the bus is costed from the sizes of its frames, so a
+# schedule that asks for more bus time than there is can be slowed down or turned away before
+# it shows up as "Comms" errors.
+
+import time # Standard library of time, diary & calendar functions
+import config # Bus Servo protocol definitions
+import RPiExpCom as Ctrl # Raspberry Pi expansion board communication driver
+
+def data_length(num_params):
+    '''
+    :param num_params: number of parameters of a command, from config.BS_num_params
+    :return: data length of the frame (excluding frame header & checksum)
+    '''
+
+    return (3, 4, 7)[num_params] # 1 parameter is a byte, 2 parameters are 16 bits each
+
+def write_time(w_cmd):
+    '''
+    :param w_cmd: servo command
+    :return: time to transmit the command, in seconds
+    '''
+
+    return Ctrl.frame_time(data_length(config.BS_num_params[w_cmd - 1]))
+
+def read_time(r_cmd, id=None):
+    '''
+    Time the bus is tied up by a read: the request, the servo's delay in answering & the reply
+    :param r_cmd: servo read command
+    :param id: servo ID. If its replies have been timed the measured latency is used
+    :return: time in seconds
+    '''
+
+    stats = Ctrl.latency.get((id, r_cmd))
+    if stats is not None and stats.samples: reply = stats.percentile(50) # Measured
+    else: reply = Ctrl.reply_timeout(r_cmd) # Allowance from the frame size
+    return write_time(r_cmd) + reply
+
+def trinket_time(colours=3):
+    '''
+    :param colours: bytes of colour data in the frame
+    :return: time to transmit a TrinketM0 LED frame, in seconds
+    '''
+
+    # Header, ID, colour, checksum & line end, each a start bit, 8 data bits & a stop bit
+    return (len(Ctrl.TRINKET_FRAME_HEADER) + 1 + colours + 2) * Ctrl.BITS_PER_BYTE / Ctrl.BAUD_RATE
+
+class Bus_Task():
+    ''' This is a class to define a job that uses the bus at a regular rate.
+    The cost is the bus time each run of the task takes on each bus
+    '''
+
+    def __init__(self, name, rate, min_rate=None, priority=1):
+        '''
+        :param name: name to report the task by
+        :param rate: runs per second
+        :param min_rate: slowest the task may be run, or None if it can't be slowed down
+        :param priority: tasks with higher numbers are slowed down first
+        '''
+
+        self.name = name
+        self.rate = rate
+        self.requested = rate # The rate asked for, before any down-sampling
+        self.min_rate = rate if min_rate is None else min_rate
+        self.priority = priority
+        self.cost = {} # Serial_Bus: seconds per run
+
+    def add(self, bus, seconds):
+        self.cost[bus] = self.cost.get(bus, 0.0) + seconds
+
+    def writes(self, cmds):
+        '''
+        Add servo write commands sent on each run
+        :param cmds: sequence of (id, w_cmd) tuples. Broadcasts are sent on every bus
+        :return: self, so calls can be chained
+        '''
+
+        for id, w_cmd in cmds:
+            for bus in (Ctrl.buses if id == config.BS_broadcast_id else (Ctrl.bus_for(id),)):
+                self.add(bus, write_time(w_cmd))
+        return self
+
+    def reads(self, requests):
+        '''
+        Add servo read commands made on each run
+        :param requests: sequence of (id, r_cmd) tuples
+        :return: self, so calls can be chained
+        '''
+
+        for id, r_cmd in requests: self.add(Ctrl.bus_for(id), read_time(r_cmd, id))
+        return self
+
+    def lights(self, frames, colours=3):
+        '''
+        Add TrinketM0 LED frames sent on each run
+        :return: self, so calls can be chained
+        '''
+
+        self.add(Ctrl.bus, frames * trinket_time(colours))
+        return self
+
+    def utilisation(self, bus):
+        '''
+        :return: share of the bus time the task uses at its current rate
+        '''
+
+        return self.rate * self.cost.get(bus, 0.0)
+
+class Bus_Budget():
+    ''' This is a class to define the schedule of periodic tasks on the servo buses.
+    Tasks are admitted while every bus stays within its capacity. If a new task doesn't fit,
+    tasks that allow it are slowed down, lowest priority first. If it still doesn't fit it's rejected
+    '''
+
+    def __init__(self, capacity=0.7):
+        '''
+        :param capacity: share of each bus's time that may be planned. The rest is left for retries
+                         & one-off transactions
+        '''
+
+        self.capacity = capacity
+        self.tasks = []
+        self.last = {bus: (time.monotonic(), bus.busy) for bus in Ctrl.buses} # For live utilisation
+
+    def projected(self, bus=None):
+        '''
+        :param bus: RPiExpCom.Serial_Bus or None for every bus
+        :return: share of the bus time the schedule uses, or dictionary of Serial_Bus: share
+        '''
+
+        if bus is not None: return sum(task.utilisation(bus) for task in self.tasks)
+        return {bus: self.projected(bus) for bus in Ctrl.buses}
+
+    def admit(self, task):
+        '''
+        Add a task to the schedule, slowing down other tasks if they allow it
+        :param task: Bus_Task
+        :return: True = admitted or error code
+        '''
+
+        rates = [(t, t.rate) for t in self.tasks] # To put back if the task is rejected
+        self.tasks.append(task)
+        for bus in task.cost:
+            # Slow down the lowest priority tasks first, as little as possible
+            for t in sorted(self.tasks, key=lambda t: -t.priority):
+                excess = self.projected(bus) - self.capacity
+                if excess <= 0: break
+                if t.cost.get(bus, 0.0) > 0 and t.rate > t.min_rate:
+                    t.rate = max(t.min_rate, t.rate - excess / t.cost[bus])
+            if self.projected(bus) > self.capacity: # Still doesn't fit
+                self.tasks.remove(task)
+                for t, rate in rates: t.rate = rate
+                task.rate = task.requested # As it was before it was offered
+                return "Over budget"
+        return True
+
+    def remove(self, task):
+        '''
+        Take a task off the schedule. Tasks that were slowed down get back as much rate as now fits
+        '''
+
+        self.tasks.remove(task)
+        for t in sorted(self.tasks, key=lambda t: t.priority):
+            for bus, cost in t.cost.items():
+                if cost > 0 and t.rate < t.requested:
+                    spare = self.capacity - self.projected(bus)
+                    t.rate = min(t.requested, t.rate + max(spare, 0.0) / cost)
+
+    def live(self):
+        '''
+        Measure the share of each bus's time actually used since the last call
+        :return: dictionary of Serial_Bus: share
+        '''
+
+        now = time.monotonic()
+        result = {}
+        for bus in Ctrl.buses:
+            then, busy = self.last.get(bus, (now, bus.busy))
+            result[bus] = (bus.busy - busy) / (now - then) if now > then else 0.0
+            self.last[bus] = (now, bus.busy)
+        return result
+
+    def report(self):
+        '''
+        Print the schedule, the projected & live utilisation of each bus
+        :return: True if every bus is within its capacity
+        '''
+
+        live = self.live()
+        ok = True
+        for bus in Ctrl.buses:
+            projected = self.projected(bus)
+            print("Bus", bus.port, "projected %.1f%%  live %.1f%%  capacity %.1f%%" % (100 * projected,
+                  100 * live[bus], 100 * self.capacity))
+            if live[bus] > self.capacity:
+                print("WARNING bus", bus.port, "is over-subscribed. Expect Comms errors")
+                ok = False
+            for task in self.tasks:
+                if task.cost.get(bus):
+                    print("    %-20s %6.1f Hz (asked for %.1f)  %.1f%%" % (task.name, task.rate, task.requested,
+                          100 * task.utilisation(bus)))
+        return ok
+
+if __name__ == '__main__':
+    ids = range(1, config.BS_num_servos + 1)
+    budget = Bus_Budget()
+    pose = Bus_Task("Pose writes", 30, priority=0).writes([(id, config.BS_MOVE_TIME_WRITE) for id in ids])
+    print("Pose writes", budget.admit(pose))
+    telemetry = Bus_Task("Telemetry", 10, min_rate=1, priority=2).reads([(id, r_cmd) for id in ids
+                for r_cmd in (config.BS_TEMP_READ, config.BS_VIN_READ, config.BS_POS_READ)])
+    print("Telemetry", budget.admit(telemetry))
+    lights = Bus_Task("LEDs", 20, min_rate=5, priority=1).lights(13)
+    print("LEDs", budget.admit(lights))
+    greedy = Bus_Task("Position stream", 100).reads([(id, config.BS_POS_READ) for id in ids])
+    print("Position stream", budget.admit(greedy))
+    budget.report()
@@ -0,0 +1,234 @@
+#!/usr/bin/python3
+# encoding: utf-8
+# Copyright ians.moyes@gmail.com
+
+# Recording & replay of the traffic on the Raspberry Pi expansion board servo bus.
+# Recording is switched on with RPiExpCom.start_capture(path). Every frame sent & received
+# is appended to the file as it happens. From the command line:
+#     python3 BusCapture.py summary capture.bin
+#     python3 BusCapture.py replay capture.bin [--emulator] [--speed 2]
+#
+# File format. All numbers are little endian
+#     File header:   6 bytes "SPBUS1", 4 byte unsigned baud rate
+#     Each record:   8 byte float time.monotonic(), 1 byte direction, 1 byte result,
+#                    2 byte unsigned length, then length raw bytes
+
+import argparse # Standard command line argument library
+import struct # Standard library to convert numbers to bytes
+import threading # Standard multi-tasking library
+import time # Standard library of time, diary & calendar functions
+import config # Bus Servo protocol definitions
+
+MAGIC = b"SPBUS1" # Identifies a capture file
+FILE_HEADER = struct.Struct("<6sI") # Magic & baud rate
+RECORD_HEADER = struct.Struct("<dBBH") # Time, direction, result & length
+
+# Directions
+TX = 0 # Sent by the Raspberry Pi
+RX = 1 # Received from the bus
+EVENT = 2 # Something that happened, not bytes on the wire. Raw bytes are (id, command)
+
+# Results
+OK = 0 # A valid Bus Servo frame
+BAD_CHECKSUM = 1 # A frame whose checksum didn't match
+BAD_LENGTH = 2 # A header followed by an impossible length
+JUNK = 3 # Bytes thrown away while looking for a header
+TRINKET = 4 # A TrinketM0 LED frame
+TIMEOUT = 5 # A read attempt got no reply
+FAILED = 6 # A read gave up & returned "Comms"
+
+direction_names = ("TX", "RX", "EVENT")
+result_names = ("OK", "BAD_CHECKSUM", "BAD_LENGTH", "JUNK", "TRINKET", "TIMEOUT", "FAILED")
+
+class Capture_Writer():
+    ''' This is a class to append bus traffic records to a capture file.
+    Records can be written from any thread
+    '''
+
+    def __init__(self, path, baud_rate):
+        '''
+        :param path: capture file. Appended to if it already exists
+        :param baud_rate: baud rate of the bus, for working out utilisation
+        '''
+
+        self.file = open(path, "ab")
+        if self.file.tell() == 0: self.file.write(FILE_HEADER.pack(MAGIC, baud_rate)) # New file
+        self.lock = threading.Lock()
+        self.records = 0 # Records written
+
+    def record(self, direction, result, data):
+        '''
+        Append a record, time stamped now
+        :param direction: TX, RX or EVENT
+        :param result: OK, BAD_CHECKSUM etc.
+        :param data: raw bytes
+        '''
+
+        header = RECORD_HEADER.pack(time.monotonic(), direction, result, len(data))
+        with self.lock:
+            self.file.write(header)
+            self.file.write(data)
+            self.records += 1
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+def read_capture(path):
+    '''
+    Read a capture file
+    :return: (baud rate, list of (time, direction, result, raw bytes))
+    '''
+
+    with open(path, "rb") as file:
+        data = file.read()
+    magic, baud_rate = FILE_HEADER.unpack_from(data, 0)
+    if magic != MAGIC: raise ValueError(path + " is not a bus capture file")
+    records = []
+    offset = FILE_HEADER.size
+    while offset + RECORD_HEADER.size <= len(data):
+        t, direction, result, length = RECORD_HEADER.unpack_from(data, offset)
+        offset += RECORD_HEADER.size
+        if offset + length > len(data): break # Cut short while it was being written
+        records.append((t, direction, result, data[offset:offset + length]))
+        offset += length
+    return baud_rate, records
+
+def is_read_request(raw):
+    '''
+    :param raw: a Bus Servo frame
+    :return: True if it's a request the servo answers
+    '''
+
+    return raw[3] == 3 and raw[2] != config.BS_broadcast_id and config.BS_reply_lengths[raw[4] - 1] > 0
+
+def summarise(baud_rate, records):
+    '''
+    Work out the bus statistics of a capture
+    :return: Dictionary of totals & a dictionary of statistics for each servo
+    '''
+
+    servos = {}
+    def servo(id):
+        if id not in servos:
+            servos[id] = {"tx":0, "rx":0, "reads":0, "retries":0, "timeouts":0, "failures":0, "corrupt":0}
+        return servos[id]
+
+    totals = {"records":len(records), "tx_frames":0, "rx_frames":0, "bytes":0, "corrupt":0, "junk_bytes":0}
+    last_timeout = None # (id, command) of the last read attempt that timed out
+    for t, direction, result, raw in records:
+        if direction == EVENT:
+            if result == TIMEOUT:
+                servo(raw[0])["timeouts"] += 1
+                last_timeout = (raw[0], raw[1])
+            elif result == FAILED:
+                servo(raw[0])["failures"] += 1
+                last_timeout = None
+            continue
+        totals["bytes"] += len(raw) if result in (OK, TRINKET, JUNK) else 0 # Corrupt frames are parsed again
+        if result == JUNK: totals["junk_bytes"] += len(raw)
+        elif result in (BAD_CHECKSUM, BAD_LENGTH):
+            totals["corrupt"] += 1
+            if len(raw) > 2: servo(raw[2])["corrupt"] += 1
+        elif result == OK:
+            stats = servo(raw[2])
+            if direction == TX:
+                totals["tx_frames"] += 1
+                stats["tx"] += 1
+                if is_read_request(raw):
+                    if last_timeout == (raw[2], raw[4]): stats["retries"] += 1 # Asking again
+                    else: stats["reads"] += 1
+                    last_timeout = None
+            else:
+                totals["rx_frames"] += 1
+                stats["rx"] += 1
+        elif result == TRINKET: totals["tx_frames"] += 1
+
+    wire = [r for r in records if r[1] != EVENT]
+    span = wire[-1][0] - wire[0][0] if len(wire) > 1 else 0.0
+    totals["duration"] = span
+    totals["frames_per_second"] = (totals["tx_frames"] + totals["rx_frames"]) / span if span else 0.0
+    # Each byte is a start bit, 8 data bits & a stop bit
+    totals["utilisation"] = totals["bytes"] * 10 / baud_rate / span if span else 0.0
+    for stats in servos.values():
+        attempts = stats["reads"] + stats["retries"]
+        stats["timeout_rate"] = stats["timeouts"] / attempts if attempts else 0.0
+        stats["failure_rate"] = stats["failures"] / stats["reads"] if stats["reads"] else 0.0
+    return totals, servos
+
+def replay(pi, records, speed=1.0):
+    '''
+    Send the frames of a capture to the bus again, with the same spacing in time.
+    Read requests are sent one attempt at a time, so retries happen as they did when captured
+    :param pi: the Raspberry Pi
+    :param records: records from read_capture
+    :param speed: 2 = twice as fast as captured
+    :return: Dictionary of frames sent, replies & timeouts
+    '''
+
+    import RPiExpCom as Ctrl # Raspberry Pi expansion board communication driver
+
+    counts = {"writes":0, "reads":0, "replies":0, "timeouts":0, "trinket":0}
+    sent = [r for r in records if r[1] == TX and r[2] in (OK, TRINKET)]
+    if not sent: return counts
+    start = time.monotonic()
+    first = sent[0][0]
+    for t, direction, result, raw in sent:
+        wait = start + (t - first) / speed - time.monotonic() # Keep the original spacing
+        if wait > 0: time.sleep(wait)
+        if result == TRINKET: # Header, ID, colour, checksum & line end
+            Ctrl.TrinketM0_write_data(raw[2], raw[3:-2])
+            counts["trinket"] += 1
+            continue
+        id, cmd, params = raw[2], raw[4], raw[5:-1]
+        if is_read_request(raw):
+            counts["reads"] += 1
+            if Ctrl.serial_servo_read_attempt(pi, id, cmd, Ctrl.get_latency(id, cmd).timeout) is None:
+                counts["timeouts"] += 1
+            else: counts["replies"] += 1
+            continue
+        if len(params) == 4: # Two 16 bit parameters, or 4 bytes that encode the same way
+            Ctrl.serial_servo_write_cmd(pi, id, cmd, params[0] | (params[1] << 8), params[2] | (params[3] << 8))
+        elif len(params) == 1: Ctrl.serial_servo_write_cmd(pi, id, cmd, params[0])
+        else: Ctrl.serial_servo_write_cmd(pi, id, cmd)
+        counts["writes"] += 1
+    return counts
+
+def print_summary(totals, servos):
+    print("Duration %.3f s  frames %d sent %d received  %.1f frames/s  utilisation %.1f%%" % (
+          totals["duration"], totals["tx_frames"], totals["rx_frames"], totals["frames_per_second"],
+          100 * totals["utilisation"]))
+    print("Corrupt frames %d  junk bytes %d" % (totals["corrupt"], totals["junk_bytes"]))
+    print("Servo  sent  recv  reads  retries  timeouts  failures  corrupt  timeout%  failure%")
+    for id in sorted(servos):
+        s = servos[id]
+        print("%5d %5d %5d %6d %8d %9d %9d %8d %8.1f %9.1f" % (id, s["tx"], s["rx"], s["reads"],
+              s["retries"], s["timeouts"], s["failures"], s["corrupt"], 100 * s["timeout_rate"],
+              100 * s["failure_rate"]))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Servo bus capture tool")
+    parser.add_argument("action", choices=("summary", "replay"))
+    parser.add_argument("path", help="capture file")
+    parser.add_argument("--emulator", action="store_true", help="replay against ServoEmulator")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed. 2 = twice as fast")
+    parser.add_argument("--record", help="capture the replay to this file")
+    args = parser.parse_args()
+
+    baud_rate, records = read_capture(args.path)
+    if args.action == "summary":
+        print_summary(*summarise(baud_rate, records))
+    else:
+        if args.emulator:
+            import ServoEmulator # Software Bus Servos
+            pi = ServoEmulator.install().pi
+        else:
+            import pigpio # Standard Raspberry Pi GPIO library
+            pi = pigpio.pi() # Create a Raspberry Pi object
+        import RPiExpCom as Ctrl # Raspberry Pi expansion board communication driver
+        Ctrl.portinit(pi) # Initialise the read/write switch
+        if args.record: Ctrl.start_capture(args.record)
+        print(replay(pi, records, args.speed))
+        if args.record:
+            Ctrl.stop_capture()
+            print_summary(*summarise(*read_capture(args.record)))
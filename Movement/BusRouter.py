@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+# encoding: utf-8
+# Copyright ians.moyes@gmail.com
+
+# Class to spread servo transactions across several UARTs.
+# Each bus in config.BS_buses gets its own Bus_Worker thread, so reads & writes to servos
+# on different buses happen at the same time.
+
+import BusWorker # Bus owner thread & transaction priorities
+import RPiExpCom as Ctrl # Raspberry Pi expansion board communication driver
+
+class Bus_Router():
+    ''' This is a class to send each servo transaction to the worker of the bus the servo is on.
+    Commands for several servos are shared out & the workers carry them out in parallel
+    '''
+
+    def __init__(self, pi, buses=None):
+        '''
+        :param pi: the Raspberry Pi
+        :param buses: RPiExpCom.Serial_Bus objects to use. Default every bus in config.BS_buses
+        '''
+
+        self.pi = pi # Attach the router to the Raspberry Pi
+        if buses is None: buses = Ctrl.buses
+        self.workers = {bus: BusWorker.Bus_Worker(pi, bus) for bus in buses} # One thread per bus
+
+    def worker_for(self, id):
+        '''
+        :param id: servo ID
+        :return: BusWorker.Bus_Worker of the bus the servo is on
+        '''
+
+        return self.workers[Ctrl.bus_for(id)]
+
+    def stop(self):
+        '''
+        Stop every worker once its transaction in progress has finished
+        '''
+
+        for worker in self.workers.values(): worker.stop()
+
+    def write_cmd(self, id, w_cmd, dat1=None, dat2=None, priority=BusWorker.MOTION, deadline=None):
+        '''
+        Queue a servo command on the servo's bus. Broadcasts go to every bus
+        :return: list of Futures holding True = Success or error code
+        '''
+
+        if id == Ctrl.config.BS_broadcast_id:
+            return [worker.write_cmd(id, w_cmd, dat1, dat2, priority, deadline) for worker in self.workers.values()]
+        return [self.worker_for(id).write_cmd(id, w_cmd, dat1, dat2, priority, deadline)]
+
+    def write_many(self, cmds, priority=BusWorker.MOTION, deadline=None):
+        '''
+        Share commands out between the buses, one transmission on each bus
+        :param cmds: sequence of (id, w_cmd, dat1, dat2) tuples
+        :return: list of Futures holding True = Success or error code, one for each bus used
+        '''
+
+        return [self.workers[bus].write_many(share, priority, deadline)
+                for bus, share in Ctrl.split_cmds(cmds).items()]
+
+    def read_many(self, requests, priority=BusWorker.TELEMETRY, deadline=None):
+        '''
+        Queue requests for data. Requests to servos on different buses are answered at the same time
+        :param requests: sequence of (id, r_cmd) tuples
+        :return: list of Futures holding the data returned or error code, in the order of requests
+        '''
+
+        return [self.worker_for(id).read_cmd(id, r_cmd, priority, deadline) for id, r_cmd in requests]
+
+    @staticmethod
+    def wait(futures):
+        '''
+        Wait for every transaction to be carried out
+        :param futures: list of Futures from write_cmd or write_many
+        :return: True = Success or the first error code
+        '''
+
+        results = [future.result() for future in futures]
+        for result in results:
+            if result != True: return result
+        return True
+
+if __name__ == '__main__':
+    import time # Standard library of time, diary & calendar functions
+    import pigpio # Standard Raspberry Pi GPIO library
+    pi = pigpio.pi() # Create a Raspberry Pi object
+    Ctrl.portinit(pi) # Initialise the read/write switch of every bus
+    router = Bus_Router(pi) # Start a worker for every bus
+
+    ids = range(1, Ctrl.config.BS_num_servos + 1)
+    start = time.monotonic()
+    positions = [future.result() for future in router.read_many([(id, Ctrl.config.BS_POS_READ) for id in ids])]
+    print("Read", len(positions), "positions from", len(router.workers), "buses in", time.monotonic() - start, "seconds")
+    print(positions)
+    print(router.wait(router.write_many([(id, Ctrl.config.BS_MOVE_TIME_WRITE, pos, 500)
+                                         for id, pos in zip(ids, positions) if type(pos) == int])))
+    router.stop()
+    print("Bus router tests complete!")
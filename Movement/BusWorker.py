@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+# encoding: utf-8
+# Copyright ians.moyes@gmail.com
+
+# Class to own the Raspberry Pi expansion board UART from a single thread.
+# Motion, telemetry & LED transactions are queued by priority & carried out one at a time,
+# so they never collide on the bus.
+
+import itertools # Standard library of iterator functions
+import queue # Standard library of thread safe queues
+import threading # Standard multi-tasking library
+import time # Standard library of time, diary & calendar functions
+from concurrent.futures import Future # Standard library placeholder for a result to come
+import RPiExpCom as Ctrl # Raspberry Pi expansion board communication driver
+
+# Transaction priorities. Lower numbers are served first
+MOTION = 0 # Servo movement commands
+TELEMETRY = 1 # Servo health polling
+LIGHTS = 2 # LED controller frames
+
+class Bus_Worker():
+    ''' This is a class to define a thread which carries out every transaction on the servo bus
+    Transactions are submitted from any thread & a Future is returned straight away.
+    The Future holds the result once the transaction has been carried out
+    '''
+
+    def __init__(self, pi, bus=None):
+        '''
+        :param pi: the Raspberry Pi
+        :param bus: RPiExpCom.Serial_Bus to work on, or None to use the RPiExpCom functions,
+                    which send each servo's commands to the bus it's on
+        '''
+
+        self.pi = pi # Attach the bus to the Raspberry Pi
+        self.bus = bus
+        self.queue = queue.PriorityQueue() # Transactions waiting for the bus
+        self.sequence = itertools.count() # Keeps transactions of equal priority in order
+        self.missed = 0 # Number of transactions abandoned because they missed their deadline
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, priority, fn, *args, deadline=None):
+        '''
+        Queue a transaction for the bus
+        :param priority: MOTION, TELEMETRY or LIGHTS
+        :param fn: RPiExpCom function to call. Called as fn(pi, *args)
+        :param args: arguments for fn
+        :param deadline: time.monotonic() after which the transaction is no use, or None
+        :return: Future holding the result of fn
+        '''
+
+        future = Future()
+        self.queue.put((priority, next(self.sequence), deadline, future, fn, args))
+        return future
+
+    def run(self): # This is the code for the multi-tasking thread
+        while True:
+            priority, seq, deadline, future, fn, args = self.queue.get() # Wait for a transaction
+            if fn is None: break # Told to stop
+            if not future.set_running_or_notify_cancel(): continue # Cancelled by the caller
+            if deadline is not None and time.monotonic() > deadline: # Too late to be useful
+                self.missed += 1
+                future.set_exception(TimeoutError("Bus transaction missed its deadline"))
+                continue
+            try:
+                future.set_result(fn(self.pi, *args)) # Carry out the transaction
+            except BaseException as e: # If it all went wrong, tell the caller
+                future.set_exception(e)
+
+    def stop(self):
+        '''
+        Stop the thread once the transaction in progress has finished.
+        Transactions still queued are cancelled
+        '''
+
+        self.queue.put((-1, next(self.sequence), None, None, None, ())) # Jump the queue
+        self.thread.join()
+        while not self.queue.empty(): # Cancel anything left behind
+            future = self.queue.get()[3]
+            if future is not None: future.cancel()
+
+    def write_cmd(self, id, w_cmd, dat1=None, dat2=None, priority=MOTION, deadline=None):
+        '''
+        Queue a servo command. See RPiExpCom.serial_servo_write_cmd
+        :return: Future holding True = Success or error code
+        '''
+
+        fn = Ctrl.serial_servo_write_cmd if self.bus is None else self.bus.write_cmd
+        return self.submit(priority, fn, id, w_cmd, dat1, dat2, deadline=deadline)
+
+    def write_many(self, cmds, priority=MOTION, deadline=None):
+        '''
+        Queue several servo commands to be sent in one transmission. See RPiExpCom.serial_servo_write_many
+        :return: Future holding True = Success or error code
+        '''
+
+        fn = Ctrl.serial_servo_write_many if self.bus is None else self.bus.write_many
+        return self.submit(priority, fn, cmds, deadline=deadline)
+
+    def read_cmd(self, id, r_cmd, priority=TELEMETRY, deadline=None):
+        '''
+        Queue a request for data from a servo. See RPiExpCom.serial_servo_read_cmd
+        :return: Future holding the data returned from the servo or error code
+        '''
+
+        fn = Ctrl.serial_servo_read_cmd if self.bus is None else self.bus.read_cmd
+        return self.submit(priority, fn, id, r_cmd, deadline=deadline)
+
+    def trinket_write(self, id, colour, priority=LIGHTS, deadline=None):
+        '''
+        Queue an LED frame for the TrinketM0. See RPiExpCom.TrinketM0_write_data
+        :return: Future holding True = Success or error code
+        '''
+
+        bus = Ctrl.bus if self.bus is None else self.bus
+        return self.submit(priority, lambda pi, id, colour: bus.trinket_write(id, colour),
+                           id, colour, deadline=deadline)
+
+if __name__ == '__main__':
+    import pigpio # Standard Raspberry Pi GPIO library
+    pi = pigpio.pi() # Create a Raspberry Pi object
+    Ctrl.portinit(pi) # Initialise the read/write switch
+    bus = Bus_Worker(pi) # Start the bus thread
+
+    # Queue a position read from every servo, then an LED frame & a movement.
+    # The movement jumps the queue
+    reads = [bus.read_cmd(id, Ctrl.config.BS_POS_READ) for id in range(1, Ctrl.config.BS_num_servos + 1)]
+    lights = bus.trinket_write(12, (1, 1, 0))
+    move = bus.write_cmd(1, Ctrl.config.BS_MOVE_TIME_WRITE, 500, 500)
+
+    for id, future in enumerate(reads): print("Servo", id + 1, "position", future.result())
+    print("Lights", lights.result(), "Move", move.result())
+    bus.stop()
+    print("Bus worker tests complete!")
@@ -0,0 +1,144 @@
+#!/usr/bin/python3
+# encoding: utf-8
+# Copyright ians.moyes@gmail.com
+
+# Class to collect the servo commands of one control tick & send only the net changes.
+# A later command to the same servo replaces an earlier one, & a position that has already
+# been sent isn't sent again.
+#
+#     stager = Command_Stager(pi)
+#     Serial_Servo.stager = stager # Leg & Hexapod movements are staged, not sent
+#     ... every tick
+#     stager.flush()
+
+import threading # Standard multi-tasking library
+import RPiExpCom as Ctrl # Raspberry Pi expansion board communication driver
+from SerialServoClass import Serial_Servo as Servo # Bus Serial Servo control class
+
+class Command_Stager():
+    ''' This is a class to define a staging area for servo write commands.
+    Commands are kept by (servo ID, command), so the last one staged in a tick wins.
+    Commands are sent in the order they were first staged
+    '''
+    # Commands that set a target, which is still in force after they've been sent
+    target_cmds = (Servo.MOVE_TIME_WRITE, Servo.MOVE_TIME_WAIT_WRITE)
+
+    def __init__(self, pi):
+        self.pi = pi # Attach the stager to the Raspberry Pi
+        self.lock = threading.Lock() # Commands may be staged from any thread
+        self.staged = {} # Commands for this tick. (id, command): parameters
+        self.sent = {} # Last target sent to each servo. (id, command): parameters
+        # Counters
+        self.staged_count = 0 # Commands staged
+        self.superseded = 0 # Commands replaced by a later one in the same tick
+        self.suppressed = 0 # Commands the same as the target already sent
+        self.sent_count = 0 # Frames sent
+        self.flushes = 0 # Ticks flushed
+
+    def stage(self, id, w_cmd, dat1=None, dat2=None):
+        '''
+        Stage a servo command for this tick
+        :param id: servo ID
+        :param w_cmd: The servo command
+        :param dat1: First servo command parameter
+        :param dat2: Second servo command parameter
+        '''
+
+        with self.lock:
+            key = (id, w_cmd)
+            if key in self.staged: self.superseded += 1
+            self.staged[key] = (dat1, dat2)
+            self.staged_count += 1
+
+    def stage_many(self, cmds):
+        '''
+        :param cmds: sequence of (id, w_cmd, dat1, dat2) tuples. dat1 & dat2 may be None or left out
+        '''
+
+        for cmd in cmds: self.stage(*cmd)
+
+    def forget(self, id=None):
+        '''
+        Forget the targets sent, so they are sent again even if they haven't changed.
+        e.g. after a servo has been stopped or unloaded
+        :param id: servo ID or None for every servo. The broadcast ID is every servo too
+        '''
+
+        with self.lock:
+            if id is None or id == Ctrl.config.BS_broadcast_id: self.sent.clear()
+            else:
+                for key in [key for key in self.sent if key[0] == id]: del self.sent[key]
+
+    def flush(self):
+        '''
+        Send the net changes of this tick in one transmission on each bus
+        :return: True = Success or error code
+        '''
+
+        with self.lock:
+            cmds = []
+            targets = {} # Targets to remember once they've been sent
+            for (id, w_cmd), params in self.staged.items():
+                if w_cmd in Command_Stager.target_cmds:
+                    if self.sent.get((id, w_cmd)) == params: # The servo already has this target
+                        self.suppressed += 1
+                        continue
+                    self.sent.pop((id, w_cmd), None) # Not known until it's been sent
+                    targets[(id, w_cmd)] = params
+                else: # The servo may end up somewhere other than the last target sent
+                    for known in (self.sent, targets):
+                        for key in [key for key in known if key[0] == id or id == Ctrl.config.BS_broadcast_id]:
+                            # A trigger moves to the standby target, which is still set afterwards
+                            if w_cmd != Servo.MOVE_START or key[1] != Servo.MOVE_TIME_WAIT_WRITE:
+                                del known[key]
+                cmds.append((id, w_cmd) + params)
+            self.staged.clear()
+            self.sent_count += len(cmds)
+            self.flushes += 1
+        if not cmds: return True # Nothing has changed
+        result = Servo.send_many(self.pi, cmds, forget=False)
+        if result == True: # Otherwise they're sent again next time
+            with self.lock:
+                self.sent.update(targets)
+        return result
+
+    @property # Allows method to be used like a variable without ()
+    def saved(self):
+        '''
+        Frames that didn't need to be sent
+        '''
+
+        return self.superseded + self.suppressed
+
+    def report(self):
+        '''
+        :return: Dictionary of the counters
+        '''
+
+        return {"staged":self.staged_count, "superseded":self.superseded, "suppressed":self.suppressed,
+                "sent":self.sent_count, "saved":self.saved, "flushes":self.flushes}
+
+    def __enter__(self): # Stage everything in a with block...
+        return self
+
+    def __exit__(self, *exc): # ...& send it at the end
+        self.flush()
+        return False
+
+if __name__ == '__main__':
+    import pigpio # Standard Raspberry Pi GPIO library
+    from LegClass import Leg # Class to define and control a leg
+    pi = pigpio.pi() # Create a Raspberry Pi object
+    Ctrl.portinit(pi) # Initialise the read/write switch
+    legs = [Leg(pi, leg) for leg in range(6)]
+
+    stager = Command_Stager(pi)
+    Servo.stager = stager # Stage every leg movement
+    for tick in range(10):
+        for leg in legs:
+            leg.set_pos(((500, 500, 500), 500)) # Overwritten by the next line
+            leg.set_pos(((500, 450 + 10 * (tick % 2), 500), 500)) # Only the knee changes
+        stager.flush()
+    Servo.stager = None
+    print(stager.report())
+    print("Command stager tests complete!")
@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+# encoding: utf-8
+# Copyright ians.moyes@gmail.com
+
+# Forward kinematics. Works out where the feet are from the servo positions, the reverse of
+# 2DIK.inverse_kin. Whole logs of positions are worked out at once.
+#
+# Leg coordinates are those of 2DIK, from the shoulder joint. X forward, Y outwards, Z down.
+# Body coordinates are from the centre of the body. X forward, Y to port, Z up.
+
+import importlib # Standard library to import modules by name
+import numpy as np # Numerical array library
+import config # Bus Servo protocol definitions & hexapod geometry
+
+IK = importlib.import_module("2DIK") # Inverse kinematics. The name starts with a digit
+
+shoulders = np.array(config.HX_shoulders) # Shoulder joints in the body frame
+sides = np.array((1, 1, 1, -1, -1, -1)) # Leg Y axis is outwards, +Y on port & -Y on starboard
+
+def unremap_batch(positions):
+    '''
+    The reverse of 2DIK.remap
+    :param positions: array of servo positions 0-1000
+    :return: array of joint angles in radians
+    '''
+
+    return np.radians((np.asarray(positions, dtype=float) - 500) / 500 * 120)
+
+def leg_forward_kin(positions, legs=None):
+    '''
+    Toe positions from servo positions, in each leg's coordinates
+    :param positions: array [..., 6, 3] of servo positions (shoulder, knee, ankle), or [..., 18]
+    :param legs: leg number of each row 0~5. Default rows 0~5 are legs 0~5
+    :return: array [..., 6, 3] of toe coordinates (X, Y, Z)
+    '''
+
+    positions = np.asarray(positions, dtype=float)
+    if positions.shape[-1] != 3: positions = positions.reshape(positions.shape[:-1] + (-1, 3))
+    if legs is None: legs = np.arange(positions.shape[-2])
+    angles = unremap_batch(IK.switch_sides_batch(positions, legs)) # Starboard legs back to port
+    shoulder, kneeflex, ankleflex = angles[..., 0], angles[..., 1], angles[..., 2]
+
+    # Knee to toe triangle, from the angle at the ankle
+    ankleang = np.pi - ankleflex
+    toedist = np.sqrt(IK.FOOT**2 + IK.CALF**2 - 2 * IK.FOOT * IK.CALF * np.cos(ankleang))
+    kneeang = np.arccos(np.clip((toedist**2 + IK.CALF**2 - IK.FOOT**2) / (2 * toedist * IK.CALF), -1, 1))
+    drop = kneeang - kneeflex # Angle of the line from knee to toe, from straight down
+    w = toedist * np.sin(drop) + IK.THIGH # Distance out from the shoulder
+    coords = np.empty(angles.shape)
+    coords[..., 0] = w * np.sin(shoulder)
+    coords[..., 1] = w * np.cos(shoulder)
+    coords[..., 2] = toedist * np.cos(drop)
+    return coords
+
+def leg_to_body(coords):
+    '''
+    :param coords: array [..., 6, 3] of toe coordinates in each leg's coordinates
+    :return: array [..., 6, 3] of toe coordinates in the body frame
+    '''
+
+    coords = np.asarray(coords, dtype=float)
+    body = np.empty(coords.shape)
+    body[..., :2] = shoulders + coords[..., :2] * np.stack((np.ones(6), sides), axis=-1)
+    body[..., 2] = -coords[..., 2] # Leg Z is down
+    return body
+
+def body_to_leg(body):
+    '''
+    :param body: array [..., 6, 3] of toe coordinates in the body frame
+    :return: array [..., 6, 3] of toe coordinates in each leg's coordinates
+    '''
+
+    body = np.asarray(body, dtype=float)
+    coords = np.empty(body.shape)
+    coords[..., :2] = (body[..., :2] - shoulders) * np.stack((np.ones(6), sides), axis=-1)
+    coords[..., 2] = -body[..., 2]
+    return coords
+
+def forward_kin(positions):
+    '''
+    Foot positions in the body frame from servo positions
+    :param positions: array [..., 18] of servo positions, servo 1 first, or [..., 6, 3]
+    :return: array [..., 6, 3] of foot coordinates (X forward, Y to port, Z up)
+    '''
+
+    return leg_to_body(leg_forward_kin(positions))
+
+def contacts(feet, margin=10.0):
+    '''
+    Guess which feet are on the ground, from how low they are
+    :param feet: array [..., 6, 3] of foot coordinates in the body frame
+    :param margin: feet within this many mm of the lowest foot are taken to be down
+    :return: boolean array [..., 6]
+    '''
+
+    height = feet[..., 2]
+    return height <= height.min(axis=-1, keepdims=True) + margin
+
+if __name__ == '__main__':
+    rng = np.random.default_rng()
+    coords = rng.uniform((-80, 60, 30), (80, 160, 120), size=(10000, 6, 3)) # Toe positions in leg coordinates
+    positions, reachable = IK.inverse_kin_batch(coords)
+    back = leg_forward_kin(positions)
+    error = np.linalg.norm(back - coords, axis=-1)[reachable]
+    print("IK then FK: largest error %.2f mm, mean %.2f mm over %d toes" % (error.max(), error.mean(), error.size))
+    print("Standing feet, body frame\n", forward_kin(IK.inverse_kin_batch(np.tile(config.HX_stand_pos, (6, 1)))[0]).round(1))
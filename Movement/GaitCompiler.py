@@ -0,0 +1,184 @@
+#!/usr/bin/python3
+# encoding: utf-8
+# Copyright ians.moyes@gmail.com
+
+# Compiler for periodic gaits. Walking at a steady velocity repeats the same joint positions
+# every cycle, so the inverse kinematics & frame encoding are done once for the whole cycle.
+# The frames of every tick, headers & checksums included, are kept back to back in one buffer
+# for each bus, & walking is just sending row k of the buffer.
+# Compiled cycles are kept in a least recently used cache, keyed by the gait parameters.
+#
+#     engine = Compiled_Gait_Engine(pi) # A Gait_Engine that plays compiled cycles when it can
+#     engine.start()
+#     engine.set_velocity(100)
+
+import functools # Standard library of function tools, for the cache
+import importlib # Standard library to import modules by name
+import numpy as np # Numerical array library
+import config # Bus Servo protocol definitions & hexapod geometry
+import RPiExpCom as Ctrl # Raspberry Pi expansion board communication driver
+import GaitEngine # Fixed-rate gait engine
+from SerialServoClass import Serial_Servo as Servo # Bus Serial Servo control class
+
+IK = importlib.import_module("2DIK") # Inverse kinematics. The name starts with a digit
+
+CACHE_SIZE = 32 # Compiled cycles kept
+FRAME_LENGTH = 10 # Bytes in a MOVE_TIME_WRITE frame. Header, ID, length, command, 4 parameters & checksum
+SPEED_STEP = 1.0 # Velocities are rounded to these steps, so nearly equal velocities share a cycle. mm/s
+YAW_STEP = 0.01 # radians/s
+
+def encode_moves(ids, positions, tim):
+    '''
+    Encode MOVE_TIME_WRITE frames for many ticks at once
+    :param ids: servo IDs, one for each column of positions
+    :param positions: array [ticks, servos] of servo positions
+    :param tim: time to reach each position in mS
+    :return: array [ticks, servos * FRAME_LENGTH] of bytes, the frames of each tick back to back
+    '''
+
+    positions = np.asarray(positions, dtype=np.int64)
+    frames = np.empty(positions.shape + (FRAME_LENGTH,), dtype=np.uint8)
+    frames[..., 0:2] = 0x55 # Header
+    frames[..., 2] = ids
+    frames[..., 3] = 7 # Data length of 2 parameters
+    frames[..., 4] = config.BS_MOVE_TIME_WRITE
+    frames[..., 5] = positions & 0xff # Least significant 8 bits first
+    frames[..., 6] = (positions >> 8) & 0xff
+    frames[..., 7] = tim & 0xff
+    frames[..., 8] = (tim >> 8) & 0xff
+    frames[..., 9] = ~frames[..., 2:9].sum(axis=-1, dtype=np.int64) & 0xff # Checksum
+    return np.ascontiguousarray(frames.reshape(positions.shape[0], -1))
+
+class Compiled_Cycle():
+    ''' This is a class to define one gait cycle, ready to send.
+    positions[tick, leg, joint] are the servo positions & frames[bus][tick] the bytes to send
+    '''
+
+    def __init__(self, gait, velocity, cycle, rate, lift, stand):
+        '''
+        Run the inverse kinematics for every tick of the cycle & encode the frames
+        :param gait: name from GaitEngine.gaits
+        :param velocity: (forward mm/s, to port mm/s, turn to port radians/s)
+        :param cycle: seconds for every leg to take a step
+        :param rate: ticks per second
+        :param lift: height each foot is lifted in mm
+        :param stand: toe position standing, from each shoulder
+        '''
+
+        self.gait = gait
+        self.velocity = velocity
+        self.ticks = max(1, int(round(rate * cycle)))
+        self.move_time = int(round(1000 / rate)) # mS
+        stroke = GaitEngine.strokes(velocity, cycle * GaitEngine.gaits[gait][1], stand)
+        coords = GaitEngine.toe_coords(gait, np.arange(self.ticks) / self.ticks, stroke, lift, stand)
+        self.positions, reachable = IK.inverse_kin_batch(coords)
+        reachable &= IK.in_range_batch(self.positions, config.BS_rotate_limits)
+        # Every leg can be reached within the servo limits & no joint has to move faster than the servos can,
+        # including the wrap around. Otherwise the live engine holds & counts the legs that can't
+        step = np.abs(self.positions - np.roll(self.positions, 1, axis=0)).max()
+        self.usable = bool(reachable.all()) and step <= config.BS_max_speed / rate
+        ids = np.arange(1, 19).reshape(6, 3) # Servo IDs of each leg & joint
+        flat = self.positions.reshape(self.ticks, 18)
+        self.frames = {} # Serial_Bus: array [ticks, bytes]
+        for bus in Ctrl.buses:
+            columns = [n for n, id in enumerate(ids.flat) if Ctrl.bus_for(int(id)) is bus]
+            if columns: self.frames[bus] = encode_moves(ids.flat[columns], flat[:, columns], self.move_time)
+
+    @property # Allows method to be used like a variable without ()
+    def size(self):
+        '''
+        Bytes held by the compiled frames
+        '''
+
+        return sum(frames.nbytes for frames in self.frames.values())
+
+    def tick_of(self, phase):
+        '''
+        :param phase: 0 ~ 1 through the gait cycle
+        :return: row of the buffer for that point in the cycle
+        '''
+
+        return int(round(phase * self.ticks)) % self.ticks
+
+    def send(self, pi, tick):
+        '''
+        Send the frames of one tick, a single UART transmission on each bus
+        :param tick: row of the buffer, 0 ~ ticks - 1
+        :return: True = Success or error code
+        '''
+
+        return Ctrl.serial_servo_write_frames(pi, {bus: frames[tick] for bus, frames in self.frames.items()})
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def cached_cycle(gait, velocity, cycle, rate, lift, stand):
+    return Compiled_Cycle(gait, velocity, cycle, rate, lift, stand)
+
+def compile_cycle(gait, velocity, cycle=1.0, rate=50, lift=30, stand=config.HX_stand_pos):
+    '''
+    A compiled gait cycle from the cache, compiling it if it's not there.
+    Parameters as Compiled_Cycle
+    :return: Compiled_Cycle
+    '''
+
+    vx, vy, yaw = velocity
+    velocity = (round(vx / SPEED_STEP) * SPEED_STEP, round(vy / SPEED_STEP) * SPEED_STEP,
+                round(yaw / YAW_STEP) * YAW_STEP) # So nearly equal velocities share a cycle
+    return cached_cycle(gait, velocity, float(cycle), rate, float(lift), tuple(stand))
+
+class Compiled_Gait_Engine(GaitEngine.Gait_Engine):
+    ''' This is a class to define a gait engine that plays compiled cycles while walking steadily.
+    Starting, stopping, speeding up & changing gait are worked out tick by tick as usual
+    '''
+
+    def __init__(self, pi, *args, **kwargs):
+        super().__init__(pi, *args, **kwargs)
+        self.compiled_ticks = 0 # Ticks sent from a compiled cycle
+
+    def tick(self):
+        '''
+        Send the next row of the compiled cycle if the velocity is steady, or work it out if it isn't
+        :return: True = Success or error code
+        '''
+
+        with self.lock:
+            steady = self.pending is None and self.activity == 1 and np.array_equal(self.target, self.velocity) \
+                     and self.pose is None # Cycles are compiled level
+            gait, velocity = self.gait, tuple(self.velocity)
+        # Staged commands are merged with other commands, so they can't be sent as compiled frames
+        if not steady or self.sent is None or Servo.stager is not None: return super().tick()
+        compiled = compile_cycle(gait, velocity, self.cycle, round(1 / self.period), self.lift, self.stand)
+        if not compiled.usable: return super().tick()
+        phase = (self.phase + self.period / self.cycle) % 1
+        tick = compiled.tick_of(phase)
+        if np.abs(compiled.positions[tick] - self.sent).max() > config.BS_max_speed * self.period:
+            return super().tick() # Too far from the compiled cycle. Close in first
+        self.phase = phase
+        self.ticks += 1
+        self.sent = compiled.positions[tick]
+        self.frames += 18
+        self.compiled_ticks += 1
+        return compiled.send(self.pi, tick)
+
+if __name__ == '__main__':
+    import time # Standard library of time, diary & calendar functions
+    import pigpio # Standard Raspberry Pi GPIO library
+    pi = pigpio.pi() # Create a Raspberry Pi object
+    Ctrl.portinit(pi) # Initialise the read/write switch
+
+    start = time.perf_counter()
+    compiled = compile_cycle("tripod", (100, 0, 0))
+    print("Compiled", compiled.ticks, "ticks,", compiled.size, "bytes in %.1f ms" % (1000 * (time.perf_counter() - start)))
+    start = time.perf_counter()
+    compile_cycle("tripod", (100.2, 0, 0)) # Rounds to the same velocity
+    print("From the cache in %.3f ms" % (1000 * (time.perf_counter() - start)), cached_cycle.cache_info())
+
+    engine = Compiled_Gait_Engine(pi)
+    engine.start()
+    time.sleep(1.5) # Stand up
+    engine.set_velocity(100)
+    time.sleep(4)
+    engine.set_velocity(0)
+    time.sleep(2)
+    engine.stop()
+    print("Ticks", engine.ticks, "compiled", engine.compiled_ticks, "overruns", engine.overruns)
+    print("Gait compiler tests complete!")
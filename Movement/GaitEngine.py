@@ -0,0 +1,269 @@
+#!/usr/bin/python3
+# encoding: utf-8
+# Copyright ians.moyes@gmail.com
+
+# Class to walk the hexapod. A control loop runs at a fixed rate & works out where every toe
+# should be from the phase of the gait cycle & the velocity asked for. All 18 joints are sent
+# each tick in one transmission on each bus, with a move time of one tick, so the servos
+# interpolate between the ticks.
+#
+#     engine = Gait_Engine(pi)
+#     engine.start() # Stands up & starts the loop
+#     engine.set_velocity(100, 0, 0.2) # Returns at once. Forward at 100mm/s, turning to port
+#     engine.set_gait("wave") # Stops, changes gait & carries on
+#     engine.stop()
+
+import importlib # Standard library to import modules by name
+import math # Standard library of mathematical functions
+import threading # Standard multi-tasking library
+import time # Standard library of time, diary & calendar functions
+import numpy as np # Numerical array library
+import config # Bus Servo protocol definitions & hexapod geometry
+import BodyPose # Body pose inverse kinematics
+import ForwardKin as FK # Forward kinematics & the body frame
+from LegClass import Leg # Class to define and control a leg
+from SerialServoClass import Serial_Servo as Servo # Bus Serial Servo control class
+
+IK = importlib.import_module("2DIK") # Inverse kinematics. The name starts with a digit
+
+# Gaits. Name: (when each leg lifts off as a share of the cycle, share of the cycle a foot is on the ground)
+gaits = {"tripod": ((0, 1/2, 0, 1/2, 0, 1/2), 1/2), # 3 legs at a time
+         "ripple": ((0, 1/3, 2/3, 1/2, 5/6, 1/6), 2/3), # 2 legs at a time, each side rear to front
+         "wave": ((0, 1/6, 2/6, 3/6, 4/6, 5/6), 5/6)} # 1 leg at a time, port rear to front then starboard
+
+def neutral(stand=config.HX_stand_pos):
+    '''
+    :param stand: toe position standing, from each shoulder
+    :return: array [6, 3] of toe coordinates standing, one row for each leg
+    '''
+
+    return np.tile(np.asarray(stand, dtype=float), (6, 1))
+
+def strokes(velocity, stance_time, stand=config.HX_stand_pos):
+    '''
+    How far each toe travels along the ground while it's down
+    :param velocity: (forward mm/s, to port mm/s, turn to port radians/s)
+    :param stance_time: seconds each foot is on the ground
+    :param stand: toe position standing, from each shoulder
+    :return: array [6, 2] of (X, Y) distances in each leg's coordinates
+    '''
+
+    vx, vy, yaw = velocity
+    toes = FK.shoulders + np.stack((np.full(6, float(stand[0])), FK.sides * stand[1]), axis=-1) # Body frame
+    ground = np.stack((vx - yaw * toes[:, 1], vy + yaw * toes[:, 0]), axis=-1) # Body speed at each toe
+    return ground * stance_time * np.stack((np.ones(6), FK.sides), axis=-1) # Into leg coordinates
+
+def toe_coords(gait, phase, stroke, lift, stand=config.HX_stand_pos):
+    '''
+    Where every toe is at a point in the gait cycle
+    :param gait: name from gaits
+    :param phase: 0 ~ 1 through the cycle. A number or an array of them
+    :param stroke: array [6, 2] from strokes
+    :param lift: height a foot is lifted in mm
+    :param stand: toe position standing, from each shoulder
+    :return: array [..., 6, 3] of toe coordinates, one row for each leg
+    '''
+
+    lift_off, duty = gaits[gait]
+    swing = 1 - duty # Share of the cycle a foot is in the air
+    leg_phase = (np.asarray(phase, dtype=float)[..., np.newaxis] - lift_off) % 1 # [..., 6]
+    in_air = leg_phase < swing
+    # Along the ground from front to back, then through the air with a smooth start & finish
+    along = np.where(in_air, (1 - np.cos(math.pi * leg_phase / swing)) / 2 - 0.5,
+                     0.5 - (leg_phase - swing) / duty)
+    coords = neutral(stand) + np.zeros(leg_phase.shape + (3,))
+    coords[..., :2] += along[..., np.newaxis] * stroke
+    coords[..., 2] -= np.where(in_air, lift * np.sin(math.pi * leg_phase / swing), 0) # Z is down
+    return coords
+
+class Gait_Engine():
+    ''' This is a class to define a thread which walks the hexapod.
+    Velocity & gait can be changed at any time from any thread without waiting
+    '''
+
+    def __init__(self, pi, gait="tripod", rate=50, cycle=1.0, lift=30, max_stride=120,
+                 max_accel=200, max_yaw_accel=2.0, stand=config.HX_stand_pos, settle=1000):
+        '''
+        :param pi: the Raspberry Pi
+        :param gait: name from gaits
+        :param rate: ticks per second
+        :param cycle: seconds for every leg to take a step
+        :param lift: height each foot is lifted in mm
+        :param max_stride: longest distance a toe may travel along the ground in mm. Faster requests are slowed
+        :param max_accel: fastest change of speed in mm/s/s
+        :param max_yaw_accel: fastest change of turn rate in radians/s/s
+        :param stand: toe position standing, from each shoulder
+        :param settle: time in mS to move to the standing position when started
+        '''
+
+        positions, reachable = IK.inverse_kin_batch(neutral(stand))
+        if not np.all(reachable & IK.in_range_batch(positions, config.BS_rotate_limits)):
+            raise ValueError("Standing position out of reach " + str(stand))
+        self.pi = pi # Attach the engine to the Raspberry Pi
+        self.legs = [Leg(pi, leg) for leg in range(6)]
+        self.gait = gait
+        self.pending = None # Gait to change to once the hexapod has stopped
+        self.period = 1 / rate
+        self.move_time = int(round(1000 * self.period)) # mS
+        self.cycle = cycle
+        self.lift = lift
+        self.max_stride = max_stride
+        self.accel = np.array((max_accel, max_accel, max_yaw_accel))
+        self.stand = stand
+        self.settle = settle
+        self.lock = threading.Lock()
+        self.target = np.zeros(3) # Velocity asked for. (forward mm/s, to port mm/s, turn radians/s)
+        self.velocity = np.zeros(3) # Velocity being walked, after acceleration limiting
+        self.activity = 0.0 # 0 = standing still ~ 1 = stepping. Fades the foot lift in & out
+        self.phase = 0.0 # 0 ~ 1 through the gait cycle
+        self.pose = None # Body pose (roll, pitch, yaw, x, y, z) or None for level
+        self.sent = None # array [6, 3] of servo positions last sent
+        # Counters
+        self.ticks = 0 # Ticks run
+        self.frames = 0 # Servo commands sent
+        self.overruns = 0 # Ticks that started late
+        self.unreachable = 0 # Leg positions out of reach or past the servo limits, the leg was held still
+        self.rate_limited = 0 # Joint moves cut short to keep within the servo's top speed
+        self.errors = 0 # Ticks whose joint positions couldn't be sent
+        self.halt = threading.Event() # Set to stop the thread
+        self.thread = None
+
+    def set_velocity(self, vx, vy=0.0, yaw=0.0):
+        '''
+        Walk at a new velocity. Returns at once, the engine accelerates to it
+        :param vx: forward speed in mm/s. Negative is backwards
+        :param vy: speed to port in mm/s. Negative is to starboard
+        :param yaw: turn rate to port in radians/s. Negative turns to starboard
+        '''
+
+        target = np.array((vx, vy, yaw), dtype=float)
+        with self.lock: # The gait may be changed by another thread
+            stride = np.abs(strokes(target, self.cycle * gaits[self.pending or self.gait][1], self.stand)).max()
+            if stride > self.max_stride: target *= self.max_stride / stride # Too fast, slow down in proportion
+            self.target = target
+
+    def set_pose(self, roll=0.0, pitch=0.0, yaw=0.0, x=0.0, y=0.0, z=0.0):
+        '''
+        Tilt & shift the body while walking. e.g. to stay level on a slope or lean into a turn.
+        Parameters as BodyPose.solve. Returns at once
+        '''
+
+        pose = (roll, pitch, yaw, x, y, z)
+        with self.lock:
+            self.pose = None if not any(pose) else pose
+
+    def set_gait(self, gait):
+        '''
+        Change gait. If the hexapod is walking it stops, changes & carries on at the same velocity
+        :param gait: name from gaits
+        '''
+
+        if gait not in gaits: raise ValueError("Unknown gait " + gait)
+        with self.lock:
+            self.pending = None if gait == self.gait else gait
+            target = self.target
+        self.set_velocity(*target) # The stride limit depends on the gait
+
+    def start(self):
+        '''
+        Stand up & start the control loop in the background
+        '''
+
+        self.halt.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        '''
+        Stop the control loop. The legs stay where they are
+        '''
+
+        self.halt.set()
+        if self.thread is not None: self.thread.join()
+
+    def tick(self):
+        '''
+        Move the gait on by one tick & send the new joint positions
+        :return: True = Success or error code
+        '''
+
+        with self.lock:
+            target = self.target if self.pending is None else np.zeros(3) # Stop before changing gait
+            step = self.accel * self.period
+            self.velocity += np.clip(target - self.velocity, -step, step)
+            walking = np.any(target != 0) or np.any(self.velocity != 0)
+            fade = self.period / self.cycle # Lift fades in or out over one cycle
+            self.activity = min(1.0, self.activity + fade) if walking else max(0.0, self.activity - fade)
+            if self.pending is not None and self.activity == 0: # Stopped, change gait
+                self.gait, self.pending = self.pending, None
+            gait, velocity, activity, pose = self.gait, self.velocity.copy(), self.activity, self.pose
+        self.phase = (self.phase + self.period / self.cycle) % 1
+        self.ticks += 1
+
+        stroke = strokes(velocity, self.cycle * gaits[gait][1], self.stand)
+        coords = toe_coords(gait, self.phase, stroke, self.lift * activity, self.stand)
+        if pose is not None: coords = FK.body_to_leg(BodyPose.pose_feet(FK.leg_to_body(coords), *pose))
+        positions, reachable = IK.inverse_kin_batch(coords)
+        reachable &= IK.in_range_batch(positions, config.BS_rotate_limits) # The servos can't go any further
+        self.unreachable += int(np.count_nonzero(~reachable))
+        if self.sent is None: # Nothing to hold the legs at
+            if not reachable.all(): return "Position too far"
+        else:
+            positions = np.where(reachable[:, np.newaxis], positions, self.sent) # Hold unreachable legs still
+            limit = int(config.BS_max_speed * self.period)
+            change = positions - self.sent
+            self.rate_limited += int(np.count_nonzero(np.abs(change) > limit))
+            positions = self.sent + np.clip(change, -limit, limit)
+            if np.array_equal(positions, self.sent): return True # Standing still, nothing to send
+        return self.send(positions, self.move_time)
+
+    def send(self, positions, tim):
+        '''
+        Send the positions of every joint in one transmission on each bus
+        :param positions: array [6, 3] of servo positions
+        :param tim: time to reach them in mS
+        :return: True = Success or error code
+        '''
+
+        cmds = []
+        for leg in range(6): cmds += self.legs[leg].pos_cmds((tuple(int(p) for p in positions[leg]), tim))
+        self.sent = positions
+        self.frames += len(cmds)
+        return Servo.write_many(self.pi, cmds)
+
+    def run(self): # This is the code for the multi-tasking thread
+        if self.sent is None: # Stand up slowly before streaming
+            positions, reachable = IK.inverse_kin_batch(neutral(self.stand)) # Checked when the engine was made
+            if self.send(positions, self.settle) != True: self.errors += 1
+            if self.halt.wait(self.settle / 1000): return
+        next_tick = time.monotonic()
+        while not self.halt.is_set():
+            if self.tick() != True: self.errors += 1
+            next_tick += self.period
+            wait = next_tick - time.monotonic()
+            if wait < 0: # Running late, don't try to catch up
+                self.overruns += 1
+                next_tick = time.monotonic()
+                wait = 0
+            if self.halt.wait(wait): break
+
+if __name__ == '__main__':
+    import pigpio # Standard Raspberry Pi GPIO library
+    import RPiExpCom as Ctrl # Raspberry Pi expansion board communication driver
+    pi = pigpio.pi() # Create a Raspberry Pi object
+    Ctrl.portinit(pi) # Initialise the read/write switch
+
+    engine = Gait_Engine(pi)
+    engine.start()
+    time.sleep(1.5) # Stand up
+    for gait, velocity in (("tripod", (100, 0, 0)), ("tripod", (0, 0, 0.3)), ("ripple", (0, 60, 0)),
+                           ("wave", (-50, 0, 0))):
+        engine.set_gait(gait)
+        engine.set_velocity(*velocity)
+        time.sleep(4)
+        print(engine.gait, engine.velocity, "frames", engine.frames, "overruns", engine.overruns,
+              "unreachable", engine.unreachable, "rate limited", engine.rate_limited, "errors", engine.errors)
+    engine.set_velocity(0)
+    time.sleep(2)
+    engine.stop()
+    print("Gait engine tests complete!")
@@ -20,11 +20,17 @@
 # Y axis is side to side
 # Z axis is vertical
 
+import asyncio # Standard asynchronous I/O library
+import importlib # Standard library to import modules by name
 import math # Standard library of mathematical functions
 import time # Standard library of time & date functions
+import numpy as np # Numerical array library
 import pigpio # Standard Raspberry Pi GPIO library
+import RPiExpCom as Ctrl # Raspberry Pi expansion board communication driver
 import PTHeadCtrl as PTH # Library to define & control a Pan & Tilt Head
 from LegClass import Leg # Class to define and control a leg with 3 egrees of freedom (DoF)
+from SerialServoClass import Serial_Servo as Servo # Bus Serial Servo control class
+inverse_kin = importlib.import_module("2DIK").inverse_kin # The module name starts with a digit
 # import HCSR04 # Library to control ultrasonic sensor
 # import MPU950 # Library to read MPU9250/BM80 IMU
 
@@ -106,6 +112,35 @@ def backward_step(leg, factor=1, tim=2000):
         SpiderPi[leg].pos = (inverse_kin(leg, AEP), tim * 0.601)
         SpiderPi[leg].pos = (inverse_kin(leg, ASP), tim * 0.133)
 
+def set_pos(positions, tim=Leg.default_time):
+    '''
+    Move all of the legs at once. All 18 joints are sent in one transmission
+    :param positions: 6 tuples of servo positions (shoulder, knee, ankle), one for each leg
+    :param tim: time to reach destination in mS
+    :return: True = success or error code
+    '''
+    global SpiderPi # Import the hexapod
+
+    cmds = [] # Collect the commands for every joint
+    for leg in range(6): # Scan the legs
+        cmds += SpiderPi[leg].pos_cmds((positions[leg], tim))
+    return Servo.write_many(pi, cmds) # Send them all at once
+
+def set_standby_pos(positions, tim=Leg.default_time):
+    '''
+    Prepare all of the legs to move. All 18 joints are sent in one transmission
+    Nothing happens until trigger() is called
+    :param positions: 6 tuples of servo positions (shoulder, knee, ankle), one for each leg
+    :param tim: time to reach destination in mS
+    :return: True = success or error code
+    '''
+    global SpiderPi # Import the hexapod
+
+    cmds = [] # Collect the commands for every joint
+    for leg in range(6): # Scan the legs
+        cmds += SpiderPi[leg].pos_cmds((positions[leg], tim), Servo.MOVE_TIME_WAIT_WRITE)
+    return Servo.write_many(pi, cmds) # Send them all at once
+
 def load():
     '''
     Loads all of the servos in the hexapod
@@ -128,17 +163,67 @@ def unload():
     for leg in range(6): # Scan the legs
         SpiderPi[leg].unload # Unload them
 
+def refresh():
+    '''
+    Forget the cached registers of every servo, so they are read from the servos next time
+    :param:
+    :return:
+    '''
+    global SpiderPi # Import the hexapod
+
+    for leg in range(6): # Scan the legs
+        SpiderPi[leg].refresh()
+
 def trigger():
     '''
-    Triggers hexapod movement
+    Triggers hexapod movement to the positions given to set_standby_pos
+    A single broadcast frame, so all of the legs start moving at the same moment
     :param:
     :return: True = success or error code
     '''
 
+    return Servo.trigger_all(pi) # Trigger the movement
+
+async def read_pos():
+    '''
+    Read the real time positions of every joint without blocking the event loop
+    :param:
+    :return: 6 tuples of joint positions (shoulder, knee, ankle), one for each leg
+    '''
+    global SpiderPi # Import the hexapod
+
+    # Every leg at once. Legs on different buses are read at the same time
+    return tuple(await asyncio.gather(*(SpiderPi[leg].read_pos() for leg in range(6))))
+
+def snapshot():
+    '''
+    Read the real time position of every joint in one batch. Each reply is time stamped as it arrives
+    :param:
+    :return: (positions, times, valid)
+             positions: array [18] of joint positions, servo 1 first. 0 where there was no reply
+             times: array [18] of time.monotonic() of each reply. NaN where there was no reply
+             valid: boolean array [18]. False where the servo didn't answer
+    '''
+
+    ids = range(1, 19) # Servos are 1 indexed, 3 to a leg
+    results = Ctrl.serial_servo_read_many(pi, [(id, Servo.POS_READ) for id in ids])
+    valid = np.array([type(data) == int for data, t in results])
+    positions = np.array([data if ok else 0 for (data, t), ok in zip(results, valid)], dtype=np.int64)
+    times = np.array([t if ok else np.nan for (data, t), ok in zip(results, valid)])
+    return positions, times, valid
+
+async def read_state():
+    '''
+    Report hexapod status without blocking the event loop
+    :param:
+    :return: Tuple of leg status dictionaries
+    '''
     global SpiderPi # Import the hexapod
 
-    for leg in range (6): # Scan the legs
-        SpiderPi[leg].trigger # Trigger the movement
+    results = () # Create empty tuple
+    for leg in range(6): # Scan the legs
+        results += (await SpiderPi[leg].read_state(),)
+    return results
 
 def diag():
     '''
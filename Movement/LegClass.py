@@ -18,23 +18,32 @@ class Leg():
         self.knee = Servo(self.pi, (self.leg * 3) + 2) # Create a knee joint
         self.ankle = Servo(self.pi, (self.leg * 3) + 3) # Create an ankle joint
 
+    def pos_cmds(self, posn, w_cmd=Servo.MOVE_TIME_WRITE): # Command 1 or 7
+        '''
+        Build, but don't send, the commands to move the leg to a new position
+        param posn: ((shoulder, knee, ankle), time) or (shoulder, knee, ankle) for the default time
+        param w_cmd: MOVE_TIME_WRITE to move immediately, MOVE_TIME_WAIT_WRITE to wait for trigger
+        :return: list of 3 commands for Servo.write_many
+        '''
+
+        if len(posn) == 2: # if a time to detination was specified
+            joints, tim = posn
+        else:
+            joints, tim = posn, Leg.default_time
+        return [self.shoulder.pos_cmd((joints[0], tim), w_cmd), # Move shoulder joint
+                self.knee.pos_cmd((joints[1], tim), w_cmd), # Move knee joint
+                self.ankle.pos_cmd((joints[2], tim), w_cmd)] # Move ankle joint
+
     def set_pos(self, posn): # Command 1.
         '''
-        Move leg to new position
+        Move leg to new position. All 3 joints are sent in one transmission
         param position: tuple to define the position for leg to move to (shoulder, knee, ankle)
         param time: time to reach destination in mS
         This MAY mean the servos are travelling at different speeds
-        :return:
+        :return: True = successful or error code
         '''
 
-        if len(posn) == 2: # if a time to detination was specified
-            self.shoulder.pos = (posn[0][0], posn[1]) # Move shoulder joint
-            self.knee.pos = (posn[0][1], posn[1]) # Move knee joint
-            self.ankle.pos = (posn[0][2], posn[1]) # Move ankle joint
-        else:
-            self.shoulder.pos = (posn[0], Leg.default_time) # Move shoulder joint
-            self.knee.pos = (posn[1], Leg.default_time) # Move knee joint
-            self.ankle.pos = (posn[2], Leg.default_time) # Move ankle joint
+        return Servo.write_many(self.pi, self.pos_cmds(posn))
    
     @property # Allows method to be used like a variable without ()
     def get_set_pos(self): # Command 2
@@ -57,17 +66,11 @@ class Leg():
         param position: tuple to define the position for leg to move to (shoulder, knee, ankle)
         param tim: time to reach destinations in mS
         This MAY mean the servos are travelling at different speeds
-        :return:
+        All 3 joints are sent in one transmission
+        :return: True = successful or error code
         '''
  
-        if len(posn) == 2: # if a time to detination was specified
-            self.shoulder.standby_pos = (posn[0][0], posn[1]) # Move shoulder joint
-            self.knee.standby_pos = (posn[0][1], posn[1]) # Move knee joint
-            self.ankle.standby_pos = (posn[0][2], posn[1]) # Move ankle joint
-        else:
-            self.shoulder.standby_pos = (posn[0], Leg.default_time) # Standby to move shoulder joint
-            self.knee.standby_pos = (posn[1], Leg.default_time) # Standby to move knee joint
-            self.ankle.standby_pos = (posn[2], Leg.default_time) # Standby to move ankle joint
+        return Servo.write_many(self.pi, self.pos_cmds(posn, Servo.MOVE_TIME_WAIT_WRITE))
 
     standby_pos = property(fset=set_standby_pos)
 
@@ -76,12 +79,14 @@ class Leg():
         '''
         Triggers movement to new position as defined by previously transmitted
         new_standby_pos command. Command 7.
-        :return:
+        The 3 joints are triggered in one transmission. A broadcast trigger would also start
+        any movement waiting on the other legs, so use Servo.trigger_all for the whole hexapod
+        :return: True = successful or error code
         '''
 
-        self.shoulder.trigger # Trigger shoulder joint
-        self.knee.trigger # Trigger knee joint
-        self.ankle.trigger # Trigger ankle joint
+        return Servo.write_many(self.pi, [(self.shoulder.id, Servo.MOVE_START), # Trigger shoulder joint
+                                          (self.knee.id, Servo.MOVE_START), # Trigger knee joint
+                                          (self.ankle.id, Servo.MOVE_START)]) # Trigger ankle joint
   
     @property # Allows method to be used like a variable without ()
     def stop(self): # Command 12
@@ -94,6 +99,15 @@ class Leg():
         self.knee.stop # Stop knee joint
         self.ankle.stop # Stop ankle joint
         
+    def refresh(self):
+        '''
+        Forget the cached registers of all 3 joints, so they are read from the servos next time
+        '''
+
+        self.shoulder.refresh() # Shoulder joint
+        self.knee.refresh() # Knee joint
+        self.ankle.refresh() # Ankle joint
+
     def set_offset(self, offset=(0,0,0)): # Command 17 + 18
         """
         Set leg joint offsets and save to non-volatile memory to survive reboot
@@ -284,6 +298,54 @@ class Leg():
         results["load"] = self.load # Command 32
         return results # Return data
 
+    # asyncio versions. These let other coroutines run while the servos answer
+
+    async def move(self, posn): # Command 1
+        '''
+        Move leg to new position without blocking the event loop
+        param posn: ((shoulder, knee, ankle), time) or (shoulder, knee, ankle) for the default time
+        :return: True = successful or error code
+        '''
+
+        return await Servo.async_send_many(self.pi, self.pos_cmds(posn))
+
+    async def read_temp(self): # Command 26
+        '''
+        Read real time leg joint temperatures in °C without blocking the event loop
+        :return: Temperature values (shoulder, knee, ankle) or error code
+        '''
+
+        return (await self.shoulder.read_temp(), await self.knee.read_temp(), await self.ankle.read_temp())
+
+    async def read_vin(self): # Command 27
+        '''
+        Read real time leg joint voltages-in without blocking the event loop
+        :return: Voltages-in (shoulder, knee, ankle) or error code
+        '''
+
+        return (await self.shoulder.read_vin(), await self.knee.read_vin(), await self.ankle.read_vin())
+
+    async def read_pos(self): # Command 28
+        '''
+        Read real time leg joint positions without blocking the event loop
+        :return: Current leg joint positions (Shoulder, Knee, Ankle) or error code
+        '''
+
+        return (await self.shoulder.read_pos(), await self.knee.read_pos(), await self.ankle.read_pos())
+
+    async def read_state(self):
+        '''
+        Collect leg information without blocking the event loop
+        :return: Dictionary of collected results
+        '''
+        results = {"leg":self.leg}
+        results["positions"] = await self.read_pos() # Command 28
+        results["temps"] = await self.read_temp() # Command 26
+        results["vins"] = await self.read_vin() # Command 27
+        results["offsets"] = (await self.shoulder.read_offset(), await self.knee.read_offset(),
+                              await self.ankle.read_offset()) # Command 19
+        return results # Return data
+
 if __name__ == '__main__':
     import pigpio # Standard Raspberry Pi GPIO library
     pi = pigpio.pi() # Create a Raspberry Pi object
@@ -0,0 +1,230 @@
+#!/usr/bin/python3
+# encoding: utf-8
+# Copyright ians.moyes@gmail.com
+
+# Class to queue up joint moves & play them back to back without stopping in between.
+# Each move is sent to the servos as a standby position while the one before it is still running,
+# then started for every servo at once with a single trigger frame, just in time. Where one move
+# turns a corner into the next, the next is started a little early so the joints round the corner
+# instead of stopping on it, like the look-ahead of a CNC machine.
+#
+#     queue = Motion_Queue(pi)
+#     queue.start()
+#     queue.add(positions, 300) # Returns at once. positions [6, 3] or [18]
+#     queue.add_toes(coords, 300, exact=True) # Toe coordinates [6, 3], stopping exactly there
+#     queue.wait() # Until every move has finished
+
+import importlib # Standard library to import modules by name
+import threading # Standard multi-tasking library
+import time # Standard library of time, diary & calendar functions
+from collections import deque # Standard library double ended queue
+import numpy as np # Numerical array library
+import config # Bus Servo protocol definitions
+import Trajectory # Joint trajectories & the servo speed limit
+from SerialServoClass import Serial_Servo as Servo # Bus Serial Servo control class
+
+IK = importlib.import_module("2DIK") # Inverse kinematics. The name starts with a digit
+
+class Motion_Queue():
+    ''' This is a class to define a thread which plays queued joint moves.
+    Moves are queued from any thread without waiting. Each move ends at a time, not when it's sent
+    '''
+
+    def __init__(self, pi, ids=Trajectory.all_ids, lead=0.03, blend=100, blend_share=0.25):
+        '''
+        :param pi: the Raspberry Pi
+        :param ids: array of servo IDs, the shape of the positions added. Default every joint, [6, 3]
+        :param lead: time allowed to send the standby positions before a trigger, in seconds
+        :param blend: longest a move may be started early to round a corner, in mS
+        :param blend_share: most of the shorter of two moves that may be spent rounding their corner
+        '''
+
+        self.pi = pi # Attach the queue to the Raspberry Pi
+        self.ids = np.asarray(ids)
+        self.lead = lead
+        self.blend = blend / 1000
+        self.blend_share = blend_share
+        self.moves = deque() # (positions, time in seconds, exact) waiting to be sent
+        self.pending = 0 # Moves taken off the queue that haven't been triggered yet
+        self.ready = threading.Condition() # Notified when a move is queued or triggered
+        self.start_pos = None # Where the move in progress started, array the shape of ids
+        self.end_pos = None # Where it ends
+        self.started = 0.0 # time.monotonic() it was triggered
+        self.ends = 0.0 # time.monotonic() it ends
+        self.exact = True # It must end exactly on its positions
+        # Counters
+        self.sent = 0 # Moves triggered
+        self.blended = 0 # Moves started early to round a corner
+        self.stretched = 0 # Moves slowed down to keep within the servo's top speed
+        self.late = 0 # Moves queued too late to follow on without a stop
+        self.errors = 0 # Moves that couldn't be sent
+        self.halt = threading.Event() # Set to stop the thread
+        self.thread = None
+
+    def add(self, positions, tim, exact=False):
+        '''
+        Queue a move. Returns at once
+        :param positions: array of servo positions, the same shape as ids
+        :param tim: time for the move in mS
+        :param exact: True = stop on the positions. False = the corner into the next move may be rounded
+        :return: True = queued or "Position out of range"
+        '''
+
+        positions = np.asarray(positions, dtype=np.int64).reshape(self.ids.shape)
+        limits = config.BS_rotate_limits
+        if np.any((positions < limits[0]) | (positions > limits[1])): return "Position out of range" # Nothing is queued
+        with self.ready:
+            self.moves.append((positions, tim / 1000, exact))
+            self.ready.notify_all() # The thread & anybody waiting
+        return True
+
+    def add_toes(self, coords, tim, exact=False):
+        '''
+        Queue a move of every leg to toe coordinates
+        :param coords: array [6, 3] of toe coordinates, one row for each leg
+        :param tim: time for the move in mS
+        :param exact: True = stop on the positions. False = the corner into the next move may be rounded
+        :return: True = queued, "Position too far" or "Position out of range"
+        '''
+
+        positions, reachable = IK.inverse_kin_batch(coords)
+        if not reachable.all(): return "Position too far" # Like inverse_kin, nothing is queued
+        return self.add(positions, tim, exact)
+
+    @property # Allows method to be used like a variable without ()
+    def idle(self):
+        '''
+        True when every move has been sent & finished
+        '''
+
+        with self.ready:
+            return not self.moves and not self.pending and time.monotonic() >= self.ends
+
+    def wait(self, timeout=None):
+        '''
+        Wait for every queued move to finish
+        :param timeout: longest to wait in seconds, None = for ever
+        :return: True if they have all finished
+        '''
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.ready:
+            while self.moves or self.pending or time.monotonic() < self.ends:
+                now = time.monotonic()
+                if deadline is not None and now >= deadline: return False
+                # Nothing more will be triggered, so nobody notifies when the last move finishes
+                wait = None if self.moves or self.pending else self.ends - now
+                if deadline is not None: wait = deadline - now if wait is None else min(wait, deadline - now)
+                self.ready.wait(wait)
+        return True
+
+    def clear(self):
+        '''
+        Throw away the moves that haven't been sent. The move in progress carries on
+        '''
+
+        with self.ready:
+            self.moves.clear()
+            self.ready.notify_all()
+
+    def start(self):
+        '''
+        Start playing moves in the background
+        '''
+
+        self.halt.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        '''
+        Stop playing moves. The move in progress carries on, the rest are thrown away
+        '''
+
+        self.halt.set()
+        with self.ready:
+            self.moves.clear()
+            self.ready.notify_all()
+        if self.thread is not None: self.thread.join()
+
+    def where(self, now):
+        '''
+        :param now: time.monotonic()
+        :return: where the joints should be, part way through the move in progress
+        '''
+
+        if self.start_pos is None or now >= self.ends: return self.end_pos
+        share = (now - self.started) / (self.ends - self.started)
+        return self.start_pos + share * (self.end_pos - self.start_pos) # The servos move in a straight line
+
+    def dispatch(self, positions, duration, exact):
+        '''
+        Send the next move as standby positions & trigger it at the right moment
+        :return: True = Success or error code
+        '''
+
+        now = time.monotonic()
+        if self.end_pos is None: trigger = now + self.lead # The first move
+        else:
+            blend = 0.0
+            if not self.exact: # Round the corner
+                blend = min(self.blend, self.blend_share * min(duration, self.ends - self.started))
+            trigger = self.ends - blend
+            if trigger < now + self.lead: # Queued too late to start on time
+                if now + self.lead > self.ends: self.late += 1
+                trigger = now + self.lead
+            if trigger < self.ends: self.blended += 1
+        arrive = max(trigger, self.ends) + duration # When the move was meant to finish
+        start_pos = self.where(trigger)
+        if start_pos is not None: # Slow down if a joint would go faster than the servos can
+            shortest = Trajectory.min_time(start_pos, positions, "linear") / 1000
+            if shortest > arrive - trigger:
+                arrive = trigger + shortest
+                self.stretched += 1
+        tim = int(round(1000 * (arrive - trigger)))
+
+        cmds = [(int(id), Servo.MOVE_TIME_WAIT_WRITE, int(pos), tim) for id, pos in zip(self.ids.flat, positions.flat)]
+        result = Servo.send_many(self.pi, cmds) # Sent now, the servos wait for the trigger
+        if result != True: return result
+        wait = trigger - time.monotonic()
+        if wait > 0 and self.halt.wait(wait): return True
+        # Every servo starts at once. Not trigger_all, which would be staged if there's a stager
+        result = Servo.send_many(self.pi, [(Servo.broadcast_id, Servo.MOVE_START)])
+        with self.ready:
+            self.start_pos = start_pos if start_pos is not None else positions
+            self.end_pos = positions
+            self.started, self.ends, self.exact = trigger, arrive, exact
+            self.sent += 1
+        return result
+
+    def run(self): # This is the code for the multi-tasking thread
+        while not self.halt.is_set():
+            with self.ready:
+                while not self.moves and not self.halt.is_set(): self.ready.wait(0.1)
+                if self.halt.is_set(): break
+                positions, duration, exact = self.moves.popleft()
+                self.pending += 1 # Not idle until it has been triggered
+            if self.dispatch(positions, duration, exact) != True: self.errors += 1
+            with self.ready: # Triggered or given up on. ends has been set
+                self.pending -= 1
+                self.ready.notify_all()
+
+if __name__ == '__main__':
+    import pigpio # Standard Raspberry Pi GPIO library
+    import RPiExpCom as Ctrl # Raspberry Pi expansion board communication driver
+    pi = pigpio.pi() # Create a Raspberry Pi object
+    Ctrl.portinit(pi) # Initialise the read/write switch
+
+    queue = Motion_Queue(pi)
+    queue.start()
+    start = time.monotonic()
+    square = ((0, 140, 120), (50, 140, 120), (50, 140, 100), (0, 140, 100)) # A square with each toe
+    for lap in range(2):
+        for corner in square: queue.add_toes(np.tile(corner, (6, 1)), 250)
+    queue.add_toes(np.tile(square[0], (6, 1)), 250, exact=True)
+    queue.wait()
+    print("9 moves of 250 mS in %.2f s" % (time.monotonic() - start))
+    print("Sent", queue.sent, "blended", queue.blended, "stretched", queue.stretched, "late", queue.late,
+          "errors", queue.errors)
+    queue.stop()
+    print("Motion queue tests complete!")
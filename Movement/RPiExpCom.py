@@ -6,47 +6,53 @@
 
 # Library to control the HiWonder Bus Serial Servo Control Raspberry Pi expansion board
 
+import asyncio # Standard asynchronous I/O library, to tell which coroutine is running
+import os # Standard operating system interface
 import serial # Standard library to define serial ports
 import time # Standard library of time, diary & calendar functions
 import ctypes # Standard library to manipulate C++ number types
+import threading # Standard multi-tasking library
+from collections import deque # Standard library double ended queue
+import config # Bus Servo protocol definitions
+import BusCapture # Bus traffic capture file format
 
 SERVO_FRAME_HEADER = b'\x55\x55' # Define data frame header
 TRINKET_FRAME_HEADER = b'\x25\x25' # Define data frame header
 
-UART = serial.Serial("/dev/ttyAMA0", 115200)  # 初始化串口， 波特率为115200
-                                                  # Initialize the UART, baud rate 115200
+BAUD_RATE = 115200 # UART baud rate
+BITS_PER_BYTE = 10 # Each byte on the wire is a start bit, 8 data bits & a stop bit
+REPLY_LATENCY = 0.002 # Time allowed for a servo to start replying, in seconds
+READ_TIMEOUT = 1 # Never spend more than 1 second on a read request
+LATENCY_WINDOW = 64 # Number of recent reply latencies kept for each servo & command
+LATENCY_MIN_SAMPLES = 8 # Replies needed before the timeout is based on the measurements
+LATENCY_MARGIN = 0.0005 # Added to the 99th percentile latency to make the timeout, in seconds
+READ_RETRIES = 3 # Attempts at a read from a servo that has been answering
+DEAD_RETRIES = 1 # Attempts at a read from a servo that hasn't
+DEAD_AFTER = 2 # Failed reads in a row before a servo is treated as not answering
 
-# This port is used as a switch to tell the Raspberry Pi Expansion Boad whether it should
-# expect data or it is expected to send data over the UART
-def portinit(pi):
-    import pigpio # Standard Raspberry Pi GPIO library
-    pi.set_mode(17, pigpio.OUTPUT)  # 配置RX_CON 即 GPIO17 为输出
-                                    # Configure RX_CON on GPIO17 as output
-    pi.write(17, 0) # Pulldown RX_CON
-    pi.set_mode(27, pigpio.OUTPUT)  # 配置TX_CON 即 GPIO27 为输出
-                                    # Configure TX_CON on GPIO27 as output
-    pi.write(27, 1) # Pullup TX_CON
-
-def portWrite(pi):  # 配置单线串口为输出 Switch the Raspberry Pi expansion board to read mode
-    pi.write(17, 0)  # 拉低RX_CON 即 GPIO17 Pulldown RX_CON (GPIO17)
-    pi.write(27, 1)  # 拉高TX_CON 即 GPIO27 Pullup TX_CON (GPIO27)
-
-def portRead(pi):  # 配置单线串口为输入 Switch the Raspberry Pi expansion board to read mode
-    pi.write(17, 1)  # 拉高RX_CON 即 GPIO17 Pullup RX_CON (GPIO17) 
-    pi.write(27, 0)  # 拉低TX_CON 即 GPIO27 Pulldown TX_CON (GPIO27)
-
-def portReset(pi): # Reset the Raspberry Pi expansion board
-    time.sleep(0.1) # Pause
-    UART.close() # Close the UART
-    pi.write(17, 1) # GPIO17 Pullup RX_CON (GPIO17)
-    pi.write(27, 1) # GPIO27 Pullup TX_CON (GPIO27)
-    UART.open() # Open the UART
-    time.sleep(0.1) # Pause
-
-def portOff(pi): # Close the Raspberry Pi expansion board
-    UART.close() # Close the UART
-    pi.write(17, 0) # GPIO17 Pulldown RX_CON (GPIO17)
-    pi.write(27, 0) # GPIO27 Pulldown TX_CON (GPIO27)
+capture = None # BusCapture.Capture_Writer recording the bus traffic, or None
+
+def start_capture(path):
+    '''
+    Start recording every frame sent & received. See BusCapture.py
+    :param path: capture file. Appended to if it already exists
+    :return: BusCapture.Capture_Writer
+    '''
+    global capture
+
+    stop_capture()
+    capture = BusCapture.Capture_Writer(path, BAUD_RATE)
+    return capture
+
+def stop_capture():
+    '''
+    Stop recording & close the capture file
+    '''
+    global capture
+
+    if capture is not None:
+        capture.close()
+        capture = None
 
 def checksum(buf):
     ''' 计算校验和 Calculate the checksum
@@ -60,121 +66,730 @@ def checksum(buf):
     sum = ~sum  # 取反 Negate the sum (change the sign)
     return sum & 0xff # return the 8 least significant bits
 
-def serial_servo_write_cmd(pi, id, w_cmd, dat1=None, dat2=None):
+def encode_frame(buf, offset, id, w_cmd, dat1=None, dat2=None):
     '''
-    写指令 Send command to the Raspberry Pi expansion board
+    Encode a servo command as a data frame, directly into a transmit buffer
+    :param buf: bytearray to encode the frame into. It is extended if it's too short
+    :param offset: index in buf where the frame starts
     :param id: servo ID to be written to
     :param w_cmd: The servo command to send
     :param dat1: First servo command parameter
     :param dat2: Second servo command parameter
-    :return: Error code or True = Success
+    :return: index in buf after the end of the frame
     '''
 
-    portWrite(pi) # Switch Raspberry Pi expansion board to write mode
+    if dat2 is not None: length = 7 # 指令长度 Determine the data frame length
+    elif dat1 is not None: length = 4
+    else: length = 3
 
-    buf = bytearray()
+    end = offset + length + 3 # Header, data & checksum
+    if len(buf) < end: buf.extend(bytes(end - len(buf))) # Make room for the frame
 
-    buf.append(id) # Append the servo ID
+    buf[offset:offset + 5] = SERVO_FRAME_HEADER + bytes((id, length, w_cmd)) # 帧头 Header, ID, length & command
 
-    if dat2 is not None: # 指令长度 Determine & append the data frame length
-        buf.append(7)
-    elif dat1 is not None:
-        buf.append(4)
-    else: buf.append(3)
-
-    buf.append(w_cmd)  # 指令 Append the servo command
-
-    # 写数据 Append the parameters
+    # 写数据 Insert the parameters
     if dat2 is not None: # If there are 2 parameters
-        # Append the least significant & next least significant 8 bits of the 1st parameter
-        buf.extend([(0xff & dat1), (0xff & (dat1 >> 8))])  # 分低8位 高8位 放入缓存
-        # Append the least significant & next least significant 8 bits of the 2nd parameter
-        buf.extend([(0xff & dat2), (0xff & (dat2 >> 8))])  # 分低8位 高8位 放入缓存
+        dat1 = int(dat1)
+        dat2 = int(dat2)
+        # The least significant & next least significant 8 bits of each parameter
+        buf[offset + 5:offset + 9] = bytes(((0xff & dat1), (0xff & (dat1 >> 8)), (0xff & dat2), (0xff & (dat2 >> 8))))
     elif dat1 is not None: # If there is 1 parameter
-        buf.append(dat1 & 0xff) # Append the least significant 8 bits of the parameter
+        buf[offset + 5] = int(dat1) & 0xff # The least significant 8 bits of the parameter
 
-    buf.append(checksum(buf)) # 校验和 Append the checksum
+    buf[end - 1] = checksum(buf[offset + 2:end - 1]) # 校验和 Insert the checksum
+    return end
 
-    frame = bytearray(SERVO_FRAME_HEADER) + buf  # 帧头 Prepend the data frame header
 
-    UART.write(frame)  # 发送 Transmit data frame over UART
+class Frame_Parser():
+    ''' Incremental parser for Bus Servo data frames.
+    Bytes are fed in as they arrive from the UART. The parser synchronises on the frame header,
+    then collects the ID, length, command, parameters & checksum. Complete frames with a valid
+    checksum are queued in self.frames as (id, command, parameters). Incomplete frames are
+    kept until the rest of their bytes arrive.
+    '''
+    min_length = 3 # Shortest data length. ID, length & command with no parameters
+    max_length = 7 # Longest data length. 4 parameters
+
+    def __init__(self):
+        self.buffer = bytearray() # Bytes received but not yet parsed
+        self.frames = deque() # Complete frames waiting to be collected
+        self.errors = 0 # Number of corrupt frames thrown away
+
+    def feed(self, data):
+        '''
+        Add received bytes to the parser & extract any complete frames
+        :param data: bytes read from the UART
+        :return: Number of complete frames waiting to be collected
+        '''
+
+        self.buffer += data # Append the new bytes
+        while True:
+            start = self.buffer.find(SERVO_FRAME_HEADER) # Look for the frame header
+            if start < 0: # No header in the buffer
+                keep = 1 if self.buffer[-1:] == SERVO_FRAME_HEADER[:1] else 0 # Keep half a header
+                if capture is not None and len(self.buffer) > keep:
+                    capture.record(BusCapture.RX, BusCapture.JUNK, self.buffer[:len(self.buffer) - keep])
+                del self.buffer[:len(self.buffer) - keep]
+                break
+            if capture is not None and start > 0: capture.record(BusCapture.RX, BusCapture.JUNK, self.buffer[:start])
+            del self.buffer[:start] # Throw away anything before the header
+            if len(self.buffer) < 4: break # Wait for the length byte
+            length = self.buffer[3] # Extract the length of the data (excluding frame header)
+            if length < Frame_Parser.min_length or length > Frame_Parser.max_length:
+                if capture is not None: capture.record(BusCapture.RX, BusCapture.BAD_LENGTH, self.buffer[:4])
+                del self.buffer[:1] # Not a real header, resynchronise on the next byte
+                self.errors += 1
+                continue
+            end = length + 3 # Header, data & checksum
+            if len(self.buffer) < end: break # Wait for the rest of the frame
+            if self.buffer[end - 1] == checksum(self.buffer[2:end - 1]): # Do the checksums match?
+                self.frames.append((self.buffer[2], self.buffer[4], bytes(self.buffer[5:end - 1])))
+                if capture is not None: capture.record(BusCapture.RX, BusCapture.OK, self.buffer[:end])
+                del self.buffer[:end] # Remove the frame, keep any trailing bytes
+            else:
+                if capture is not None: capture.record(BusCapture.RX, BusCapture.BAD_CHECKSUM, self.buffer[:end])
+                del self.buffer[:1] # Corrupt frame, resynchronise on the next byte
+                self.errors += 1
+        return len(self.frames)
+
+def frame_time(length):
+    '''
+    Time taken to transmit a data frame over the UART
+    :param length: data length of the frame (excluding frame header & checksum)
+    :return: transmission time in seconds
+    '''
+    return (length + 3) * BITS_PER_BYTE / BAUD_RATE
 
-    return True # Tell the World how clever you were
+def reply_timeout(r_cmd):
+    '''
+    How long to wait for the reply to a read command
+    :param r_cmd: The servo read command
+    :return: timeout in seconds
+    '''
+    return REPLY_LATENCY + frame_time(config.BS_reply_lengths[r_cmd - 1])
 
-def serial_servo_read_cmd(pi, id, r_cmd):
+class Latency_Stats():
+    ''' Reply latency statistics for one servo & read command.
+    The latency is the time from the request leaving the UART until the whole reply has arrived.
+    The read timeout & number of attempts are derived from the recent latencies
     '''
-    发送读取命令 Send request for data to the Raspberry Pi expansion board & return result
-    :param id: servo_id to be interrogated
-    :param r_cmd: The servo command to be responded to
-    :return: 数据 Data returned from the servo
-    '''
-
-    prev = time.time() # Take a time stamp
-    UART.flushInput()  # 清空接收缓存 Clear the UART receive buffer
-    while time.time() < prev + 1: # Repeat for 1 second
-        write_ok = serial_servo_write_cmd(pi, id, r_cmd) # Write data
-        if write_ok == True: # If the write command succeeded
-
-            time.sleep(0.00034) # Pause for an oddly specific period of time
-        
-            portRead(pi)  # 将单线串口配置为输入 Switch UART to read mode
-
-            for i in range(20): # Repeat 5 times
-                results = collect_serial_servo_data(r_cmd) # Read the data back
-                if results != None: # If data is collected
-                    return results # Send it back
-
-    return "Comms" # If it just didn't work, report
-
-def collect_serial_servo_data(r_cmd):
-    time.sleep(0.00034) # Pause for an oddly specific period of time
-    # time.sleep(0.005)  # 稍作延时，等待接收完毕 Pause while the data reception is completed
-    count = UART.inWaiting() # 获取接收缓存中的字节数 Get the receive buffer length (bytes)
-    if count != 0: # 如果接收到的数据不空 If the buffer is not empty
-        recv_data = UART.read(count) # 读取接收到的数据 Read the buffer
-        UART.flushInput() # 清空接收缓存 Clear the buffer
-        try:
-            data_ok = recv_data[-1] == checksum(recv_data[2:-1]) # Do the checksums match?
-            data_ok = data_ok and recv_data[4] == r_cmd # Do the receive commands match?
-            # Does the data have a valid header
-            data_ok = data_ok and recv_data[0:2] == SERVO_FRAME_HEADER
-            if data_ok:
-                dat_len = recv_data[3] # Extract the length of the data (excluding frame header)
-                if dat_len == 4: # 1 parameter
-                    return recv_data[5] # Answer to the question we asked
-                elif dat_len == 5: # 2 parameters
-                    pos = 0xffff & (recv_data[5] | (0xff00 & (recv_data[6] << 8)))
-                    return ctypes.c_int16(pos).value
-                elif dat_len == 7: # 4 Parameters
-                    pos1 = 0xffff & (recv_data[5] | (0xff00 & (recv_data[6] << 8)))
-                    pos2 = 0xffff & (recv_data[7] | (0xff00 & (recv_data[8] << 8)))
-                    return ctypes.c_int16(pos1).value, ctypes.c_int16(pos2).value
-        except BaseException as e: # If it all went wrong
-            print(e) # Print the explanation
-    return None # If the data frame was empty, or corrupt
 
-def TrinketM0_write_data(id, colour):
+    def __init__(self, r_cmd):
+        self.default_timeout = reply_timeout(r_cmd) # Timeout until enough replies are measured
+        self.min_timeout = frame_time(config.BS_reply_lengths[r_cmd - 1]) # The reply can't be quicker
+        self.samples = deque(maxlen=LATENCY_WINDOW) # Recent latencies, in seconds
+        self.ordered = None # Sorted copy of the samples, made when needed
+        self.replies = 0 # Replies received
+        self.timeouts = 0 # Attempts that timed out
+        self.failures = 0 # Reads that failed in a row
+
+    def add(self, latency):
+        '''
+        Record the latency of a reply
+        '''
+
+        self.samples.append(latency)
+        self.ordered = None # Needs sorting again
+        self.replies += 1
+        self.failures = 0
+
+    def percentile(self, p):
+        '''
+        :param p: percentile 0 - 100
+        :return: latency in seconds or None if nothing has been measured
+        '''
+
+        if not self.samples: return None
+        if self.ordered is None: self.ordered = sorted(self.samples)
+        return self.ordered[min(int(p / 100 * len(self.ordered)), len(self.ordered) - 1)]
+
+    @property # Allows method to be used like a variable without ()
+    def timeout(self):
+        '''
+        How long to wait for a reply, in seconds
+        '''
+
+        if len(self.samples) < LATENCY_MIN_SAMPLES: return self.default_timeout
+        return max(self.percentile(99) + LATENCY_MARGIN, self.min_timeout)
+
+    @property # Allows method to be used like a variable without ()
+    def attempts(self):
+        '''
+        How many times to send the request before giving up
+        '''
+
+        return DEAD_RETRIES if self.failures >= DEAD_AFTER else READ_RETRIES
+
+    def report(self):
+        '''
+        :return: Dictionary of the statistics
+        '''
+
+        return {"replies":self.replies, "timeouts":self.timeouts, "failures":self.failures,
+                "p50":self.percentile(50), "p90":self.percentile(90), "p99":self.percentile(99),
+                "timeout":self.timeout, "attempts":self.attempts}
+
+latency = {} # Reply latency statistics. (id, read command): Latency_Stats
+
+def get_latency(id, r_cmd):
     '''
-    Send data to the TrinketM0 via the Raspberry Pi expansion board
-    :param id: LED ID to be addressed 0 ~ 11 = face lights, 12 = head/tail lights
-    :param colour: the colour, or direction codes to be transmitted
+    Find or create the reply latency statistics for a servo & read command
+    :return: Latency_Stats
+    '''
+
+    stats = latency.get((id, r_cmd))
+    if stats is None: stats = latency[(id, r_cmd)] = Latency_Stats(r_cmd)
+    return stats
+
+def latency_stats(id=None):
+    '''
+    Report the reply latency statistics
+    :param id: Only report this servo. None = all of them
+    :return: Dictionary of (id, read command): statistics dictionary
+    '''
+
+    return {key: stats.report() for key, stats in latency.items() if id is None or key[0] == id}
+
+def decode_params(params):
+    '''
+    Convert the parameters of a reply into values
+    :param params: the parameter bytes of the reply
+    :return: 1 byte value, signed 16 bit value, or tuple of 2 signed 16 bit values
+    '''
+
+    if len(params) == 1: # 1 parameter
+        return params[0] # Answer to the question we asked
+    elif len(params) == 2: # 2 parameters
+        return ctypes.c_int16(params[0] | (params[1] << 8)).value
+    elif len(params) == 4: # 4 Parameters
+        pos1 = ctypes.c_int16(params[0] | (params[1] << 8)).value
+        pos2 = ctypes.c_int16(params[2] | (params[3] << 8)).value
+        return pos1, pos2
+    return None # Not a reply we understand
+
+WRITE = 1 # Transceiver directions
+READ = 2
+
+class Bus_Lock():
+    ''' This is a class to define the lock of a servo bus. Like threading.RLock, the thread holding it
+    can take it again, but a coroutine (AsyncBus) can hold it across awaits, when other coroutines
+    in the same thread would take it too & talk over the transaction. They get an error instead
+    '''
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.depth = 0 # Times the holder has taken the lock
+        self.task = None # asyncio task holding the lock across awaits, None = a thread holds it
+
+    def acquire(self, blocking=True, task=None):
+        '''
+        :param blocking: False = return at once if another thread has the lock
+        :param task: asyncio task that will hold the lock across awaits
+        :return: True if the lock was taken
+        '''
+
+        if not self.lock.acquire(blocking): return False
+        if self.task is not None and self.task is not current_task(): # Same thread, another coroutine
+            self.lock.release()
+            raise RuntimeError("Servo bus held by a coroutine. Use AsyncBus from coroutines")
+        if self.depth == 0: self.task = task
+        self.depth += 1
+        return True
+
+    def release(self):
+        self.depth -= 1
+        if self.depth == 0: self.task = None
+        self.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
+
+def current_task():
+    '''
+    :return: the asyncio task running in this thread, or None
+    '''
+
+    try:
+        return asyncio.current_task()
+    except RuntimeError: # No event loop running in this thread
+        return None
+
+class Serial_Bus():
+    ''' This is a class to define one half duplex servo bus: a UART & the pair of GPIOs that
+    switch its transceiver between read & write. Every transaction on the bus holds self.lock,
+    so threads & coroutines sharing the bus never collide
+    '''
+
+    def __init__(self, port, rx_con=17, tx_con=27, ids=()):
+        '''
+        :param port: UART device, or a pyserial URL
+        :param rx_con: GPIO that enables the receiver
+        :param tx_con: GPIO that enables the transmitter
+        :param ids: IDs of the servos on the bus
+        '''
+
+        self.port = port
+        self.uart = serial.serial_for_url(port, BAUD_RATE)  # 初始化串口， 波特率为115200
+                                                            # Initialize the UART, baud rate 115200
+        self.rx_con = rx_con
+        self.tx_con = tx_con
+        self.ids = tuple(ids)
+        self.lock = Bus_Lock() # Only one transaction on the UART at a time
+        self.parser = Frame_Parser() # Parser for the replies from the Bus Servos
+        self.tx_buffer = bytearray(10 * config.BS_num_servos) # Transmit buffer, with room for a full frame for every servo
+        self.direction = None # The direction the transceiver is switched to. None = not known
+        # Each pigpio call is a round trip to the pigpiod daemon, so the pins are only switched when
+        # the direction changes. Switching to read mode is done by a script stored in the daemon, 1 call.
+        # Scripts run in their own thread in the daemon, so they may finish a little after run_script
+        # returns. That's fine for read mode, the servo takes longer than that to start replying.
+        # Switching to write mode has to be finished before the UART starts transmitting, so it's
+        # done with a bank clear & a bank set, which are finished when they return
+        self.read_script = None # pigpio script ID to switch to read mode or None to use the bank functions
+        self.switch_calls = 0 # Number of direction switches made
+        self.busy = 0.0 # Time the bus has spent transmitting or waiting for replies, in seconds
+
+    def attach(self, uart):
+        '''
+        Use a different UART for the bus. e.g. ServoEmulator.Emulated_UART
+        :param uart: object with the pyserial Serial methods
+        '''
+
+        with self.lock: # Not in the middle of a transaction
+            self.uart = uart
+            self.parser.buffer.clear() # Anything half received came from the old UART
+            self.parser.frames.clear()
+
+    # These ports are used as a switch to tell the transceiver whether it should
+    # expect data or it is expected to send data over the UART
+    def portinit(self, pi):
+        import pigpio # Standard Raspberry Pi GPIO library
+        pi.set_mode(self.rx_con, pigpio.OUTPUT)  # 配置RX_CON 即 GPIO17 为输出
+                                                 # Configure RX_CON on GPIO17 as output
+        pi.write(self.rx_con, 0) # Pulldown RX_CON
+        pi.set_mode(self.tx_con, pigpio.OUTPUT)  # 配置TX_CON 即 GPIO27 为输出
+                                                 # Configure TX_CON on GPIO27 as output
+        pi.write(self.tx_con, 1) # Pullup TX_CON
+        self.direction = WRITE
+
+        if self.read_script is None:
+            try: # Pulldown TX_CON & pullup RX_CON
+                script = pi.store_script(b"bc1 %d bs1 %d" % (1 << self.tx_con, 1 << self.rx_con))
+                while pi.script_status(script)[0] == pigpio.PI_SCRIPT_INITING: # Wait for pigpiod to get it ready
+                    time.sleep(0.001)
+                self.read_script = script
+            except Exception: # No scripts, use the bank functions
+                self.read_script = None
+
+    def portWrite(self, pi):  # 配置单线串口为输出 Switch the transceiver to write mode
+        if self.direction == WRITE: return # Already switched
+        pi.clear_bank_1(1 << self.rx_con)  # 拉低RX_CON 即 GPIO17 Pulldown RX_CON (GPIO17)
+        pi.set_bank_1(1 << self.tx_con)  # 拉高TX_CON 即 GPIO27 Pullup TX_CON (GPIO27)
+        self.direction = WRITE
+        self.switch_calls += 1
+
+    def portRead(self, pi):  # 配置单线串口为输入 Switch the transceiver to read mode
+        if self.direction == READ: return # Already switched
+        if self.read_script is not None: pi.run_script(self.read_script)
+        else:
+            pi.clear_bank_1(1 << self.tx_con)  # 拉低TX_CON 即 GPIO27 Pulldown TX_CON (GPIO27)
+            pi.set_bank_1(1 << self.rx_con)  # 拉高RX_CON 即 GPIO17 Pullup RX_CON (GPIO17)
+        self.direction = READ
+        self.switch_calls += 1
+
+    def portReset(self, pi): # Reset the transceiver
+        time.sleep(0.1) # Pause
+        self.uart.close() # Close the UART
+        pi.write(self.rx_con, 1) # GPIO17 Pullup RX_CON (GPIO17)
+        pi.write(self.tx_con, 1) # GPIO27 Pullup TX_CON (GPIO27)
+        self.direction = None # Neither read nor write
+        self.uart.open() # Open the UART
+        time.sleep(0.1) # Pause
+
+    def portOff(self, pi): # Close the transceiver
+        self.uart.close() # Close the UART
+        pi.write(self.rx_con, 0) # GPIO17 Pulldown RX_CON (GPIO17)
+        pi.write(self.tx_con, 0) # GPIO27 Pulldown TX_CON (GPIO27)
+        self.direction = None # Neither read nor write
+        if self.read_script is not None: # Tidy up pigpiod
+            pi.delete_script(self.read_script)
+            self.read_script = None
+
+    def write_cmd(self, pi, id, w_cmd, dat1=None, dat2=None):
+        '''
+        写指令 Send command to the servos on this bus
+        :param id: servo ID to be written to
+        :param w_cmd: The servo command to send
+        :param dat1: First servo command parameter
+        :param dat2: Second servo command parameter
+        :return: Error code or True = Success
+        '''
+
+        with self.lock: # Wait for any other transaction to finish
+            self.portWrite(pi) # Switch the transceiver to write mode
+
+            end = encode_frame(self.tx_buffer, 0, id, w_cmd, dat1, dat2) # Build the data frame
+
+            self.uart.write(self.tx_buffer[:end])  # 发送 Transmit data frame over UART
+            self.busy += end * BITS_PER_BYTE / BAUD_RATE
+            if capture is not None: capture.record(BusCapture.TX, BusCapture.OK, self.tx_buffer[:end])
+
+        return True # Tell the World how clever you were
+
+    def write_many(self, pi, cmds):
+        '''
+        Send several servo commands in a single UART transmission
+        :param cmds: sequence of (id, w_cmd, dat1, dat2) tuples. dat1 & dat2 may be None or left out
+        :return: Error code or True = Success
+        '''
+
+        with self.lock: # Wait for any other transaction to finish
+            buf = self.tx_buffer
+            end = 0
+            for cmd in cmds: # Encode all of the frames back to back
+                end = encode_frame(buf, end, *cmd)
+            return self.write_frames(pi, buf[:end])
+
+    def write_frames(self, pi, frames):
+        '''
+        Send servo frames that have already been encoded, in a single UART transmission
+        :param frames: bytes-like object of complete frames, headers & checksums included
+        :return: Error code or True = Success
+        '''
+
+        end = len(frames)
+        if end == 0: return True # Nothing to send
+        with self.lock: # Wait for any other transaction to finish
+            self.portWrite(pi) # Switch the transceiver to write mode
+
+            self.uart.write(frames)  # Transmit all the data frames over UART
+            self.busy += end * BITS_PER_BYTE / BAUD_RATE
+            if capture is not None: # Record each frame separately
+                start = 0
+                while start < end:
+                    length = frames[start + 3] + 3 # Header, data & checksum
+                    capture.record(BusCapture.TX, BusCapture.OK, bytes(frames[start:start + length]))
+                    start += length
+
+        return True # Tell the World how clever you were
+
+    def read_cmd(self, pi, id, r_cmd):
+        '''
+        发送读取命令 Send request for data to a servo on this bus & return result
+        :param id: servo_id to be interrogated
+        :param r_cmd: The servo command to be responded to
+        :return: 数据 Data returned from the servo
+        '''
+
+        prev = time.time() # Take a time stamp
+        stats = get_latency(id, r_cmd) # How quickly this servo usually answers
+        timeout = stats.timeout # Time for the servo to answer & the reply to arrive
+        with self.lock: # Keep the bus until the reply arrives
+            for attempt in range(stats.attempts): # A few times, unless the servo isn't answering
+                if time.time() >= prev + READ_TIMEOUT: break # Never longer than 1 second
+                results = self.read_attempt(pi, id, r_cmd, timeout)
+                if results is not None: return results # Send it back
+            stats.failures += 1
+            if capture is not None: capture.record(BusCapture.EVENT, BusCapture.FAILED, bytes((id, r_cmd)))
+
+        return "Comms" # If it just didn't work, report
+
+    def read_attempt(self, pi, id, r_cmd, timeout):
+        '''
+        Send one request for data & wait for the reply
+        :param id: servo_id to be interrogated
+        :param r_cmd: The servo command to be responded to
+        :param timeout: How long to wait for the reply, in seconds
+        :return: Data returned from the servo or None
+        '''
+
+        stats = get_latency(id, r_cmd)
+        with self.lock: # Keep the bus until the reply arrives
+            write_ok = self.write_cmd(pi, id, r_cmd) # Write data
+            if write_ok == True: # If the write command succeeded
+                self.uart.flush() # Wait until the request has left the UART
+
+                self.portRead(pi)  # 将单线串口配置为输入 Switch UART to read mode
+
+                sent = time.monotonic() # Start timing the reply
+                results = self.collect(id, r_cmd, timeout) # Read the data back
+                waited = time.monotonic() - sent
+                self.busy += waited # The bus is tied up until the reply arrives or the wait times out
+                if results is not None: # If data is collected
+                    stats.add(waited) # Record how long it took
+                    return results
+            stats.timeouts += 1
+            if capture is not None: capture.record(BusCapture.EVENT, BusCapture.TIMEOUT, bytes((id, r_cmd)))
+        return None
+
+    def collect(self, id, r_cmd, timeout):
+        '''
+        Wait for the reply to a read command
+        :param id: servo_id that was interrogated
+        :param r_cmd: The servo command to be responded to
+        :param timeout: How long to wait for the reply, in seconds
+        :return: Data returned from the servo or None
+        '''
+
+        uart = self.uart
+        parser = self.parser
+        deadline = time.monotonic() + timeout # When to give up
+        if uart.timeout != timeout: uart.timeout = timeout # Block reads for no longer than a reply
+        length = config.BS_reply_lengths[r_cmd - 1] # Data length of the reply
+        frame_len = length + 3 # Bytes in a complete reply
+        while True:
+            while parser.frames: # Collect the frames received so far
+                r_id, cmd, params = parser.frames.popleft()
+                # Is it the answer to the question we asked
+                if r_id == id and cmd == r_cmd and len(params) + 3 == length:
+                    return decode_params(params)
+            if time.monotonic() >= deadline: return None # The reply didn't arrive
+            # Read whatever is needed to complete the reply, or more if it's already waiting
+            recv_data = uart.read(max(frame_len - len(parser.buffer), uart.in_waiting, 1))
+            if not recv_data: return None # Timed out
+            parser.feed(recv_data)
+
+    def read_many(self, pi, requests, retries=1):
+        '''
+        Ask several servos for data, one request straight after another's reply.
+        The bus is half duplex, so a request can't be sent while a reply is due, but the bus is
+        held for the whole batch & any reply that arrives late is still matched to its request.
+        Servos that don't answer are asked again at the end, rather than straight away
+        :param requests: sequence of (id, r_cmd) tuples, each asked once
+        :param retries: number of times to ask again
+        :return: list of (data or None, time.monotonic() of the reply), in the order of requests
+        '''
+
+        results = [(None, None)] * len(requests)
+        waiting = {} # (id, r_cmd): index in requests of replies not yet received
+        for n, request in enumerate(requests): waiting[tuple(request)] = n
+        with self.lock: # Keep the bus until the batch is finished
+            for attempt in range(1 + retries):
+                for key in list(waiting):
+                    if key not in waiting: continue # Its reply came in late while waiting for another
+                    id, r_cmd = key
+                    stats = get_latency(id, r_cmd)
+                    if self.write_cmd(pi, id, r_cmd) != True: continue
+                    self.uart.flush() # Wait until the request has left the UART
+                    self.portRead(pi) # Switch UART to read mode
+                    sent = time.monotonic() # Start timing the reply
+                    answered = self.collect_many(waiting, key, stats.timeout, results)
+                    waited = time.monotonic() - sent
+                    self.busy += waited # The bus is tied up until the reply arrives or the wait times out
+                    if answered: stats.add(waited)
+                    else:
+                        stats.timeouts += 1
+                        if capture is not None: capture.record(BusCapture.EVENT, BusCapture.TIMEOUT, bytes(key))
+                if not waiting: break
+            for key in waiting: # Gave up on these
+                get_latency(*key).failures += 1
+                if capture is not None: capture.record(BusCapture.EVENT, BusCapture.FAILED, bytes(key))
+        return results
+
+    def collect_many(self, waiting, key, timeout, results):
+        '''
+        Wait for the reply to one read command, keeping any other replies that are waited for
+        :param waiting: dictionary of (id, r_cmd): index in results. Answered requests are removed
+        :param key: (id, r_cmd) of the request just sent
+        :param timeout: How long to wait for the reply, in seconds
+        :param results: list to put (data, time received) in
+        :return: True if the reply to key arrived
+        '''
+
+        uart = self.uart
+        parser = self.parser
+        deadline = time.monotonic() + timeout # When to give up
+        if uart.timeout != timeout: uart.timeout = timeout # Block reads for no longer than a reply
+        frame_len = config.BS_reply_lengths[key[1] - 1] + 3 # Bytes in a complete reply
+        while True:
+            while parser.frames: # Collect the frames received so far
+                r_id, cmd, params = parser.frames.popleft()
+                n = waiting.get((r_id, cmd))
+                if n is not None and len(params) + 3 == config.BS_reply_lengths[cmd - 1]:
+                    results[n] = (decode_params(params), time.monotonic())
+                    del waiting[(r_id, cmd)]
+            if key not in waiting: return True
+            if time.monotonic() >= deadline: return False # The reply didn't arrive
+            # Read whatever is needed to complete the reply, or more if it's already waiting
+            recv_data = uart.read(max(frame_len - len(parser.buffer), uart.in_waiting, 1))
+            if not recv_data: return False # Timed out
+            parser.feed(recv_data)
+
+    def trinket_write(self, id, colour):
+        '''
+        Send data to the TrinketM0 on this bus
+        :param id: LED ID to be addressed 0 ~ 11 = face lights, 12 = head/tail lights
+        :param colour: the colour, or direction codes to be transmitted
+        :return: Error code or True = Success
+        '''
+
+        buf = bytearray()
+
+        buf.append(id) # Start with the LED ID
+
+        for i in colour: buf.append(i) # Append the colour data
+
+        buf.append(checksum(buf)) # Append the checksum
+
+        frame = bytearray(TRINKET_FRAME_HEADER) + buf  # Prepend the data frame header
+
+        frame += b'\n' # So that you can send a line end designated line at a time
+
+        with self.lock: # Wait for any other transaction to finish
+            self.uart.write(frame)  # Transmit data frame over UART
+            self.busy += len(frame) * BITS_PER_BYTE / BAUD_RATE
+            if capture is not None: capture.record(BusCapture.TX, BusCapture.TRINKET, frame)
+        return True # Tell the World how clever you were
+
+# The servo buses, from config.BS_buses. The first is the expansion board, which also carries
+# the TrinketM0 LED frames. The UARTs can be pointed at other ports, or pyserial URLs, with the
+# SPIDERPI_UART environment variable, a comma separated list with a port for each bus.
+# e.g. the pseudo terminal of ServoEmulator.py
+ports = os.environ.get("SPIDERPI_UART", "").split(",")
+buses = [] # Serial_Bus for each bus
+routes = {} # Servo ID: Serial_Bus it's on
+for number, (port, rx_con, tx_con, ids) in enumerate(config.BS_buses):
+    if number < len(ports) and ports[number]: port = ports[number]
+    buses.append(Serial_Bus(port, rx_con, tx_con, ids))
+    for id in ids: routes[id] = buses[-1]
+bus = buses[0] # The expansion board
+
+def bus_for(id):
+    '''
+    :param id: servo ID
+    :return: Serial_Bus the servo is on. Servos not in config.BS_buses are on the expansion board
+    '''
+    return routes.get(id, bus)
+
+def split_cmds(cmds):
+    '''
+    Share commands between the buses the servos are on. Broadcasts go to every bus
+    :param cmds: sequence of (id, w_cmd, dat1, dat2) tuples
+    :return: Dictionary of Serial_Bus: list of commands, in their original order
+    '''
+
+    shares = {}
+    for cmd in cmds:
+        for b in (buses if cmd[0] == config.BS_broadcast_id else (bus_for(cmd[0]),)):
+            shares.setdefault(b, []).append(cmd)
+    return shares
+
+def attach(uart, number=0):
+    '''
+    Use a different UART for a bus. e.g. ServoEmulator.Emulated_UART
+    :param uart: object with the pyserial Serial methods
+    :param number: index of the bus in config.BS_buses
+    '''
+    buses[number].attach(uart)
+
+def portinit(pi): # Initialise the read/write switch of every bus
+    for b in buses: b.portinit(pi)
+
+def portWrite(pi): # Switch the expansion board to write mode
+    bus.portWrite(pi)
+
+def portRead(pi): # Switch the expansion board to read mode
+    bus.portRead(pi)
+
+def portReset(pi): # Reset every bus
+    for b in buses: b.portReset(pi)
+
+def portOff(pi): # Close every bus
+    for b in buses: b.portOff(pi)
+
+def serial_servo_write_cmd(pi, id, w_cmd, dat1=None, dat2=None):
+    '''
+    写指令 Send command to the servo, on whichever bus it's on
+    :param id: servo ID to be written to. Broadcasts go to every bus
+    :param w_cmd: The servo command to send
+    :param dat1: First servo command parameter
+    :param dat2: Second servo command parameter
     :return: Error code or True = Success
     '''
 
-    buf = bytearray()
+    if id == config.BS_broadcast_id:
+        result = True
+        for b in buses: # Every bus is sent the command, even if one of them fails
+            msg = b.write_cmd(pi, id, w_cmd, dat1, dat2)
+            if result == True: result = msg # Report the first failure
+        return result
+    return bus_for(id).write_cmd(pi, id, w_cmd, dat1, dat2)
 
-    buf.append(id) # Start with the LED ID
+def serial_servo_write_many(pi, cmds):
+    '''
+    Send several servo commands, a single UART transmission on each bus.
+    The UARTs transmit in parallel, so the time taken is the time for the busiest bus
+    :param cmds: sequence of (id, w_cmd, dat1, dat2) tuples. dat1 & dat2 may be None or left out
+    :return: Error code or True = Success
+    '''
 
-    for i in colour: buf.append(i) # Append the colour data
+    if len(buses) == 1: return bus.write_many(pi, cmds)
+    for b, share in split_cmds(cmds).items():
+        result = b.write_many(pi, share)
+        if result != True: return result
+    return True
 
-    buf.append(checksum(buf)) # Append the checksum
+def serial_servo_write_frames(pi, frames):
+    '''
+    Send servo frames that have already been encoded, a single UART transmission on each bus
+    :param frames: dictionary of Serial_Bus: bytes-like object of complete frames
+    :return: Error code or True = Success
+    '''
 
-    frame = bytearray(TRINKET_FRAME_HEADER) + buf  # Prepend the data frame header
+    for b, data in frames.items():
+        result = b.write_frames(pi, data)
+        if result != True: return result
+    return True
 
-    frame += b'\n' # So that you can send a line end designated line at a time
+def serial_servo_read_cmd(pi, id, r_cmd):
+    '''
+    发送读取命令 Send request for data to a servo & return result
+    :param id: servo_id to be interrogated
+    :param r_cmd: The servo command to be responded to
+    :return: 数据 Data returned from the servo or "Comms"
+    '''
+    return bus_for(id).read_cmd(pi, id, r_cmd)
+
+def serial_servo_read_many(pi, requests, retries=1):
+    '''
+    Ask several servos for data. Each bus works through its own requests, at the same time
+    :param requests: sequence of (id, r_cmd) tuples, each asked once
+    :param retries: number of times to ask servos that didn't answer
+    :return: list of (data or None, time.monotonic() of the reply), in the order of requests
+    '''
 
-    UART.write(frame)  # Transmit data frame over UART
-    return True # Tell the World how clever you were
+    shares = {} # Serial_Bus: indexes of its requests
+    for n, (id, r_cmd) in enumerate(requests): shares.setdefault(bus_for(id), []).append(n)
+    results = [(None, None)] * len(requests)
+    def work(b, indexes):
+        for n, result in zip(indexes, b.read_many(pi, [requests[n] for n in indexes], retries)):
+            results[n] = result
+    threads = [threading.Thread(target=work, args=share) for share in list(shares.items())[1:]]
+    for thread in threads: thread.start()
+    if shares: work(*next(iter(shares.items()))) # The first bus in this thread
+    for thread in threads: thread.join()
+    return results
+
+def serial_servo_read_attempt(pi, id, r_cmd, timeout):
+    '''
+    Send one request for data & wait for the reply
+    :param timeout: How long to wait for the reply, in seconds
+    :return: Data returned from the servo or None
+    '''
+    return bus_for(id).read_attempt(pi, id, r_cmd, timeout)
+
+def TrinketM0_write_data(id, colour):
+    '''
+    Send data to the TrinketM0 via the Raspberry Pi expansion board
+    :param id: LED ID to be addressed 0 ~ 11 = face lights, 12 = head/tail lights
+    :param colour: the colour, or direction codes to be transmitted
+    :return: Error code or True = Success
+    '''
+    return bus.trinket_write(id, colour)
 
 if __name__ == '__main__':
     import config # Environment variables
@@ -216,4 +831,6 @@ if __name__ == '__main__':
             serial_servo_write_cmd(pi, id, config.BS_MOVE_TIME_WRITE, pos, 500)
         print(" ")
     print(" ")
+    for key, stats in latency_stats().items(): # Report how quickly each servo answered
+        print("Servo", key[0], "command", key[1], stats)
     print("Servo tests complete!")
@@ -0,0 +1,174 @@
+#!/usr/bin/python3
+# encoding: utf-8
+# Copyright ians.moyes@gmail.com
+
+# Class to map where each toe can go. The workspace around each shoulder is divided into voxels
+# & for each one the map holds whether the leg can reach it within the rotation limits of its
+# servos, how far the nearest joint is from a limit & how well the leg can move from there.
+# Gait & footstep planners can check, or clamp, toe targets by looking them up instead of
+# working out the inverse kinematics & catching the failures.
+#
+#     reach = Reachability_Map() # Or Reachability_Map(servo_limits(pi)) for the limits set in the servos
+#     feasible, margin, manipulability = reach.lookup(coords) # coords [..., 6, 3]
+#     coords, ok = reach.clamp(coords, min_margin=20)
+
+import importlib # Standard library to import modules by name
+import numpy as np # Numerical array library
+import config # Bus Servo protocol definitions & hexapod geometry
+import ForwardKin as FK # Forward kinematics
+
+IK = importlib.import_module("2DIK") # Inverse kinematics. The name starts with a digit
+
+# Default voxel grid of toe coordinates (X, Y, Z) from the shoulder joint, in mm
+GRID_LO = (-250.0, -50.0, -100.0)
+GRID_HI = (250.0, 250.0, 250.0)
+GRID_STEP = 5.0
+RADIANS_PER_STEP = np.radians(120 / 500) # Servo resolution
+
+def servo_limits(pi):
+    '''
+    Read the rotation limits set in every servo
+    :param pi: the Raspberry Pi
+    :return: array [6, 3, 2] of (lower, upper) servo positions for each leg & joint
+    '''
+
+    from SerialServoClass import Serial_Servo as Servo # Bus Serial Servo control class
+    limits = np.empty((6, 3, 2))
+    for leg in range(6):
+        for joint in range(3):
+            result = Servo(pi, leg * 3 + joint + 1).rotation_limits
+            limits[leg, joint] = result if type(result) != str else config.BS_rotate_limits # Unknown, the widest
+    return limits
+
+def manipulability(positions):
+    '''
+    How freely the toe can move in every direction, |determinant| of the Jacobian of a port leg.
+    0 where the leg is straight or folded & can't move the toe some way
+    :param positions: array [..., 3] of fractional servo positions of a port leg
+    :return: array [...] in mm³ per radian³
+    '''
+
+    columns = []
+    for joint in range(3): # Each column is the toe movement for a small turn of one joint
+        nudge = np.zeros(3)
+        nudge[joint] = 0.5
+        ahead = FK.leg_forward_kin(positions + nudge, np.zeros(positions.shape[:-1]))
+        behind = FK.leg_forward_kin(positions - nudge, np.zeros(positions.shape[:-1]))
+        columns.append((ahead - behind) / RADIANS_PER_STEP)
+    return np.abs(np.linalg.det(np.stack(columns, axis=-1)))
+
+class Reachability_Map():
+    ''' This is a class to define a voxel map of the workspace of each leg.
+    margin[leg, i, j, k] is the distance in servo steps from the nearest joint limit,
+    negative if a joint would be past its limit & NaN if the toe can't reach the voxel at all.
+    manipulability[i, j, k] is the same for every leg, the legs are mirror images
+    '''
+
+    def __init__(self, limits=None, lo=GRID_LO, hi=GRID_HI, step=GRID_STEP):
+        '''
+        :param limits: array [6, 3, 2] of (lower, upper) servo positions, e.g. from servo_limits.
+                       Default config.BS_rotate_limits for every joint
+        :param lo: lowest (X, Y, Z) of the grid
+        :param hi: highest (X, Y, Z) of the grid
+        :param step: voxel size in mm
+        '''
+
+        if limits is None: limits = np.tile(np.array(config.BS_rotate_limits, dtype=float), (6, 3, 1))
+        self.limits = np.asarray(limits, dtype=float)
+        self.lo = np.asarray(lo, dtype=float)
+        self.step = float(step)
+        self.counts = np.floor((np.asarray(hi, dtype=float) - self.lo) / self.step).astype(int) + 1
+        axes = [self.lo[n] + self.step * np.arange(self.counts[n]) for n in range(3)]
+        coords = np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1) # Centre of every voxel
+
+        angles, reachable = IK.joint_angles_batch(coords)
+        positions = IK.remap_batch(angles, truncate=False) # Port leg servo positions
+        self.manipulability = np.where(reachable, manipulability(positions), 0).astype(np.float32)
+        self.margin = np.empty((6,) + coords.shape[:3], dtype=np.float32)
+        for leg in range(6):
+            actual = 1000 - positions if leg > 2 else positions # switch_sides
+            margin = np.minimum(actual - self.limits[leg, :, 0], self.limits[leg, :, 1] - actual).min(axis=-1)
+            self.margin[leg] = np.where(reachable, margin, np.nan)
+
+    def voxels(self, coords):
+        '''
+        :param coords: array [..., 3] of toe coordinates
+        :return: (index, inside) index [..., 3] of the nearest voxel & True where it's in the map
+        '''
+
+        index = np.rint((np.asarray(coords, dtype=float) - self.lo) / self.step).astype(np.int64)
+        inside = np.all((index >= 0) & (index < self.counts), axis=-1)
+        return np.where(inside[..., np.newaxis], index, 0), inside
+
+    def lookup(self, coords, legs=None, min_margin=0.0):
+        '''
+        Check toe targets, one voxel look-up each
+        :param coords: array [..., 6, 3] of toe coordinates, one row for each leg
+        :param legs: leg number of each row 0~5. Default rows 0~5 are legs 0~5
+        :param min_margin: servo steps every joint must be from its limits
+        :return: (feasible, margin, manipulability), each an array [..., 6]
+                 Outside the map the margin is NaN & the target isn't feasible
+        '''
+
+        index, inside = self.voxels(coords)
+        if legs is None: legs = np.arange(index.shape[-2])
+        legs = np.broadcast_to(legs, index.shape[:-1])
+        i, j, k = index[..., 0], index[..., 1], index[..., 2]
+        margin = np.where(inside, self.margin[legs, i, j, k], np.nan)
+        with np.errstate(invalid="ignore"): # NaN is never feasible
+            feasible = margin >= min_margin
+        return feasible, margin, np.where(inside, self.manipulability[i, j, k], 0)
+
+    def clamp(self, coords, toward=config.HX_stand_pos, min_margin=0.0, samples=32):
+        '''
+        Pull infeasible toe targets back towards a safe point until they're feasible
+        :param coords: array [..., 6, 3] of toe coordinates, one row for each leg
+        :param toward: toe coordinates to pull back towards, [3] or [..., 6, 3]. They must be feasible
+        :param min_margin: servo steps every joint must be from its limits
+        :param samples: points checked along the way. The result is within 1/samples of the best
+        :return: (coords, ok) clamped coordinates & False where no feasible point was found
+        '''
+
+        coords = np.asarray(coords, dtype=float)
+        toward = np.broadcast_to(np.asarray(toward, dtype=float), coords.shape)
+        if not self.lookup(toward, min_margin=min_margin)[0].all():
+            raise ValueError("Can't clamp toward a point that isn't feasible")
+        share = np.linspace(1, 0, samples + 1) # From the target back to the safe point
+        path = toward[..., np.newaxis, :, :] + share[:, np.newaxis, np.newaxis] * (coords - toward)[..., np.newaxis, :, :]
+        feasible = self.lookup(path, min_margin=min_margin)[0] # [..., samples + 1, 6]
+        first = np.argmax(feasible, axis=-2) # First feasible point from the target end
+        ok = np.take_along_axis(feasible, first[..., np.newaxis, :], axis=-2)[..., 0, :]
+        clamped = np.take_along_axis(path, first[..., np.newaxis, :, np.newaxis], axis=-3)[..., 0, :, :]
+        return np.where(ok[..., np.newaxis], clamped, coords), ok
+
+    def save(self, path):
+        np.savez_compressed(path, limits=self.limits, lo=self.lo, step=self.step, counts=self.counts,
+                            margin=self.margin, manipulability=self.manipulability)
+
+    @classmethod
+    def load(cls, path):
+        '''
+        :param path: file written by save
+        :return: Reachability_Map
+        '''
+
+        data = np.load(path)
+        reach = cls.__new__(cls) # Without working it all out again
+        reach.limits, reach.lo, reach.step, reach.counts = data["limits"], data["lo"], float(data["step"]), data["counts"]
+        reach.margin, reach.manipulability = data["margin"], data["manipulability"]
+        return reach
+
+if __name__ == '__main__':
+    import time # Standard library of time, diary & calendar functions
+    start = time.perf_counter()
+    reach = Reachability_Map()
+    print("Built %s voxels in %.2f s" % (reach.margin.shape, time.perf_counter() - start))
+    for leg in (0, 3):
+        feasible = np.count_nonzero(reach.margin[leg] >= 0)
+        reachable = np.count_nonzero(~np.isnan(reach.margin[leg]))
+        print("Leg", leg, reachable, "voxels reachable,", feasible, "within the servo limits")
+    targets = np.tile(np.array(config.HX_stand_pos, dtype=float), (6, 1))
+    targets[0] = (0, 300, 70) # Too far
+    targets[4] = (0, 100, 120) # Stand tall
+    print(reach.lookup(targets))
+    print(reach.clamp(targets, min_margin=10))
@@ -7,7 +7,9 @@
 
 # Class to define a serial bus servo motor
 
+import time # Standard library of time, diary & calendar functions
 import RPiExpCom as Ctrl # Raspberry Pi expansion board communication driver
+import AsyncBus # asyncio front-end for the servo bus
 
 class Serial_Servo():
     ''' This is a class to define & therefore control a Bus Serial Servo motor
@@ -66,11 +68,77 @@ class Serial_Servo():
     temp_limits = (50, 85) # Temperature alarm limit in °C.
     # The limit can be set between 50 ~ 100°C.
     default_pos = 500 # The default position for 50% rotation
+    broadcast_id = Ctrl.config.BS_broadcast_id # Every servo obeys commands sent to this ID, but none of them reply
+    # Registers that only change when they are written, so can be cached
+    cached_cmds = (ANGLE_OFFSET_READ, ANGLE_LIMIT_READ, VIN_LIMIT_READ, TEMP_LIMIT_READ, LED_CTRL_READ)
+    cache_ttl = None # Seconds before a cached register is read again. None = only after it's written
+    cache = {} # Cached register values of every servo. (ID, read command): (value, time read)
+    router = None # BusRouter.Bus_Router to send batches to every bus in parallel. None = one bus after another
+    stager = None # CommandStager.Command_Stager to hold movements until the end of the tick. None = send now
 
     def __init__(self, pi, id):
         self.pi = pi # Attach the servo to the Raspberry Pi
         self.id = id # The ID number of the Bus Serial Servo to control
 
+    def write_cmd(self, w_cmd, dat1=None, dat2=None):
+        '''
+        Send a command to the servo now. The stager forgets the targets it has sent to the servo,
+        so the next target is sent even if it's the same as the last one
+        :param w_cmd: The servo command
+        :param dat1: First servo command parameter
+        :param dat2: Second servo command parameter
+        :return: True = successful or error code
+        '''
+
+        if Serial_Servo.stager is not None: Serial_Servo.stager.forget(self.id)
+        return Ctrl.serial_servo_write_cmd(self.pi, self.id, w_cmd, dat1, dat2)
+
+    def cached(self, r_cmd):
+        '''
+        :param r_cmd: The servo read command, one of cached_cmds
+        :return: The cached register value, or None if it isn't cached or is older than cache_ttl
+        '''
+
+        entry = Serial_Servo.cache.get((self.id, r_cmd))
+        if entry is None: return None
+        if Serial_Servo.cache_ttl is not None and time.monotonic() - entry[1] >= Serial_Servo.cache_ttl: return None
+        return entry[0]
+
+    def remember(self, r_cmd, msg):
+        '''
+        Cache a register value read from the servo. Errors aren't cached
+        :param r_cmd: The servo read command, one of cached_cmds
+        :param msg: Value returned from the servo or error code
+        '''
+
+        if type(msg) != str: Serial_Servo.cache[(self.id, r_cmd)] = (msg, time.monotonic())
+
+    def cached_read(self, r_cmd):
+        '''
+        Read a register that only changes when it is written.
+        The servo is only asked if the register isn't cached, or the cached value is older than cache_ttl
+        :param r_cmd: The servo read command, one of cached_cmds
+        :return: Register value or error code
+        '''
+
+        msg = self.cached(r_cmd)
+        if msg is not None: return msg # Still fresh
+        msg = Ctrl.serial_servo_read_cmd(self.pi, self.id, r_cmd) # Send data request
+        self.remember(r_cmd, msg)
+        return msg # Return value once received
+
+    def refresh(self, r_cmd=None):
+        '''
+        Forget cached registers, so they are read from the servo next time.
+        Every Serial_Servo object for the same ID shares the cache
+        :param r_cmd: The read command of the register to forget. None = all of them
+        '''
+
+        broadcast = self.id == Serial_Servo.broadcast_id # Written to every servo
+        for key in list(Serial_Servo.cache):
+            if (broadcast or key[0] == self.id) and (r_cmd is None or key[1] == r_cmd):
+                Serial_Servo.cache.pop(key, None)
+
     def set_pos(self, posn): # Command 1
         '''
         Move servo to new position
@@ -79,8 +147,50 @@ class Serial_Servo():
         param tim: time to reach destination in mS
         :return: True or error code
         '''
+        if Serial_Servo.stager is not None: # Send it at the end of the tick
+            Serial_Servo.stager.stage(self.id, Serial_Servo.MOVE_TIME_WRITE, posn[0], posn[1])
+            return True
         return Ctrl.serial_servo_write_cmd(self.pi, self.id, Serial_Servo.MOVE_TIME_WRITE, posn[0], posn[1])
 
+    def pos_cmd(self, posn, w_cmd=MOVE_TIME_WRITE): # Command 1 or 7
+        '''
+        Build, but don't send, a command to move the servo to a new position
+        param posn: (position for servo to move to, time to reach destination in mS)
+        param w_cmd: MOVE_TIME_WRITE to move immediately, MOVE_TIME_WAIT_WRITE to wait for trigger
+        :return: (id, command, position, time) for write_many
+        '''
+
+        return (self.id, w_cmd, posn[0], posn[1])
+
+    @staticmethod
+    def write_many(pi, cmds):
+        '''
+        Send commands to several servos in a single transmission on each bus,
+        or stage them to be sent at the end of the tick if there is a stager
+        param cmds: sequence of (id, command, parameter 1, parameter 2) tuples
+        :return: True = successful or error code
+        '''
+
+        if Serial_Servo.stager is not None: # Send them at the end of the tick
+            Serial_Servo.stager.stage_many(cmds)
+            return True
+        return Serial_Servo.send_many(pi, cmds)
+
+    @staticmethod
+    def send_many(pi, cmds, forget=True):
+        '''
+        Send commands to several servos now, in a single transmission on each bus
+        param cmds: sequence of (id, command, parameter 1, parameter 2) tuples
+        param forget: True = the stager forgets the targets it has sent to these servos, as these bypass it
+        :return: True = successful or error code
+        '''
+
+        if forget and Serial_Servo.stager is not None:
+            for id in set(cmd[0] for cmd in cmds): Serial_Servo.stager.forget(id)
+        if Serial_Servo.router is not None: # Every bus at the same time
+            return Serial_Servo.router.wait(Serial_Servo.router.write_many(cmds))
+        return Ctrl.serial_servo_write_many(pi, cmds)
+
     @property # Allows method to be used like a variable without ()
     def get_set_pos(self): # Command 2
         '''
@@ -106,7 +216,7 @@ class Serial_Servo():
         :return: True = successful or error code
         '''
 
-        return Ctrl.serial_servo_write_cmd(self.pi, self.id, Serial_Servo.MOVE_TIME_WAIT_WRITE, posn[0], posn[1])
+        return self.write_cmd(Serial_Servo.MOVE_TIME_WAIT_WRITE, posn[0], posn[1])
 
     # For some reason, this one doesn't work gets locked in endless loop
     def get_standby_pos(self): # Command 8
@@ -135,7 +245,18 @@ class Serial_Servo():
         :return: True = successful or error code
         '''
 
-        return Ctrl.serial_servo_write_cmd(self.pi, self.id, Serial_Servo.MOVE_START)
+        return self.write_cmd(Serial_Servo.MOVE_START)
+
+    @staticmethod
+    def trigger_all(pi): # Command 11
+        '''
+        Triggers movement of every servo on the bus to the positions defined by previously
+        transmitted new_standby_pos. Command 7.
+        A single broadcast frame, so all the servos start moving at the same moment
+        :return: True = successful or error code
+        '''
+
+        return Serial_Servo.write_many(pi, [(Serial_Servo.broadcast_id, Serial_Servo.MOVE_START)])
 
     @property # Allows method to be used like a variable without ()
     def stop(self): # Command 12
@@ -145,7 +266,7 @@ class Serial_Servo():
         :return: True = successful or error code
         '''
 
-        return Ctrl.serial_servo_write_cmd(self.pi, self.id, Serial_Servo.MOVE_STOP)
+        return self.write_cmd(Serial_Servo.MOVE_STOP)
 
     #ID_WRITE. # Command 13 is too dangerous for general use
     #ID_READ. # Command 14 is no use in a multi servo configuration
@@ -160,7 +281,8 @@ class Serial_Servo():
         """
 
         # 设置偏差 Set offset
-        result = Ctrl.serial_servo_write_cmd(self.pi, self.id, Serial_Servo.ANGLE_OFFSET_ADJUST, offset)
+        self.refresh(Serial_Servo.ANGLE_OFFSET_READ) # The cached offset is out of date
+        result = self.write_cmd(Serial_Servo.ANGLE_OFFSET_ADJUST, offset)
         if type(result) == str: return result
         # 设置为掉电保护 Save to non-volatile memory
         return Ctrl.serial_servo_write_cmd(self.pi, self.id, Serial_Servo.ANGLE_OFFSET_WRITE)
@@ -173,7 +295,7 @@ class Serial_Servo():
         '''
 
         # 发送读取偏差指令 Send read offset command
-        msg = Ctrl.serial_servo_read_cmd(self.pi, self.id, Serial_Servo.ANGLE_OFFSET_READ) # Send data request
+        msg = self.cached_read(Serial_Servo.ANGLE_OFFSET_READ) # Send data request, unless it's cached
         if type(msg) == str: print("Get offset read error",  msg)
         return msg # Return value once received
 
@@ -187,6 +309,7 @@ class Serial_Servo():
         :return: True = successful or error code
         '''
 
+        self.refresh(Serial_Servo.ANGLE_LIMIT_READ) # The cached limits are out of date
         return Ctrl.serial_servo_write_cmd(self.pi, self.id, Serial_Servo.ANGLE_LIMIT_WRITE, limits[0], limits[1])
 
     def get_rotation_limits(self): # Command 21
@@ -197,7 +320,7 @@ class Serial_Servo():
         '''
 
         # 发送读取偏差指令 Send read rotation limits command
-        msg = Ctrl.serial_servo_read_cmd(self.pi, self.id, Serial_Servo.ANGLE_LIMIT_READ) # Send data request
+        msg = self.cached_read(Serial_Servo.ANGLE_LIMIT_READ) # Send data request, unless it's cached
         if type(msg) == str: print("Get rotation limits error", msg)
         return msg # Return value once received
 
@@ -211,6 +334,7 @@ class Serial_Servo():
         :return: True = success or error code
         '''
 
+        self.refresh(Serial_Servo.VIN_LIMIT_READ) # The cached limits are out of date
         return Ctrl.serial_servo_write_cmd(self.pi, self.id, Serial_Servo.VIN_LIMIT_WRITE, limits[0], limits[1])
 
     def get_vin_limits(self): # Command 23
@@ -221,7 +345,7 @@ class Serial_Servo():
         '''
 
         # 发送读取偏差指令 Send read offset command
-        msg = Ctrl.serial_servo_read_cmd(self.pi, self.id, Serial_Servo.VIN_LIMIT_READ) # Send data request
+        msg = self.cached_read(Serial_Servo.VIN_LIMIT_READ) # Send data request, unless it's cached
         if type(msg) == str: print("Voltage-in limits read error", msg)
         return msg # Return value once received
 
@@ -235,6 +359,7 @@ class Serial_Servo():
         :return: Error value or True = successful
         '''
 
+        self.refresh(Serial_Servo.TEMP_LIMIT_READ) # The cached limit is out of date
         return Ctrl.serial_servo_write_cmd(self.pi, self.id, Serial_Servo.TEMP_LIMIT_WRITE, m_temp)
 
     def get_temp_limit(self): # Command 25
@@ -244,7 +369,7 @@ class Serial_Servo():
         :return: Servo temperature alarm value or error code
         '''
 
-        msg = Ctrl.serial_servo_read_cmd(self.pi, self.id, Serial_Servo.TEMP_LIMIT_READ) # Send data request
+        msg = self.cached_read(Serial_Servo.TEMP_LIMIT_READ) # Send data request, unless it's cached
         if type(msg) == str: print("Temperature limit read error", msg)
         return msg # Return value once received
 
@@ -295,7 +420,28 @@ class Serial_Servo():
         :return: Success = True or error code
         '''
 
-        return Ctrl.serial_servo_write_cmd(self.pi, self.id, Serial_Servo.MOTOR_MODE_WRITE, 0)
+        # Parameter 1 is the mode, parameter 2 is unused & parameters 3 & 4 are the speed
+        return self.write_cmd(Serial_Servo.MOTOR_MODE_WRITE, 0, 0)
+
+    def set_speed(self, speed): # Command 29
+        '''
+        Set continuous rotation motor mode, turning at a speed
+        :param self.id: Servo id
+        :param speed: -1000 ~ 1000. Negative speeds turn the other way
+        :return: Success = True or error code
+        '''
+
+        return self.write_cmd(*self.speed_cmd(speed)[1:])
+
+    def speed_cmd(self, speed): # Command 29
+        '''
+        Build, but don't send, a command to turn continuously at a speed
+        :param speed: -1000 ~ 1000. Clamped to cont_speed
+        :return: (id, command, mode, speed) for write_many
+        '''
+
+        speed = int(min(max(speed, Serial_Servo.cont_speed[0]), Serial_Servo.cont_speed[1]))
+        return (self.id, Serial_Servo.MOTOR_MODE_WRITE, 1, speed) # Mode 1 in the low byte of the 1st parameter
 
     @property # Allows method to be used like a variable without ()
     def motor_mode(self): # Command 30
@@ -316,7 +462,7 @@ class Serial_Servo():
         :return: True = success or error code
         '''
 
-        return Ctrl.serial_servo_write_cmd(self.pi, self.id, Serial_Servo.LOAD_MODE_WRITE, mode)
+        return self.write_cmd(Serial_Servo.LOAD_MODE_WRITE, mode)
 
     @property # Allows method to be used like a variable without ()
     def unload(self): # Command 31
@@ -326,7 +472,7 @@ class Serial_Servo():
         :return: True = success or error code
         '''
 
-        return Ctrl.serial_servo_write_cmd(self.pi, self.id, Serial_Servo.LOAD_MODE_WRITE, 0)
+        return self.write_cmd(Serial_Servo.LOAD_MODE_WRITE, 0)
 
     def get_load_mode(self): # Command 32
         '''
@@ -350,6 +496,7 @@ class Serial_Servo():
         :return:
         '''
 
+        self.refresh(Serial_Servo.LED_CTRL_READ) # The cached mode is out of date
         return Ctrl.serial_servo_write_cmd(self.pi, self.id, Serial_Servo.LED_CTRL_WRITE, mode)
 
     def get_LED_mode(self): # Command 34
@@ -359,7 +506,7 @@ class Serial_Servo():
         :return: Return LED mode or error code
         '''
 
-        msg = Ctrl.serial_servo_read_cmd(self.pi, self.id, Serial_Servo.LED_CTRL_READ) # Send data request
+        msg = self.cached_read(Serial_Servo.LED_CTRL_READ) # Send data request, unless it's cached
         if type(msg) == str: print("LED mode read error", msg)
         return msg # Return value once received
 
@@ -418,6 +565,85 @@ class Serial_Servo():
         print(" ")
         return results # Return data
 
+    # asyncio versions. These let other coroutines run while the servo answers
+
+    async def read(self, r_cmd):
+        '''
+        Read a value from the servo without blocking the event loop
+        :param r_cmd: The servo read command
+        :return: Value returned from the servo or error code
+        '''
+
+        msg = await AsyncBus.read_cmd(self.pi, self.id, r_cmd) # Send data request
+        if type(msg) == str: print("Servo", self.id, "command", r_cmd, "read error", msg)
+        return msg # Return value once received
+
+    async def move(self, posn): # Command 1
+        '''
+        Move servo to new position without blocking the event loop
+        param posn: (position for servo to move to, time to reach destination in mS)
+        :return: True or error code
+        '''
+
+        return await Serial_Servo.async_send_many(self.pi, [(self.id, Serial_Servo.MOVE_TIME_WRITE, posn[0], posn[1])])
+
+    @staticmethod
+    async def async_send_many(pi, cmds):
+        '''
+        Send commands to several servos now without blocking the event loop, like send_many.
+        The stager forgets the targets it has sent to these servos, as these bypass it
+        param cmds: sequence of (id, command, parameter 1, parameter 2) tuples
+        :return: True = successful or error code
+        '''
+
+        if Serial_Servo.stager is not None:
+            for id in set(cmd[0] for cmd in cmds): Serial_Servo.stager.forget(id)
+        return await AsyncBus.write_many(pi, cmds)
+
+    async def read_cached(self, r_cmd):
+        '''
+        Read a register that only changes when it is written, without blocking the event loop.
+        Shares the cache with cached_read
+        :param r_cmd: The servo read command, one of cached_cmds
+        :return: Register value or error code
+        '''
+
+        msg = self.cached(r_cmd)
+        if msg is not None: return msg # Still fresh
+        msg = await self.read(r_cmd) # Send data request
+        self.remember(r_cmd, msg)
+        return msg # Return value once received
+
+    async def read_offset(self): # Command 19
+        return await self.read_cached(Serial_Servo.ANGLE_OFFSET_READ)
+
+    async def read_temp(self): # Command 26
+        return await self.read(Serial_Servo.TEMP_READ)
+
+    async def read_vin(self): # Command 27
+        return await self.read(Serial_Servo.VIN_READ)
+
+    async def read_pos(self): # Command 28
+        return await self.read(Serial_Servo.POS_READ)
+
+    async def read_state(self):
+        '''
+        Collect servo information without blocking the event loop
+        :return: Dictionary of collected results
+        '''
+        results = {"id":self.id}
+        results["rotation_limits"] = await self.read_cached(Serial_Servo.ANGLE_LIMIT_READ) # Command 21
+        results["position"] = await self.read_pos() # Command 28
+        results["temp_limit"] = await self.read_cached(Serial_Servo.TEMP_LIMIT_READ) # Command 25
+        results["temp"] = await self.read_temp() # Command 26
+        results["vin_limits"] = await self.read_cached(Serial_Servo.VIN_LIMIT_READ) # Command 23
+        results["vin"] = await self.read_vin() # Command 27
+        results["offset"] = await self.read_offset() # Command 19
+        results["load"] = await self.read(Serial_Servo.LOAD_MODE_READ) # Command 32
+        results["LED_mode"] = await self.read_cached(Serial_Servo.LED_CTRL_READ) # Command 34
+        results["LED_err"] = await self.read(Serial_Servo.LED_ERROR_READ) # Command 36
+        return results # Return data
+
 if __name__ == '__main__':
     import pigpio # Standard Raspberry Pi GPIO library
     pi = pigpio.pi() # Create a Raspberry Pi object
@@ -0,0 +1,633 @@
+#!/usr/bin/python3
+# encoding: utf-8
+# Copyright ians.moyes@gmail.com
+
+# Software emulation of the LX-224HV Bus Servos behind the Raspberry Pi expansion board,
+# so the Movement code can be run & benchmarked without the robot.
+#
+# In the same process, install the emulator before anything imports RPiExpCom or pigpio:
+#     import ServoEmulator
+#     emulator = ServoEmulator.install()
+#     import Hexapod
+# From another process, run this file with --pty & set SPIDERPI_UART to the pseudo terminal
+# it prints before starting the robot code.
+
+import argparse # Standard command line argument library
+import fcntl # Standard library of file control functions
+import heapq # Standard library of priority queue functions
+import itertools # Standard library of iterator functions
+import os # Standard operating system interface
+import pty # Standard library of pseudo terminal functions
+import random # Standard library of random number functions
+import select # Standard library to wait for I/O
+import struct # Standard library to convert bytes to numbers
+import sys # Standard system library
+import termios # Standard library of terminal control functions
+import threading # Standard multi-tasking library
+import time # Standard library of time, diary & calendar functions
+import tty # Standard library of terminal control functions
+import types # Standard library of type names
+import config # Bus Servo protocol definitions
+
+SERVO_FRAME_HEADER = b'\x55\x55' # Define data frame header
+BAUD_RATE = 115200 # UART baud rate
+BITS_PER_BYTE = 10 # Each byte on the wire is a start bit, 8 data bits & a stop bit
+
+def checksum(buf):
+    ''' Calculate the checksum
+    :param buf: data frame without header & checksum
+    :return: checksum
+    '''
+    return ~sum(buf) & 0xff
+
+def int16(lo, hi): # Signed 16 bit value from 2 bytes
+    value = lo | (hi << 8)
+    return value - 0x10000 if value & 0x8000 else value
+
+def pack16(*values): # 2 bytes for each value, least significant first
+    return b''.join(bytes((value & 0xff, (value >> 8) & 0xff)) for value in values)
+
+class Emulated_Servo():
+    ''' This is a class to define the behaviour of one emulated Bus Servo
+    Movement is at uniform speed, limited by the maximum speed of the servo. The temperature rises
+    while the servo is loaded or moving & cools towards ambient. Exceeding the temperature limit
+    unloads the servo, as the real ones do
+    '''
+    ambient = 25.0 # Ambient temperature in °C
+    heat_loaded = 0.05 # °C per second while holding a position
+    heat_moving = 0.5 # °C per second while moving
+    cooling = 0.01 # Proportion of the temperature above ambient lost per second
+    supply = 11100 # Supply voltage in mV
+    sag = 150 # Supply voltage lost while moving, in mV
+
+    def __init__(self, id):
+        self.id = id # The ID number of the servo
+        self.pos_from = self.pos_to = float(config.BS_default_pos) # Start & end of the current move
+        self.move_start = self.move_end = 0.0 # Times of the start & end of the current move
+        self.move = (config.BS_default_pos, 0) # Last MOVE_TIME_WRITE (position, time)
+        self.standby = (config.BS_default_pos, 0) # Last MOVE_TIME_WAIT_WRITE (position, time)
+        self.offset = 0 # Angle offset
+        self.angle_limits = config.BS_rotate_limits # Rotation limits
+        self.vin_limits = config.BS_Vin_limits # Voltage alarm limits
+        self.temp_limit = config.BS_temp_limits[1] # Temperature alarm limit
+        self.temp = Emulated_Servo.ambient # Current temperature
+        self.loaded = 0 # 1 = torque on
+        self.motor_mode = 0 # 1 = continuous rotation
+        self.speed = 0 # Continuous rotation speed
+        self.LED_mode = 0 # 0 = LED on
+        self.LED_err = 7 # Faults that flash the LED
+        self.updated = time.monotonic() # Time the temperature was last worked out
+        # Fault injection
+        self.dead = False # Doesn't reply
+        self.locked = False # Rotor is locked, so it doesn't move
+        self.reply_delay = None # Reply delay in seconds, None = the emulator default
+
+    def position(self, now):
+        '''
+        :return: position at time now
+        '''
+
+        if self.motor_mode: # Continuous rotation, position wraps around
+            travel = self.speed * config.BS_max_speed / 1000 * (now - self.move_start)
+            return (self.pos_from + travel) % 1000
+        if now >= self.move_end: return self.pos_to
+        fraction = (now - self.move_start) / (self.move_end - self.move_start)
+        return self.pos_from + (self.pos_to - self.pos_from) * fraction
+
+    def moving(self, now):
+        return (self.motor_mode and self.speed != 0) or now < self.move_end
+
+    def start_move(self, pos, tim, now):
+        '''
+        Move at uniform speed, no faster than the servo can manage
+        '''
+
+        self.update(now)
+        current = self.position(now)
+        if self.locked: pos = current # Locked rotors don't turn
+        pos = min(max(pos, self.angle_limits[0]), self.angle_limits[1])
+        self.motor_mode = 0
+        self.pos_from, self.pos_to, self.move_start = current, float(pos), now
+        self.move_end = now + max(tim / 1000, abs(pos - current) / config.BS_max_speed)
+        self.loaded = 1 # Moving loads the servo
+
+    def stop(self, now):
+        self.update(now)
+        self.pos_from = self.pos_to = self.position(now)
+        self.move_start = self.move_end = now
+        self.speed = 0
+
+    def update(self, now):
+        '''
+        Work out the temperature at time now
+        '''
+
+        dt = now - self.updated
+        self.updated = now
+        if self.moving(now): heat = Emulated_Servo.heat_moving
+        elif self.loaded: heat = Emulated_Servo.heat_loaded
+        else: heat = 0.0
+        self.temp += (heat - Emulated_Servo.cooling * (self.temp - Emulated_Servo.ambient)) * dt
+        if self.temp > self.temp_limit and self.loaded: # Protect the servo
+            self.stop(now)
+            self.loaded = 0
+
+    def vin(self, now):
+        return Emulated_Servo.supply - (Emulated_Servo.sag if self.moving(now) else 0)
+
+    def alarms(self, now):
+        '''
+        :return: fault code as table 3 of config.py
+        '''
+
+        code = 0
+        if self.temp > self.temp_limit: code |= config.BS_over_temp_alarm
+        if not self.vin_limits[0] <= self.vin(now) <= self.vin_limits[1]: code |= config.BS_over_volt_alarm
+        if self.locked and self.loaded: code |= config.BS_locked_rotor_alarm
+        return code
+
+    def handle(self, cmd, params, now):
+        '''
+        Carry out a command
+        :param cmd: command code
+        :param params: parameter bytes
+        :param now: time the command arrived
+        :return: reply parameter bytes, or None if there is no reply
+        '''
+
+        self.update(now)
+        if cmd == config.BS_MOVE_TIME_WRITE:
+            self.move = (int16(*params[0:2]), int16(*params[2:4]))
+            self.start_move(self.move[0], self.move[1], now)
+        elif cmd == config.BS_MOVE_TIME_READ: return pack16(*self.move)
+        elif cmd == config.BS_MOVE_TIME_WAIT_WRITE: self.standby = (int16(*params[0:2]), int16(*params[2:4]))
+        elif cmd == config.BS_MOVE_TIME_WAIT_READ: return pack16(*self.standby)
+        elif cmd == config.BS_MOVE_START: self.start_move(self.standby[0], self.standby[1], now)
+        elif cmd == config.BS_MOVE_STOP: self.stop(now)
+        elif cmd == config.BS_ANGLE_OFFSET_ADJUST: self.offset = params[0] - 256 if params[0] > 127 else params[0]
+        elif cmd == config.BS_ANGLE_OFFSET_WRITE: pass # Saved, nothing to emulate
+        elif cmd == config.BS_ANGLE_OFFSET_READ: return bytes((self.offset & 0xff,))
+        elif cmd == config.BS_ANGLE_LIMIT_WRITE: self.angle_limits = (int16(*params[0:2]), int16(*params[2:4]))
+        elif cmd == config.BS_ANGLE_LIMIT_READ: return pack16(*self.angle_limits)
+        elif cmd == config.BS_VIN_LIMIT_WRITE: self.vin_limits = (int16(*params[0:2]), int16(*params[2:4]))
+        elif cmd == config.BS_VIN_LIMIT_READ: return pack16(*self.vin_limits)
+        elif cmd == config.BS_TEMP_LIMIT_WRITE: self.temp_limit = params[0]
+        elif cmd == config.BS_TEMP_LIMIT_READ: return bytes((self.temp_limit,))
+        elif cmd == config.BS_TEMP_READ: return bytes((min(int(self.temp), 255),))
+        elif cmd == config.BS_VIN_READ: return pack16(self.vin(now))
+        elif cmd == config.BS_POS_READ: return pack16(int(round(self.position(now) + self.offset)))
+        elif cmd == config.BS_MOTOR_MODE_WRITE:
+            self.pos_from, self.move_start = self.position(now), now
+            self.motor_mode = params[0]
+            self.speed = int16(*params[2:4]) if len(params) == 4 else 0
+            if self.motor_mode: self.loaded = 1
+        elif cmd == config.BS_MOTOR_MODE_READ: return bytes((self.motor_mode, 0)) + pack16(self.speed)
+        elif cmd == config.BS_LOAD_MODE_WRITE:
+            if params[0] == 0: self.stop(now)
+            self.loaded = params[0]
+        elif cmd == config.BS_LOAD_MODE_READ: return bytes((self.loaded,))
+        elif cmd == config.BS_LED_CTRL_WRITE: self.LED_mode = params[0]
+        elif cmd == config.BS_LED_CTRL_READ: return bytes((self.LED_mode,))
+        elif cmd == config.BS_LED_ERROR_WRITE: self.LED_err = params[0]
+        elif cmd == config.BS_LED_ERROR_READ: return bytes((self.alarms(now) & self.LED_err,))
+        return None
+
+class Servo_Emulator():
+    ''' This is a class to define a bus of emulated servos.
+    Bytes written by the Raspberry Pi are parsed into frames & handed to the servo they are
+    addressed to. Replies are only heard if the expansion board is switched to read mode
+    '''
+
+    def __init__(self, num_servos=config.BS_num_servos, reply_delay=0.0004, jitter=0.0001, pi=None, seed=None):
+        '''
+        :param num_servos: servos on the bus, IDs 1 to num_servos
+        :param reply_delay: time from the end of a request to the start of the reply, in seconds
+        :param jitter: random variation added to the reply delay, in seconds
+        :param pi: Emulated_Pi whose direction pins gate the bus, or None to ignore direction
+        :param seed: random number seed, for repeatable fault injection
+        '''
+
+        self.servos = {id: Emulated_Servo(id) for id in range(1, num_servos + 1)}
+        self.reply_delay = reply_delay
+        self.jitter = jitter
+        self.pi = pi
+        self.random = random.Random(seed)
+        self.buffer = bytearray() # Bytes received but not yet parsed
+        self.lock = threading.Lock() # Several UARTs may deliver frames at once
+        # Fault injection
+        self.drop_rate = 0.0 # Chance of a reply going missing
+        self.corrupt_rate = 0.0 # Chance of a reply being corrupted
+        # Statistics
+        self.frames = 0 # Frames received
+        self.replies = 0 # Replies sent
+        self.checksum_errors = 0 # Frames received with a bad checksum
+        self.dropped = 0 # Replies dropped by fault injection
+        self.corrupted = 0 # Replies corrupted by fault injection
+        self.unheard = 0 # Bytes the Raspberry Pi sent or missed while the bus faced the wrong way
+
+    def talking(self, pins=None): # Is the transceiver switched to write mode
+        return self.pi is None or self.pi.talking(pins)
+
+    def listening(self, pins=None): # Is the transceiver switched to read mode
+        return self.pi is None or self.pi.listening(pins)
+
+    def receive(self, data, buffer=None):
+        '''
+        Parse bytes arriving from the Raspberry Pi
+        :param data: bytes received
+        :param buffer: bytearray of bytes left over from last time, for this UART. Default self.buffer
+        :return: list of (index in data of the last byte of the frame, id, command, parameters)
+        '''
+
+        if buffer is None: buffer = self.buffer
+        base = len(buffer) # Bytes left over from last time
+        buffer += data
+        frames = []
+        start = 0
+        while True:
+            start = buffer.find(SERVO_FRAME_HEADER, start)
+            if start < 0 or len(buffer) < start + 4: break
+            length = buffer[start + 3]
+            if length < 3 or length > 7: # Not a real header
+                start += 1
+                continue
+            end = start + length + 3
+            if len(buffer) < end: break
+            body = buffer[start + 2:end - 1]
+            if buffer[end - 1] == checksum(body):
+                frames.append((end - 1 - base, body[0], body[2], bytes(body[3:])))
+                self.frames += 1
+                start = end
+            else:
+                self.checksum_errors += 1
+                start += 1
+        if start < 0: start = max(len(buffer) - 1, 0) # Keep half a header
+        del buffer[:start]
+        return frames
+
+    def delay(self, id):
+        '''
+        :return: time for a servo to start replying, in seconds
+        '''
+
+        servo = self.servos.get(id)
+        delay = self.reply_delay if servo is None or servo.reply_delay is None else servo.reply_delay
+        return delay + self.random.random() * self.jitter
+
+    def handle(self, id, cmd, params, now):
+        '''
+        Hand a frame to the servo(s) it's addressed to
+        :return: reply frame bytes, or None
+        '''
+
+        with self.lock:
+            return self.obey(id, cmd, params, now)
+
+    def obey(self, id, cmd, params, now):
+        if id == config.BS_broadcast_id: # Everybody obeys, nobody replies
+            for servo in self.servos.values(): servo.handle(cmd, params, now)
+            return None
+        servo = self.servos.get(id)
+        if servo is None or servo.dead: return None
+        reply = servo.handle(cmd, params, now)
+        if reply is None: return None
+        if self.random.random() < self.drop_rate:
+            self.dropped += 1
+            return None
+        body = bytearray((id, len(reply) + 3, cmd)) + reply
+        frame = bytearray(SERVO_FRAME_HEADER) + body + bytes((checksum(body),))
+        if self.random.random() < self.corrupt_rate:
+            self.corrupted += 1
+            frame[self.random.randrange(2, len(frame))] ^= 1 << self.random.randrange(8)
+        self.replies += 1
+        return bytes(frame)
+
+class Scheduler():
+    ''' This is a class to define a thread which calls functions at given times
+    '''
+
+    def __init__(self):
+        self.heap = [] # (time.monotonic(), sequence, function, arguments)
+        self.sequence = itertools.count()
+        self.ready = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def at(self, when, fn, *args):
+        with self.ready:
+            heapq.heappush(self.heap, (when, next(self.sequence), fn, args))
+            self.ready.notify()
+
+    def run(self): # This is the code for the multi-tasking thread
+        while True:
+            with self.ready:
+                while not self.heap or self.heap[0][0] > time.monotonic():
+                    self.ready.wait(self.heap[0][0] - time.monotonic() if self.heap else None)
+                when, seq, fn, args = heapq.heappop(self.heap)
+            fn(*args)
+
+class Emulated_UART():
+    ''' This is a class to define an in memory stand-in for the pyserial Serial port,
+    connected to a Servo_Emulator. Transmission takes the wire time of the bytes at the baud rate.
+    Received bytes arrive through a pipe, so fileno() works with select & asyncio
+    '''
+
+    def __init__(self, emulator, baudrate=BAUD_RATE, timeout=None, pins=None):
+        '''
+        :param emulator: Servo_Emulator on the other end of the bus
+        :param pins: (RX_CON, TX_CON) GPIOs that switch the transceiver. Default the expansion board
+        '''
+
+        self.emulator = emulator
+        self.pins = pins
+        self.buffer = bytearray() # Bytes received but not yet parsed
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.rx, self.rx_in = os.pipe() # Received bytes come out of rx
+        self.tx_free = 0.0 # When the transmitter finishes the bytes already written
+        self.is_open = True
+        self.scheduler = Scheduler()
+        self.bytes_written = 0
+        self.bytes_read = 0
+
+    @property # Allows method to be used like a variable without ()
+    def byte_time(self):
+        return BITS_PER_BYTE / self.baudrate
+
+    def write(self, data):
+        data = bytes(data)
+        now = time.monotonic()
+        start = max(now, self.tx_free) # Wait for the transmitter
+        self.tx_free = start + len(data) * self.byte_time
+        self.bytes_written += len(data)
+        if not self.emulator.talking(self.pins): # The bytes never reach the bus
+            self.emulator.unheard += len(data)
+            return len(data)
+        for last, id, cmd, params in self.emulator.receive(data, self.buffer): # Frames arrive as their last byte does
+            self.scheduler.at(start + (last + 1) * self.byte_time, self.arrived, id, cmd, params)
+        return len(data)
+
+    def arrived(self, id, cmd, params):
+        now = time.monotonic()
+        reply = self.emulator.handle(id, cmd, params, now)
+        if reply is not None: self.scheduler.at(now + self.emulator.delay(id), self.reply, reply)
+
+    def reply(self, reply):
+        if not self.emulator.listening(self.pins): # Nobody is listening
+            self.emulator.unheard += len(reply)
+            return
+        self.scheduler.at(time.monotonic() + len(reply) * self.byte_time, os.write, self.rx_in, reply)
+
+    def read(self, size=1):
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        data = bytearray()
+        while len(data) < size:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0: break
+            if not select.select([self.rx], [], [], remaining)[0]: break
+            data += os.read(self.rx, size - len(data))
+        self.bytes_read += len(data)
+        return bytes(data)
+
+    @property # Allows method to be used like a variable without ()
+    def in_waiting(self):
+        return struct.unpack('I', fcntl.ioctl(self.rx, termios.FIONREAD, b'\0\0\0\0'))[0]
+
+    def inWaiting(self):
+        return self.in_waiting
+
+    @property # Allows method to be used like a variable without ()
+    def out_waiting(self):
+        return max(0, int((self.tx_free - time.monotonic()) / self.byte_time))
+
+    def flush(self): # Wait until everything written has been transmitted
+        wait = self.tx_free - time.monotonic()
+        if wait > 0: time.sleep(wait)
+
+    def reset_input_buffer(self):
+        while self.in_waiting: os.read(self.rx, self.in_waiting)
+
+    flushInput = reset_input_buffer
+
+    def fileno(self):
+        return self.rx
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+class Pty_Link():
+    ''' This is a class to connect a Servo_Emulator to a pseudo terminal, so the robot code can
+    run against it from another process with SPIDERPI_UART set to self.name.
+    The direction pins are in the other process, so they are not emulated
+    '''
+
+    def __init__(self, emulator, baudrate=BAUD_RATE):
+        self.emulator = emulator
+        self.byte_time = BITS_PER_BYTE / baudrate
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        self.name = os.ttyname(self.slave) # The port for the robot code to open
+        self.scheduler = Scheduler()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self): # This is the code for the multi-tasking thread
+        while True:
+            data = os.read(self.master, 1024)
+            now = time.monotonic()
+            for last, id, cmd, params in self.emulator.receive(data):
+                reply = self.emulator.handle(id, cmd, params, now)
+                if reply is not None: # Arrives after the reply delay & the wire time
+                    due = now + self.emulator.delay(id) + len(reply) * self.byte_time
+                    self.scheduler.at(due, os.write, self.master, reply)
+
+class Emulated_Pi():
+    ''' This is a class to define a stand-in for pigpio.pi().
+    It keeps the levels of the expansion board direction pins & counts the calls made,
+    which would each be a round trip to the pigpio daemon
+    '''
+    RX_CON = 17 # Expansion board read enable
+    TX_CON = 27 # Expansion board write enable
+
+    def __init__(self, call_latency=0.0):
+        self.levels = {Emulated_Pi.RX_CON: 0, Emulated_Pi.TX_CON: 1} # Levels after portinit
+        self.modes = {}
+        self.calls = 0 # Calls that would go to the pigpio daemon
+        self.call_latency = call_latency # Time each call takes, in seconds
+        self.scripts = {} # Stored scripts. ID: list of (command, arguments)
+        self.script_ids = itertools.count()
+        self.connected = True
+
+    def call(self):
+        self.calls += 1
+        if self.call_latency: time.sleep(self.call_latency)
+
+    def set_mode(self, gpio, mode):
+        self.call()
+        self.modes[gpio] = mode
+
+    def write(self, gpio, level):
+        self.call()
+        self.levels[gpio] = level
+
+    def read(self, gpio):
+        self.call()
+        return self.levels.get(gpio, 0)
+
+    def set_bank_1(self, bits):
+        self.call()
+        for gpio in range(32):
+            if bits & (1 << gpio): self.levels[gpio] = 1
+
+    def clear_bank_1(self, bits):
+        self.call()
+        for gpio in range(32):
+            if bits & (1 << gpio): self.levels[gpio] = 0
+
+    def store_script(self, script):
+        '''
+        Only the bank & GPIO write commands of the pigpio script language are emulated
+        '''
+
+        self.call()
+        words = script.decode().lower().split()
+        steps = []
+        while words:
+            cmd = words.pop(0)
+            if cmd in ("bc1", "bs1"): steps.append((cmd, int(words.pop(0))))
+            elif cmd == "w": steps.append((cmd, int(words.pop(0)), int(words.pop(0))))
+            else: raise ValueError("Script command " + cmd + " isn't emulated")
+        id = next(self.script_ids)
+        self.scripts[id] = steps
+        return id
+
+    def script_status(self, id):
+        self.call()
+        return (1, [0] * 10) # PI_SCRIPT_HALTED, ready to run
+
+    def run_script(self, id, params=None):
+        self.call()
+        for step in self.scripts[id]:
+            if step[0] == "w": self.levels[step[1]] = step[2]
+            else:
+                for gpio in range(32):
+                    if step[1] & (1 << gpio): self.levels[gpio] = 1 if step[0] == "bs1" else 0
+
+    def delete_script(self, id):
+        self.call()
+        del self.scripts[id]
+
+    def set_PWM_range(self, gpio, range): self.call()
+    def set_PWM_frequency(self, gpio, freq): self.call()
+    def set_PWM_dutycycle(self, gpio, dutycycle): self.call()
+    def set_servo_pulsewidth(self, gpio, width): self.call()
+    def stop(self): self.connected = False
+
+    def talking(self, pins=None): # Transceiver in write mode
+        rx_con, tx_con = pins or (Emulated_Pi.RX_CON, Emulated_Pi.TX_CON)
+        return self.levels.get(rx_con, 0) == 0 and self.levels.get(tx_con, 1) == 1
+
+    def listening(self, pins=None): # Transceiver in read mode
+        rx_con, tx_con = pins or (Emulated_Pi.RX_CON, Emulated_Pi.TX_CON)
+        return self.levels.get(rx_con, 0) == 1 and self.levels.get(tx_con, 1) == 0
+
+def install(emulator=None):
+    '''
+    Replace the servo bus & pigpio with the emulator, in this process.
+    Call before importing anything that imports RPiExpCom or pigpio
+    :param emulator: Servo_Emulator, or None for 18 servos behind an Emulated_Pi
+    :return: the Servo_Emulator. emulator.pi is what pigpio.pi() will return
+    '''
+
+    if emulator is None: emulator = Servo_Emulator(pi=Emulated_Pi())
+    pigpio = types.ModuleType("pigpio") # Stand-in for the pigpio library
+    pigpio.pi = lambda *args, **kwargs: emulator.pi
+    pigpio.INPUT = 0
+    pigpio.OUTPUT = 1
+    pigpio.PI_SCRIPT_INITING = 0
+    pigpio.PI_SCRIPT_HALTED = 1
+    sys.modules["pigpio"] = pigpio
+    # Lets RPiExpCom import without the real UARTs
+    os.environ.setdefault("SPIDERPI_UART", ",".join("loop://" for bus in config.BS_buses))
+    import RPiExpCom # Raspberry Pi expansion board communication driver
+    for number, bus in enumerate(RPiExpCom.buses): # Every bus leads to the emulated servos
+        RPiExpCom.attach(Emulated_UART(emulator, pins=(bus.rx_con, bus.tx_con)), number)
+    return emulator
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(int(p / 100 * len(ordered)), len(ordered) - 1)]
+
+def benchmark(count, call_latency=0.0):
+    '''
+    Time the servo bus code against the emulator & print the results
+    :param count: number of transactions of each kind
+    :param call_latency: time for each round trip to the pigpio daemon, in seconds
+    '''
+
+    emulator = install(Servo_Emulator(pi=Emulated_Pi(call_latency)))
+    import RPiExpCom as Ctrl # Raspberry Pi expansion board communication driver
+    from LegClass import Leg # Class to define and control a leg
+    pi = emulator.pi
+    Ctrl.portinit(pi)
+    legs = [Leg(pi, leg) for leg in range(6)]
+
+    def report(name, samples, per=1):
+        total = sum(samples)
+        print("%-30s mean %7.3f ms  p99 %7.3f ms  %8.1f per second" % (name, 1000 * total / len(samples),
+              1000 * percentile(samples, 99), per * len(samples) / total))
+
+    def timed(fn):
+        samples = []
+        for i in range(count):
+            start = time.perf_counter()
+            fn(i)
+            samples.append(time.perf_counter() - start)
+        return samples
+
+    def switches(): # Direction switches on every bus
+        return sum(bus.switch_calls for bus in Ctrl.buses)
+
+    def flush(): # Wait until every bus has transmitted everything
+        for bus in Ctrl.buses: bus.uart.flush()
+
+    def calls(name, fn): # Time it & count the round trips to the pigpio daemon
+        calls, switched = pi.calls, switches()
+        report(name, timed(fn))
+        print("    pigpio calls %.1f, direction switches %.1f per transaction" % ((pi.calls - calls) / count,
+              (switches() - switched) / count))
+
+    calls("POS_READ", lambda i: Ctrl.serial_servo_read_cmd(pi, i % 18 + 1, config.BS_POS_READ))
+    # Writes are timed until the last byte has left the UART
+    calls("MOVE_TIME_WRITE", lambda i: (Ctrl.serial_servo_write_cmd(pi, i % 18 + 1,
+          config.BS_MOVE_TIME_WRITE, 500, 100), flush()))
+    calls("Leg.set_pos", lambda i: (legs[i % 6].set_pos((500, 500, 500)), flush()))
+    calls("POS_READ then MOVE_TIME_WRITE", lambda i: (Ctrl.serial_servo_read_cmd(pi, i % 18 + 1,
+          config.BS_POS_READ), Ctrl.serial_servo_write_cmd(pi, i % 18 + 1, config.BS_MOVE_TIME_WRITE, 500, 100),
+          flush()))
+    cmds = [(id, config.BS_MOVE_TIME_WRITE, 500, 100) for id in range(1, 19)]
+    report("18 joint write_many", timed(lambda i: (Ctrl.serial_servo_write_many(pi, cmds), flush())))
+    emulator.servos[18].dead = True # A servo that doesn't answer
+    report("POS_READ dead servo", timed(lambda i: Ctrl.serial_servo_read_cmd(pi, 18, config.BS_POS_READ)))
+    print("Frames %d  replies %d  unheard bytes %d  pigpio calls %d" % (emulator.frames, emulator.replies,
+          emulator.unheard, pi.calls))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="LX-224HV bus servo emulator")
+    parser.add_argument("--pty", action="store_true", help="serve the emulator on a pseudo terminal")
+    parser.add_argument("--count", type=int, default=200, help="transactions of each kind to benchmark")
+    parser.add_argument("--call-latency", type=float, default=0.0001,
+                        help="emulated round trip to the pigpio daemon, in seconds")
+    args = parser.parse_args()
+
+    if args.pty:
+        link = Pty_Link(Servo_Emulator())
+        print("Emulated servos on", link.name)
+        print("Run the robot code with SPIDERPI_UART=" + link.name)
+        while True: time.sleep(1)
+    else:
+        benchmark(args.count, args.call_latency)
@@ -0,0 +1,144 @@
+#!/usr/bin/python3
+# encoding: utf-8
+# Copyright ians.moyes@gmail.com
+
+# Class to poll servo health in the background, within a fixed share of the bus time.
+# Readings are kept in a ring buffer so the latest values can be had without touching the bus.
+
+import threading # Standard multi-tasking library
+import time # Standard library of time, diary & calendar functions
+import numpy as np # Numerical array library
+import config # Bus Servo protocol definitions
+import RPiExpCom as Ctrl # Raspberry Pi expansion board communication driver
+import BusWorker # Transaction priorities
+
+# The readings collected from each servo, in the order they are stored
+metric_cmds = (config.BS_TEMP_READ, config.BS_VIN_READ, config.BS_POS_READ, config.BS_LED_ERROR_READ)
+metric_names = ("temp", "vin", "pos", "LED_err")
+
+class Telemetry_Poller():
+    ''' This is a class to define a thread which reads every metric from every servo in turn.
+    After each read it rests long enough to keep its use of the bus within the budget.
+    values[servo, metric, sample] & times[servo, metric, sample] hold the last depth readings
+    '''
+
+    def __init__(self, pi, ids=None, budget=0.1, depth=256, worker=None):
+        '''
+        :param pi: the Raspberry Pi
+        :param ids: servo IDs to poll. Default every servo
+        :param budget: share of the bus time the poller may use. 0.1 = 10%
+        :param depth: number of readings kept for each servo & metric
+        :param worker: BusWorker.Bus_Worker to queue reads through, or None to use the bus directly
+        '''
+
+        self.pi = pi # Attach the poller to the Raspberry Pi
+        if ids is None: ids = range(1, config.BS_num_servos + 1) # Servos are 1 indexed
+        self.ids = tuple(ids)
+        self.budget = budget
+        self.depth = depth
+        self.worker = worker
+        shape = (len(self.ids), len(metric_cmds), depth)
+        self.values = np.full(shape, np.nan) # Ring buffer of readings. NaN = no reading
+        self.times = np.full(shape, np.nan) # time.monotonic() of each reading
+        self.count = np.zeros(shape[:2], dtype=np.int64) # Readings taken for each servo & metric
+        self.errors = np.zeros(shape[:2], dtype=np.int64) # Failed reads for each servo & metric
+        self.busy = 0.0 # Total time spent on the bus, in seconds
+        self.started = None # When polling started
+        self.halt = threading.Event() # Set to stop the thread
+        self.thread = None
+
+    def start(self):
+        '''
+        Start polling in the background
+        '''
+
+        self.halt.clear()
+        self.started = time.monotonic()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        '''
+        Stop polling once the read in progress has finished
+        '''
+
+        self.halt.set()
+        if self.thread is not None: self.thread.join()
+
+    def read(self, id, r_cmd):
+        '''
+        Read one metric from one servo
+        :return: Data returned from the servo or error code
+        '''
+
+        if self.worker is None: return Ctrl.serial_servo_read_cmd(self.pi, id, r_cmd)
+        return self.worker.read_cmd(id, r_cmd, priority=BusWorker.TELEMETRY).result()
+
+    def run(self): # This is the code for the multi-tasking thread
+        while not self.halt.is_set():
+            for servo, id in enumerate(self.ids): # Round robin every servo
+                for metric, r_cmd in enumerate(metric_cmds): # & every metric
+                    start = time.monotonic()
+                    value = self.read(id, r_cmd)
+                    now = time.monotonic()
+                    if type(value) == str: # Error code
+                        self.errors[servo, metric] += 1
+                    else:
+                        slot = self.count[servo, metric] % self.depth # Overwrite the oldest reading
+                        self.values[servo, metric, slot] = value
+                        self.times[servo, metric, slot] = now
+                        self.count[servo, metric] += 1
+                    busy = now - start
+                    self.busy += busy
+                    # Rest so that busy / (busy + rest) stays within the budget
+                    if self.halt.wait(busy * (1 - self.budget) / self.budget): return
+
+    @property # Allows method to be used like a variable without ()
+    def utilisation(self):
+        '''
+        Share of the bus time the poller has actually used since it started
+        '''
+
+        if self.started is None: return 0.0
+        return self.busy / max(time.monotonic() - self.started, 1e-9)
+
+    def latest(self):
+        '''
+        The most recent reading of every metric from every servo. Doesn't touch the bus
+        :return: (values[servo, metric], times[servo, metric]). NaN where there is no reading yet
+        '''
+
+        slot = ((self.count - 1) % self.depth)[..., np.newaxis] # Index of the newest reading
+        values = np.take_along_axis(self.values, slot, axis=2)[..., 0]
+        times = np.take_along_axis(self.times, slot, axis=2)[..., 0]
+        return values, times
+
+    def history(self, id, metric):
+        '''
+        The readings kept for one servo & metric, oldest first
+        :param id: servo ID
+        :param metric: name from metric_names, e.g. "temp"
+        :return: (values, times) arrays
+        '''
+
+        servo = self.ids.index(id)
+        metric = metric_names.index(metric)
+        count = self.count[servo, metric]
+        order = np.arange(max(count - self.depth, 0), count) % self.depth # Oldest to newest
+        return self.values[servo, metric, order], self.times[servo, metric, order]
+
+if __name__ == '__main__':
+    import pigpio # Standard Raspberry Pi GPIO library
+    pi = pigpio.pi() # Create a Raspberry Pi object
+    Ctrl.portinit(pi) # Initialise the read/write switch
+
+    poller = Telemetry_Poller(pi) # Poll every servo within 10% of the bus
+    poller.start()
+    for i in range(5):
+        time.sleep(2)
+        values, times = poller.latest()
+        for metric, name in enumerate(metric_names):
+            print(name, values[:, metric])
+        print("Bus utilisation", poller.utilisation)
+    poller.stop()
+    print("Telemetry tests complete!")
@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+# encoding: utf-8
+# Copyright ians.moyes@gmail.com
+
+# Smooth joint moves. A move is broken into waypoints a tick apart that follow a minimum jerk
+# (or cubic) curve, so the servos speed up & slow down gently instead of starting & stopping
+# at full speed. Every joint uses the same curve over the same time, so they all arrive together,
+# & the time is stretched if the joint that travels furthest would go faster than the servos can.
+#
+#     waypoints, step = plan(start, end, 300) # start & end are arrays of servo positions
+#     play(pi, ids, waypoints, step)
+
+import math # Standard library of mathematical functions
+import time # Standard library of time, diary & calendar functions
+import numpy as np # Numerical array library
+import config # Bus Servo protocol definitions
+from SerialServoClass import Serial_Servo as Servo # Bus Serial Servo control class
+
+all_ids = np.arange(1, config.BS_num_servos + 1).reshape(6, 3) # Servo ID of each leg & joint
+
+def min_jerk(s):
+    '''
+    :param s: 0 ~ 1 through the move
+    :return: 0 ~ 1 of the distance travelled. Speed & acceleration are 0 at both ends
+    '''
+
+    return s**3 * (10 - 15 * s + 6 * s**2)
+
+def cubic(s):
+    '''
+    :param s: 0 ~ 1 through the move
+    :return: 0 ~ 1 of the distance travelled. Speed is 0 at both ends
+    '''
+
+    return s**2 * (3 - 2 * s)
+
+def linear(s):
+    return s
+
+# Curve name: (function, peak speed as a multiple of the average speed)
+profiles = {"min_jerk": (min_jerk, 1.875), "cubic": (cubic, 1.5), "linear": (linear, 1.0)}
+
+def min_time(start, end, profile="min_jerk", max_speed=config.BS_max_speed):
+    '''
+    :param start: array of servo positions
+    :param end: array of servo positions
+    :param profile: name from profiles
+    :param max_speed: fastest a servo may turn, in positions per second
+    :return: quickest time for the move in mS, without any joint going faster than max_speed
+    '''
+
+    distance = np.abs(np.asarray(end, dtype=float) - np.asarray(start, dtype=float)).max(initial=0)
+    return 1000 * profiles[profile][1] * distance / max_speed
+
+def plan(start, end, tim=None, rate=50, profile="min_jerk", max_speed=config.BS_max_speed):
+    '''
+    Work out the waypoints of a move for every joint at once
+    :param start: array of servo positions, any shape. e.g. [6, 3] for every joint
+    :param end: array of servo positions, the same shape
+    :param tim: time for the move in mS. None = as fast as the servos allow. Stretched if too short
+    :param rate: waypoints per second
+    :param profile: name from profiles
+    :param max_speed: fastest a servo may turn, in positions per second
+    :return: (waypoints, step)
+             waypoints: array [steps, ...] of whole servo positions. The last one is end
+             step: time between waypoints in mS
+    '''
+
+    start = np.asarray(start, dtype=float)
+    end = np.asarray(end, dtype=float)
+    shortest = min_time(start, end, profile, max_speed)
+    tim = shortest if tim is None else max(tim, shortest)
+    steps = max(1, math.ceil(tim * rate / 1000))
+    s = np.arange(1, steps + 1) / steps
+    s = s.reshape((steps,) + (1,) * start.ndim) # To apply to every joint
+    waypoints = np.rint(start + profiles[profile][0](s) * (end - start)).astype(np.int64)
+    step = math.ceil(tim / steps)
+    # Rounding to whole positions can make a step a little longer, allow for it
+    jumps = np.abs(np.diff(np.concatenate((np.rint(start)[np.newaxis], waypoints)), axis=0)).max(initial=0)
+    step = max(step, math.ceil(1000 * jumps / max_speed))
+    return waypoints, step
+
+def play(pi, ids, waypoints, step, w_cmd=Servo.MOVE_TIME_WRITE):
+    '''
+    Send the waypoints a step apart. Each one is a single transmission on each bus
+    :param pi: the Raspberry Pi
+    :param ids: array of servo IDs, the same shape as a waypoint
+    :param waypoints: array [steps, ...] from plan
+    :param step: time between waypoints in mS
+    :param w_cmd: MOVE_TIME_WRITE, or MOVE_TIME_WAIT_WRITE to stage the last waypoint for a trigger
+    :return: True = Success or error code
+    '''
+
+    ids = np.asarray(ids).ravel()
+    next_step = time.monotonic()
+    for n, waypoint in enumerate(waypoints):
+        cmd = w_cmd if n == len(waypoints) - 1 else Servo.MOVE_TIME_WRITE
+        result = Servo.write_many(pi, [(int(id), cmd, int(pos), step) for id, pos in zip(ids, np.ravel(waypoint))])
+        if result != True: return result
+        next_step += step / 1000
+        wait = next_step - time.monotonic()
+        if wait > 0: time.sleep(wait)
+    return True
+
+def move(pi, start, end, tim=None, ids=all_ids, rate=50, profile="min_jerk"):
+    '''
+    Move joints smoothly from start to end, arriving together
+    :param pi: the Raspberry Pi
+    :param start: array of servo positions where the joints are now, the same shape as ids
+    :param end: array of servo positions to move to
+    :param tim: time for the move in mS. None = as fast as the servos allow. Stretched if too short
+    :param ids: array of servo IDs. Default every joint of the hexapod, [6, 3]
+    :param rate: waypoints per second
+    :param profile: name from profiles
+    :return: True = Success or error code
+    '''
+
+    waypoints, step = plan(start, end, tim, rate, profile)
+    return play(pi, ids, waypoints, step)
+
+if __name__ == '__main__':
+    import pigpio # Standard Raspberry Pi GPIO library
+    import RPiExpCom as Ctrl # Raspberry Pi expansion board communication driver
+    pi = pigpio.pi() # Create a Raspberry Pi object
+    Ctrl.portinit(pi) # Initialise the read/write switch
+
+    start = np.full((6, 3), config.BS_default_pos)
+    end = start + np.array((100, -200, 300)) # Each joint travels a different distance
+    print("Shortest move %.0f mS" % min_time(start, end))
+    waypoints, step = plan(start, end, 100) # Too quick, it's stretched
+    print(len(waypoints), "waypoints", step, "mS apart")
+    print(move(pi, start, end))
+    print(move(pi, end, start, 1000, profile="cubic"))
+    print("Trajectory tests complete!")
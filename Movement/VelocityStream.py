@@ -0,0 +1,160 @@
+#!/usr/bin/python3
+# encoding: utf-8
+# Copyright ians.moyes@gmail.com
+
+# Class to drive Bus Servos as continuously rotating motors, e.g. wheels or a scanner turret.
+# Speed setpoints are streamed to the servos at a fixed rate in one transmission per bus.
+# Speed changes are limited to a maximum acceleration, & the servos are stopped if the
+# setpoints stop arriving.
+#
+#     wheels = Velocity_Stream(pi, (19, 20))
+#     wheels.start()
+#     wheels.set(19, 500) # Call at least every wheels.timeout seconds
+#     wheels.stop() # Servos stop & go back to servo mode
+
+import threading # Standard multi-tasking library
+import time # Standard library of time, diary & calendar functions
+import RPiExpCom as Ctrl # Raspberry Pi expansion board communication driver
+from SerialServoClass import Serial_Servo as Servo # Bus Serial Servo control class
+
+class Velocity_Stream():
+    ''' This is a class to define a thread which sends speed setpoints to servos in motor mode.
+    Only speeds that have changed are sent, apart from a refresh now & then in case a frame was lost
+    '''
+
+    def __init__(self, pi, ids, rate=50, max_accel=4000, timeout=0.25, refresh=0.5):
+        '''
+        :param pi: the Raspberry Pi
+        :param ids: IDs of the servos to drive
+        :param rate: setpoints sent per second
+        :param max_accel: fastest change of speed, in speed units per second. None = no limit
+        :param timeout: watchdog. Servos are stopped if no setpoint arrives for this long, in seconds
+        :param refresh: every speed is sent again after this long, in seconds
+        '''
+
+        self.pi = pi # Attach the stream to the Raspberry Pi
+        self.servos = {id: Servo(pi, id) for id in ids}
+        self.period = 1 / rate
+        self.max_accel = max_accel
+        self.timeout = timeout
+        self.refresh = refresh
+        self.lock = threading.Lock()
+        self.target = {id: 0 for id in ids} # Speeds asked for
+        self.speed = {id: 0.0 for id in ids} # Speeds being commanded, after acceleration limiting
+        self.sent = {id: None for id in ids} # Last speed sent to each servo
+        self.fed = time.monotonic() # When the watchdog was last fed
+        self.last_refresh = 0.0
+        # Counters
+        self.frames = 0 # Setpoint frames sent
+        self.overruns = 0 # Ticks that started late
+        self.watchdog_stops = 0 # Times the watchdog stopped the servos
+        self.halt = threading.Event() # Set to stop the thread
+        self.thread = None
+
+    def set(self, id, speed):
+        '''
+        Ask a servo to turn at a speed. Also feeds the watchdog
+        :param id: servo ID
+        :param speed: -1000 ~ 1000. Negative speeds turn the other way
+        '''
+
+        self.set_many({id: speed})
+
+    def set_many(self, speeds):
+        '''
+        Ask several servos to turn at new speeds. Also feeds the watchdog
+        :param speeds: dictionary of servo ID: speed
+        '''
+
+        with self.lock:
+            for id, speed in speeds.items():
+                self.target[id] = min(max(speed, Servo.cont_speed[0]), Servo.cont_speed[1])
+            self.fed = time.monotonic()
+
+    def feed(self):
+        '''
+        Keep the servos turning at their current speeds
+        '''
+
+        self.fed = time.monotonic()
+
+    def start(self):
+        '''
+        Start streaming in the background
+        '''
+
+        self.halt.clear()
+        self.fed = time.monotonic()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        '''
+        Stop streaming, stop the servos & put them back in servo mode
+        '''
+
+        self.halt.set()
+        if self.thread is not None: self.thread.join()
+        Servo.send_many(self.pi, [(id, Servo.MOTOR_MODE_WRITE, 0, 0) for id in self.servos])
+        for id in self.servos: self.target[id], self.speed[id], self.sent[id] = 0, 0.0, None
+
+    def tick(self, now):
+        '''
+        Work out the speeds for this tick & send the ones that have changed
+        :return: True = Success or error code
+        '''
+
+        with self.lock:
+            if now - self.fed > self.timeout and any(self.target.values()): # Nobody's driving
+                for id in self.target: self.target[id] = 0
+                for id in self.speed: self.speed[id] = 0.0 # Stop now, don't ramp down
+                self.watchdog_stops += 1
+            step = None if self.max_accel is None else self.max_accel * self.period
+            for id, target in self.target.items(): # Accelerate towards the target speeds
+                change = target - self.speed[id]
+                if step is not None: change = min(max(change, -step), step)
+                self.speed[id] += change
+        refresh = now - self.last_refresh >= self.refresh
+        if refresh: self.last_refresh = now
+        cmds = []
+        for id, servo in self.servos.items():
+            speed = int(round(self.speed[id]))
+            if refresh or speed != self.sent[id]:
+                cmds.append(servo.speed_cmd(speed))
+                self.sent[id] = speed
+        if not cmds: return True
+        self.frames += len(cmds)
+        return Servo.send_many(self.pi, cmds) # One transmission on each bus
+
+    def run(self): # This is the code for the multi-tasking thread
+        next_tick = time.monotonic()
+        while not self.halt.is_set():
+            self.tick(time.monotonic())
+            next_tick += self.period
+            wait = next_tick - time.monotonic()
+            if wait < 0: # Running late, don't try to catch up
+                self.overruns += 1
+                next_tick = time.monotonic()
+                wait = 0
+            if self.halt.wait(wait): break
+
+if __name__ == '__main__':
+    import sys # Standard system library, for the command line
+    import pigpio # Standard Raspberry Pi GPIO library
+    pi = pigpio.pi() # Create a Raspberry Pi object
+    Ctrl.portinit(pi) # Initialise the read/write switch
+
+    # Servos 1 ~ 18 are the leg joints, so never spin them by default
+    ids = tuple(int(arg) for arg in sys.argv[1:]) or (19, 20) # e.g. python3 VelocityStream.py 19 20
+    stream = Velocity_Stream(pi, ids) # The servos as motors
+    stream.start()
+    for speed in (300, 1000, -1000, 0):
+        for i in range(10): # Keep feeding the watchdog
+            for id in ids: stream.set(id, speed)
+            time.sleep(0.1)
+        print("Speed", speed, "mode", [stream.servos[id].motor_mode for id in ids])
+    for id in ids: stream.set(id, 500) # Then stop feeding it
+    time.sleep(0.5)
+    print("Watchdog stops", stream.watchdog_stops, "frames sent", stream.frames, "overruns", stream.overruns)
+    stream.stop()
+    print("Velocity stream tests complete!")
@@ -43,7 +43,9 @@ they do not perform the command nor return a response message, (except in the ca
 of reading the Bus Servo ID number, in that case the servo returns it's servo ID. In this case,
 only 1 servo can be attached to the bus at once. Please refer to the following instructions
 for details) to prevent bus conflict.
-
+'''
+BS_broadcast_id = 254 # 0xFE. Every Bus Servo obeys commands sent to this ID, but none of them reply
+'''
 Length(data): Equal to the length of the data to be sent (including its own one byte).
 That is, the length of the data plus 3 is equal to the length of this command packet,
 including the header and checksum.
@@ -418,6 +420,9 @@ BS_LED_ERROR_READ        36       4
 '''
 
 BS_inactive_rcmds = (1,3,4,5,6,7,9,10,11,12,13,15,16,17,18,20,22,24,29,31,33,35)
+# Data lengths of the replies to each read command, from table 4.
+# -1 means no reply. Tuple is 0 indexed. commands are 1 indexed.
+BS_reply_lengths = (-1,7,-1,-1,-1,-1,-1,7,-1,-1,-1,-1,-1,4,-1,-1,-1,-1,4,-1,7,-1,7,-1,4,4,5,5,-1,7,-1,4,-1,4,-1,4)
 
 '''
 Table 4 lists the commands that the Bus Servo returns to the host computer. These commands
@@ -590,6 +595,21 @@ BS_Vin_limits = (9000, 12600) # Voltage limits specified in mV
 # servos is  9-12.6V
 BS_temp_limits = (50, 85) # Temperature limit in °C. The limit can be set between 50 ~ 100°C.
 BS_default_pos = 500 # The default position for 50% rotation
+# Servo buses. (UART, RX_CON GPIO, TX_CON GPIO, IDs of the servos on the bus)
+# The first bus is the expansion board, which also carries the TrinketM0 LED frames.
+# The Pi 4 has UART2 ~ UART5 as well. Each extra bus needs its own half duplex transceiver &
+# a pair of GPIOs to switch it. e.g. port legs on the expansion board & starboard legs on UART3,
+# whose device name depends on the order the dtoverlays are loaded
+# BS_buses = (("/dev/ttyAMA0", 17, 27, (1,2,3,4,5,6,7,8,9)),
+#             ("/dev/ttyAMA1", 22, 23, (10,11,12,13,14,15,16,17,18)))
+BS_buses = (("/dev/ttyAMA0", 17, 27, (1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,17,18)),)
+
+# Hexapod geometry
+# Shoulder joints from the centre of the body in mm, X forward, Y to port. Legs 0 ~ 5 (port rear first)
+HX_shoulders = ((-43.5, 126.2), (0.0, 91.5), (43.5, 126.2), (-43.5, -126.2), (0.0, -91.5), (43.5, -126.2))
+# Standing toe position from each shoulder. X forward, Y out, Z down. Every joint is well inside its
+# rotation limits, standing & walking. Hexapod.stand_pos (0, 100, 70) needs an ankle position of 1066
+HX_stand_pos = (0, 140, 100)
 
 # PWM servo parameters
 PWM_servo_type = "PWM_generic" # Manufacturer/model of the servo